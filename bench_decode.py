@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Time the scope decoding of one unit refresh (ADC scope plus four spectrum scopes):
+   the old struct.unpack / np.array path against snapdecode.
+
+       python bench_decode.py --adc-bytes 16384 --channels 4096 --repeat 50
+"""
+
+from __future__ import print_function
+
+import argparse, struct, timeit
+
+import numpy as np
+
+import snapdecode
+
+STOKES = ('AA', 'BB', 'CR', 'CI')
+
+
+def legacy_split_snapshot(snap):
+    len = snap['length']
+    all = struct.unpack('%db'%len, snap['data'])
+    segments = np.array(all).reshape(-1, 4)
+    p0 = segments[0::2, :].flatten()
+    p1 = segments[1::2, :].flatten()
+    return p0, p1
+
+
+def legacy_refresh(adc, specs):
+    adc0, adc1 = legacy_split_snapshot(adc)
+    return [np.array(struct.unpack('>%di' % (s['length']/4), s['data'])) for s in specs]
+
+
+def snapdecode_refresh(adc, specs):
+    adc0, adc1 = snapdecode.decode('zdok0_scope', adc)
+    return [snapdecode.decode('u0_x4_vacc_scope_' + name, s) for name, s in zip(STOKES, specs)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--adc-bytes', type=int, default=16384, help='bytes captured by the ADC scope')
+    parser.add_argument('--channels', type=int, default=4096, help='channels per spectrum scope')
+    parser.add_argument('--repeat', type=int, default=50, help='refreshes to time')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    adc_data = rng.randint(-128, 128, args.adc_bytes).astype(np.int8).tobytes()
+    adc = {'length': len(adc_data), 'data': adc_data}
+    specs = []
+    for name in STOKES:
+        data = rng.randint(0, 2**30, args.channels).astype('>i4').tobytes()
+        specs.append({'length': len(data), 'data': data})
+
+    # Same numbers out of both paths
+    old, new = legacy_refresh(adc, specs), snapdecode_refresh(adc, specs)
+    assert all((o == n).all() for o, n in zip(old, new))
+    assert all((o == n).all() for o, n in zip(legacy_split_snapshot(adc), snapdecode.decode('zdok0_scope', adc)))
+
+    t_old = min(timeit.repeat(lambda: legacy_refresh(adc, specs), number=args.repeat, repeat=3)) / args.repeat
+    t_new = min(timeit.repeat(lambda: snapdecode_refresh(adc, specs), number=args.repeat, repeat=3)) / args.repeat
+    print('%i ADC bytes + 4 x %i channels per refresh' % (args.adc_bytes, args.channels))
+    print('struct.unpack + np.array: %9.3f ms' % (t_old * 1e3))
+    print('snapdecode:               %9.3f ms' % (t_new * 1e3))
+    print('speedup:                  %9.1f x' % (t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Compare the threaded FpgaClient with the asyncio AsyncFpgaClient.
+
+   Both clients read a register over and over from a set of roachsim boards (run in a separate
+   process, with a configurable reply latency). For each board
+   count the script reports aggregate requests per second and the memory and threads each
+   connection costs.
+
+       python3 bench_katcp.py --boards 1 13 100 --requests 2000 --rtt 0.0005
+
+   The threaded client needs a katcp package that runs under Python 3; without one only the
+   asyncio client is measured.
+"""
+
+from __future__ import print_function
+
+import argparse, asyncio, multiprocessing, sys, threading, time, tracemalloc
+
+import katcp_async, roachsim
+
+
+def serve_boards(count, rtt, ports):
+    servers = roachsim.start_boards(count, latency=rtt)
+    for server in servers:
+        ports.put(server.port)
+    while True:
+        time.sleep(3600)
+
+
+def start_boards(count, rtt):
+    ports = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=serve_boards, args=(count, rtt, ports), daemon=True)
+    proc.start()
+    return proc, [ports.get(timeout=30) for i in range(count)]
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * 4096
+
+
+def bench_async(ports, requests, window):
+    async def run():
+        tracemalloc.start()
+        heap0, rss0 = tracemalloc.get_traced_memory()[0], rss()
+        clients = [katcp_async.AsyncFpgaClient('127.0.0.1', port) for port in ports]
+        await asyncio.gather(*(c.connect() for c in clients))
+        await asyncio.gather(*(c.read_uint('rcs_ver') for c in clients))
+        heap, rss1 = tracemalloc.get_traced_memory()[0] - heap0, rss() - rss0
+        tracemalloc.stop()
+
+        async def drive(client):
+            for start in range(0, requests, window):
+                await asyncio.gather(*(client.read_uint('rcs_ver') for i in range(min(window, requests - start))))
+
+        t0 = time.time()
+        await asyncio.gather(*(drive(c) for c in clients))
+        elapsed = time.time() - t0
+        await asyncio.gather(*(c.stop() for c in clients))
+        return elapsed, heap, rss1, 0
+    return asyncio.run(run())
+
+
+def bench_threaded(ports, requests, window):
+    import katcp_wrapper
+    tracemalloc.start()
+    heap0, rss0, threads0 = tracemalloc.get_traced_memory()[0], rss(), threading.active_count()
+    clients = [katcp_wrapper.FpgaClient('127.0.0.1', port) for port in ports]
+    for c in clients:
+        c.wait_connected(10)
+        c.read_uint('rcs_ver')
+    heap, rss1 = tracemalloc.get_traced_memory()[0] - heap0, rss() - rss0
+    threads = threading.active_count() - threads0
+    tracemalloc.stop()
+
+    def drive(client):
+        # Same number of requests in flight as the asyncio client, through a pipelined batch
+        for start in range(0, requests, window):
+            with client.batch() as b:
+                for i in range(min(window, requests - start)):
+                    b.read_uint('rcs_ver')
+
+    workers = [threading.Thread(target=drive, args=(c,)) for c in clients]
+    t0 = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.time() - t0
+    for c in clients:
+        c.stop()
+    return elapsed, heap, rss1, threads
+
+
+def report(label, boards, requests, result):
+    elapsed, heap, rss_delta, threads = result
+    print('%-9s %6i %10.0f %13.1f %13.1f %9.1f' % (label, boards, boards * requests / elapsed,
+          heap / 1024.0 / boards, rss_delta / 1024.0 / boards, float(threads) / boards))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    p.add_argument('--boards', type=int, nargs='+', default=[1, 13, 100])
+    p.add_argument('--requests', type=int, default=1000, help='reads per board')
+    p.add_argument('--rtt', type=float, default=0.0005, help='simulated reply latency in seconds')
+    p.add_argument('--window', type=int, default=32, help='requests in flight per board')
+    p.add_argument('--no-threaded', action='store_true', help='only measure the asyncio client')
+    args = p.parse_args()
+
+    threaded = not args.no_threaded
+    if threaded:
+        try:
+            import katcp_wrapper
+        except ImportError as e:
+            print('Threaded client unavailable (%s), measuring AsyncFpgaClient only.' % e)
+            threaded = False
+
+    print('%-9s %6s %10s %13s %13s %9s' % ('client', 'boards', 'req/s', 'heap KiB/conn', 'rss KiB/conn', 'thr/conn'))
+    for boards in args.boards:
+        proc, ports = start_boards(boards, args.rtt)
+        try:
+            report('asyncio', boards, args.requests, bench_async(ports, args.requests, args.window))
+            if threaded:
+                report('threaded', boards, args.requests, bench_threaded(ports, args.requests, args.window))
+        finally:
+            proc.terminate()
+            proc.join()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
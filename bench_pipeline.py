@@ -0,0 +1,197 @@
+#!/usr/bin/env python2
+"""Time every stage of the monitor refresh (one unit: ADC scope plus four spectrum scopes)
+   against a roachsim board, for each bitstream in bof/ and each simulated round trip time.
+
+       python bench_pipeline.py --rtt 0 0.0005 0.002 --frames 50 -o bench.json
+       python bench_pipeline.py --baseline bench.json        # flag stages that got slower
+
+   The stages are the calls the monitor (mbc.MainForm.get_mb_scopes) makes for every refresh:
+
+       lock     taking and releasing the sys_scratchpad scope lock (mbrec.scope_lock)
+       arm      FpgaClient.snapshot_get_many writing the ctrl registers of the five scopes
+       poll     FpgaClient.snapshot_get_many polling their status registers until all have captured
+       read     FpgaClient.snapshot_get_many reading their status registers and BRAMs
+       decode   snapdecode of the ADC and spectrum captures
+       plot     mbv.Plotter.update_plots on an offscreen widget, skipped without pyqtgraph
+
+   Reports frames/s and p50/p99 latency per stage and saves them, with the git revision, to JSON.
+"""
+
+from __future__ import print_function
+
+import argparse, json, multiprocessing, os, platform, subprocess, sys, time
+
+import numpy as np
+
+import katcp_wrapper
+import mbrec
+import roachsim
+import snapdecode
+
+STAGES = ('lock', 'arm', 'poll', 'read', 'decode', 'plot')
+STOKES = ('AA', 'BB', 'CR', 'CI')
+LOCK_ID = 0xbe4c1                # scope lock id of the benchmark client
+REGRESSION = 1.10               # p50 ratio to the baseline that counts as slower
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def serve_board(rtt, ports):
+    server = roachsim.RoachServer(roachsim.Board('bench'), latency=rtt).start()
+    ports.put(server.port)
+    while True:
+        time.sleep(3600)
+
+
+def start_board(rtt):
+    ports = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=serve_board, args=(rtt, ports))
+    proc.daemon = True
+    proc.start()
+    return proc, ports.get(timeout=30)
+
+
+def bitstreams(directory):
+    return sorted(f[:-len('.gz')] for f in os.listdir(directory) if f.endswith('.bof.gz'))
+
+
+def make_plotter():
+    """Return an mbv.Plotter drawing offscreen, or None when pyqtgraph is missing."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        import pyqtgraph as pg
+        from mbv import Plotter
+    except ImportError as e:
+        print('plot stage skipped: %s' % e)
+        return None
+    pg.mkQApp()
+    glw = pg.GraphicsLayoutWidget()
+    glw.resize(640, 480)
+    return Plotter(glw)
+
+
+def frame(fpga, unit, plotter, times):
+    """Refresh one unit, appending the seconds spent in each stage to times[stage]."""
+    adc_name = 'zdok%d_scope' % unit
+    scope_names = ['u%d_x4_vacc_scope_%s' % (unit, s) for s in STOKES]
+
+    capture = {}
+    t0 = timer()
+    with mbrec.scope_lock(fpga, LOCK_ID):
+        t1 = timer()
+        snaps = fpga.snapshot_get_many([(adc_name, {'man_trig': True})] + scope_names,
+                                       man_valid=True, wait_period=10, timings=capture)
+        t2 = timer()
+    t3 = timer()
+    adc = snapdecode.decode(adc_name, snaps[adc_name])
+    spec = [snapdecode.decode(name, snaps[name]) for name in scope_names]
+
+    t4 = timer()
+    if plotter is not None:
+        plotter.update_plots(adc, spec, (1, 1, 1, 1))
+        plotter.glw.scene().update()
+
+    t5 = timer()
+    times['lock'].append((t1 - t0) + (t3 - t2))
+    for stage in ('arm', 'poll', 'read'):
+        times[stage].append(capture[stage])
+    times['decode'].append(t4 - t3)
+    times['plot'].append(t5 - t4)
+    times['frame'].append(t5 - t0)
+
+
+def summarize(seconds):
+    seconds = np.asarray(seconds)
+    return {'p50_ms': float(np.percentile(seconds, 50) * 1e3),
+            'p99_ms': float(np.percentile(seconds, 99) * 1e3),
+            'mean_ms': float(seconds.mean() * 1e3),
+            'fps': float(1 / seconds.mean()) if seconds.mean() > 0 else None}
+
+
+def run(bitstream, rtt, frames, unit, acc_len, plotter):
+    proc, port = start_board(rtt)
+    fpga = katcp_wrapper.FpgaClient('127.0.0.1', port, timeout=10)
+    try:
+        if not fpga.wait_connected(10):
+            raise RuntimeError('Can not connect to the simulated board on port %d' % port)
+        fpga.progdev(bitstream)
+        fpga.write_int('u%d_acc_len' % unit, acc_len)
+        times = dict((stage, []) for stage in STAGES + ('frame',))
+        frame(fpga, unit, plotter, times)                   # warm up
+        times = dict((stage, []) for stage in STAGES + ('frame',))
+        for i in range(frames):
+            frame(fpga, unit, plotter, times)
+    finally:
+        fpga.stop()
+        proc.terminate()
+        proc.join()
+    stages = dict((stage, summarize(times[stage])) for stage in STAGES if plotter is not None or stage != 'plot')
+    return {'bitstream': bitstream, 'channels': roachsim.spec_channels(bitstream), 'rtt': rtt,
+            'frames': frames, 'fps': summarize(times['frame'])['fps'], 'frame': summarize(times['frame']),
+            'stages': stages}
+
+
+def report(result, baseline=None):
+    print('\n%s (%i channels), rtt %.1f ms: %.1f frames/s' % (result['bitstream'], result['channels'],
+          result['rtt'] * 1e3, result['fps']))
+    print('  %-8s %9s %9s %9s' % ('stage', 'p50 ms', 'p99 ms', 'fps'))
+    for stage in STAGES + ('frame',):
+        s = result['frame'] if stage == 'frame' else result['stages'].get(stage)
+        if s is None:
+            print('  %-8s %9s' % (stage, 'skipped'))
+            continue
+        line = '  %-8s %9.3f %9.3f %9.1f' % (stage, s['p50_ms'], s['p99_ms'], s['fps'])
+        if baseline is not None:
+            old = baseline['frame'] if stage == 'frame' else baseline['stages'].get(stage)
+            if old and old['p50_ms'] > 0:
+                ratio = s['p50_ms'] / old['p50_ms']
+                line += '   %5.2fx baseline%s' % (ratio, '  SLOWER' if ratio > REGRESSION else '')
+        print(line)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    p.add_argument('--bof-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bof'),
+                   help='directory whose *.bof.gz bitstreams are benchmarked')
+    p.add_argument('--bitstreams', nargs='+', help='bitstreams to benchmark instead of those in --bof-dir')
+    p.add_argument('--rtt', type=float, nargs='+', default=[0, 0.0005, 0.002], help='simulated reply latencies in seconds')
+    p.add_argument('--frames', type=int, default=50, help='refreshes timed per configuration')
+    p.add_argument('--unit', type=int, default=0, choices=(0, 1))
+    p.add_argument('--acc-len', type=int, default=16, help='accumulation length programmed into the board')
+    p.add_argument('--no-plot', action='store_true', help='skip the plot stage')
+    p.add_argument('-o', '--output', help='JSON file to save the results to')
+    p.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+    args = p.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            for r in json.load(f)['results']:
+                baseline[(r['bitstream'], r['rtt'])] = r
+
+    plotter = None if args.no_plot else make_plotter()
+    results = []
+    for bitstream in args.bitstreams or bitstreams(args.bof_dir):
+        for rtt in args.rtt:
+            result = run(bitstream, rtt, args.frames, args.unit, args.acc_len, plotter)
+            report(result, baseline.get((bitstream, rtt)))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'revision': git_revision(), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'frames': args.frames, 'acc_len': args.acc_len, 'results': results}, f, indent=2)
+        print('\nSaved to %s' % args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
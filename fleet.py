@@ -0,0 +1,235 @@
+#!/usr/bin/env python2
+"""Run the same operation on many ROACH boards at once.
+
+   A Fleet keeps one FpgaClient per board for its whole lifetime (katcp reconnects them in the
+   background when a board drops off) plus one worker thread per board, so an operation on every
+   board costs about one board's latency:
+
+       fleet = Fleet(mbc.roach_list)
+       fleet.wait_connected(5)
+       versions = fleet.map(lambda f: f.read_uint('rcs_ver'), timeout=2)
+       for host, error in versions.errors.items():
+           print(host, 'failed:', error)
+
+   Operations on one board run in the order they were submitted. A board that is not connected
+   or that does not finish within the timeout is reported in the result instead of raising, so
+   one bad board never holds up the others.
+"""
+
+from __future__ import print_function
+
+import threading, logging, time, collections
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import katcp_wrapper
+
+log = logging.getLogger("katcp")
+
+
+class FleetError(RuntimeError):
+    """Raised by FleetResult.raise_for_errors() when the operation failed on one or more boards.
+
+       @param errors  Dictionary: host -> string describing the failure.
+       @param results  Dictionary: host -> return value for the boards that succeeded.
+       """
+    def __init__(self, errors, results):
+        self.errors = errors
+        self.results = results
+        RuntimeError.__init__(self, 'Failed on %i of %i boards:\n  %s'
+            % (len(errors), len(errors) + len(results), '\n  '.join('%s: %s' % e for e in errors.items())))
+
+
+class FleetResult(object):
+    """Outcome of Fleet.map(): return values of the boards that succeeded and errors of the others.
+
+       Both dictionaries keep the board order of the fleet.
+       """
+    def __init__(self):
+        self.results = collections.OrderedDict()
+        self.errors = collections.OrderedDict()
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def __getitem__(self, host):
+        try:
+            return self.results[host]
+        except KeyError:
+            raise KeyError('No result for %s: %s' % (host, self.errors.get(host, 'not in the fleet')))
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def raise_for_errors(self):
+        """Raise FleetError if any board failed, otherwise return the results dictionary."""
+        if self.errors:
+            raise FleetError(self.errors, self.results)
+        return self.results
+
+    def __str__(self):
+        lines = ['%s: %r' % item for item in self.results.items()]
+        lines += ['%s: FAILED %s' % item for item in self.errors.items()]
+        return '\n'.join(lines)
+
+
+class _Job(object):
+    """One operation queued on a board worker."""
+    __slots__ = ('fn', 'fpga', 'event', 'value', 'error')
+
+    def __init__(self, fn, fpga):
+        self.fn = fn
+        self.fpga = fpga
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.value = self.fn(self.fpga)
+        except Exception as e:
+            self.error = '%s: %s' % (type(e).__name__, e)
+        self.event.set()
+
+
+def _worker(jobs):
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job.run()
+
+
+class Fleet(object):
+    """Pooled FpgaClient connections to a set of boards.
+
+       @param hosts  List of strings: hosts to connect to.
+       @param port  Integer: KATCP port of every board.
+       @param timeout  Float: default per-board timeout of map(), also used for the individual requests.
+       @param logger  Object: Logger to log to.
+       @param cache  Boolean: give every client a FpgaRegisterCache.
+       """
+    def __init__(self, hosts, port=7147, timeout=10.0, logger=log, cache=False):
+        self._timeout = timeout
+        self._logger = logger
+        self.clients = collections.OrderedDict()
+        self._jobs = {}
+        self._workers = []
+        for host in hosts:
+            self.clients[host] = katcp_wrapper.FpgaClient(host, port, timeout=timeout, logger=logger, cache=cache)
+            self._jobs[host] = queue.Queue()
+            worker = threading.Thread(target=_worker, args=(self._jobs[host],), name='fleet-%s' % host)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __getitem__(self, host):
+        return self.clients[host]
+
+    def __iter__(self):
+        return iter(self.clients)
+
+    def __len__(self):
+        return len(self.clients)
+
+    @property
+    def hosts(self):
+        return list(self.clients)
+
+    def connected(self):
+        """Return the list of hosts that are currently connected."""
+        return [host for host, fpga in self.clients.items() if fpga.is_connected()]
+
+    def wait_connected(self, timeout=None):
+        """Wait until every board is connected or the timeout expires.
+
+           @param self  This object.
+           @param timeout  Float: seconds to wait in total, None to wait forever.
+           @return  List of strings: hosts still not connected.
+           """
+        deadline = None if timeout is None else time.time() + timeout
+        for fpga in self.clients.values():
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            fpga.wait_connected(remaining)
+        return [host for host in self.clients if host not in self.connected()]
+
+    def map(self, fn, timeout=None, hosts=None):
+        """Call fn(fpga) for every board concurrently and collect the outcome.
+
+           Boards that are not connected are reported as failed without calling fn. A board still
+           busy when its timeout expires is reported as timed out; its call carries on in the board's
+           worker and delays later operations on that board only.
+
+           @param self  This object.
+           @param fn  Callable taking a FpgaClient.
+           @param timeout  Float: seconds to wait for each board, defaults to the fleet timeout.
+           @param hosts  List of strings: subset of the fleet to run on, default all.
+           @return  FleetResult object.
+           """
+        timeout = self._timeout if timeout is None else timeout
+        hosts = self.hosts if hosts is None else hosts
+        result = FleetResult()
+        jobs = []
+        for host in hosts:
+            fpga = self.clients[host]
+            if not fpga.is_connected():
+                jobs.append((host, None))
+                continue
+            job = _Job(fn, fpga)
+            self._jobs[host].put(job)
+            jobs.append((host, job))
+        deadline = time.time() + timeout
+        for host, job in jobs:
+            if job is None:
+                result.errors[host] = 'not connected'
+            elif not job.event.wait(max(0, deadline - time.time())):
+                result.errors[host] = 'timed out after %s seconds' % timeout
+            elif job.error is not None:
+                result.errors[host] = job.error
+            else:
+                result.results[host] = job.value
+        for host, error in result.errors.items():
+            self._logger.warning('%s: %s' % (host, error))
+        return result
+
+    def ping(self, timeout=None):
+        """Return a FleetResult of FpgaClient.ping() for every board."""
+        return self.map(lambda fpga: fpga.ping(), timeout)
+
+    def stop(self):
+        """Stop the worker threads and close every connection."""
+        for jobs in self._jobs.values():
+            jobs.put(None)
+        for fpga in self.clients.values():
+            fpga.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Read a register from several ROACH boards at once.')
+    parser.add_argument('hosts', nargs='+', help='boards to query')
+    parser.add_argument('-r', '--register', default='sys_clkcounter', help='register to read')
+    parser.add_argument('-t', '--timeout', type=float, default=2.0, help='per-board timeout in seconds')
+    args = parser.parse_args()
+
+    fleet = Fleet(args.hosts, timeout=args.timeout)
+    try:
+        fleet.wait_connected(args.timeout)
+        t0 = time.time()
+        print(fleet.map(lambda fpga: fpga.read_uint(args.register)))
+        print('%i boards in %.3f s' % (len(fleet), time.time() - t0))
+    finally:
+        fleet.stop()
@@ -10,84 +10,174 @@ LOCK = 0x1 << 3
 IIC_RD = 0x1
 IIC_WR = 0x0
 
+# iic_adc<n> controller: 0x0 op FIFO, 0x4 RX FIFO, 0x8 status, 0xC op FIFO block
+IIC_OP_FIFO = 35        # ops queued per block/unblock round, the most _eeprom_read ever queued
+IIC_RX_FIFO = 32        # bytes read per round
+IIC_TIMEOUT = 1.0       # seconds for the controller to drain its op FIFO
+# Status register bits at offset 0x8
+IIC_RX_EMPTY = 0x1
+IIC_RX_OVERFLOW = 0x4
+IIC_OP_EMPTY = 0x10
+IIC_OP_OVERFLOW = 0x40
+IIC_NACK = 0x100
+
+_IIC_OP = struct.Struct('>2xBB')        # flags, data byte
+_IIC_WORD = struct.Struct('>I')
+_IIC_BLOCK = _IIC_WORD.pack(1)
+_IIC_UNBLOCK = _IIC_WORD.pack(0)
+_IIC_CLEAR = _IIC_WORD.pack(0xffffffff)
+
+class IicTransaction(object):
+    """IIC register accesses on the iic_adc<n> controller, sent as pipelined FpgaBatch rounds.
+
+       Each round clears the FIFOs, blocks the op FIFO, queues the packed ops of as many accesses
+       as fit, unblocks it and reads the status register, all in one batch. The status register
+       is polled until the op FIFO drained, then the RX FIFO is popped in one more batch:
+
+           with katadc.IicTransaction(fpga, 0) as t:
+               hb = t.read_register(0x4C, 0x00)
+               lb = t.read_register(0x4C, 0x10)
+           print t.results[hb], t.results[lb]
+
+       @param fpga  FpgaClient object.
+       @param katadc_n  Integer: ZDok port of the KATADC, 0 or 1.
+       @param timeout  Float: seconds to wait for the controller per round.
+       """
+    def __init__(self, fpga, katadc_n, timeout=IIC_TIMEOUT):
+        if not katadc_n in [0,1]: raise RuntimeError("katadc_n must be 0 or 1. Please select your ZDok port.")
+        self.fpga = fpga
+        self.controller = 'iic_adc%i' % katadc_n
+        self.timeout = timeout
+        self._chunks = []       # (access index, packed ops, bytes read)
+        self._kinds = []        # per access: None for a write, else decodes the bytes read
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        return False
+
+    def _add(self, kind, chunks):
+        index = len(self._kinds)
+        self._kinds.append(kind)
+        self._chunks.extend((index, ops, n) for ops, n in chunks)
+        return index
+
+    def write_register(self, dev_addr, reg_addr, reg_value):
+        """Queue a register write. @see iic_write_register"""
+        ops = (_IIC_OP.pack(WR | START | LOCK, (dev_addr << 1) | IIC_WR),
+               _IIC_OP.pack(WR | LOCK, reg_addr),
+               _IIC_OP.pack(WR | STOP, reg_value))
+        return self._add(None, [(ops, 0)])
+
+    def read(self, dev_addr, reg_addr, n_bytes):
+        """Queue a read of n_bytes consecutive registers; its result is a string of n_bytes."""
+        return self._add(''.join, self._read_chunks(dev_addr, reg_addr, n_bytes))
+
+    def read_register(self, dev_addr, reg_addr):
+        """Queue a register read; its result is the register value. @see iic_read_register"""
+        return self._add(lambda data: ord(data[0]), self._read_chunks(dev_addr, reg_addr, 1))
+
+    @staticmethod
+    def _read_chunks(dev_addr, reg_addr, n_bytes):
+        # One repeated START read per RX FIFO full of bytes
+        chunks = []
+        for offset in range(0, n_bytes, IIC_RX_FIFO):
+            n = min(IIC_RX_FIFO, n_bytes - offset)
+            ops = (_IIC_OP.pack(WR | START | LOCK, (dev_addr << 1) | IIC_WR),
+                   _IIC_OP.pack(WR | LOCK, reg_addr + offset),
+                   _IIC_OP.pack(WR | START | LOCK, (dev_addr << 1) | IIC_RD))
+            ops += (_IIC_OP.pack(RD, 0),) * (n - 1) + (_IIC_OP.pack(RD | STOP, 0),)
+            chunks.append((ops, n))
+        return chunks
+
+    def _rounds(self):
+        # Group the chunks so each round fits the op and RX FIFOs
+        rounds, ops, reads = [[]], 0, 0
+        for chunk in self._chunks:
+            if rounds[-1] and (ops + len(chunk[1]) > IIC_OP_FIFO or reads + chunk[2] > IIC_RX_FIFO):
+                rounds.append([])
+                ops, reads = 0, 0
+            rounds[-1].append(chunk)
+            ops += len(chunk[1])
+            reads += chunk[2]
+        return rounds
+
+    def _wait(self, status, ready):
+        # Poll the status register until ready(status), raising on the error latches
+        deadline, interval = time.time() + self.timeout, 0.0005
+        while True:
+            if status & (IIC_RX_OVERFLOW | IIC_OP_OVERFLOW):
+                raise RuntimeError('%s FIFO overflow, status 0x%X' % (self.controller, status))
+            if status & IIC_NACK:
+                raise RuntimeError('IIC device on %s did not acknowledge, status 0x%X' % (self.controller, status))
+            if ready(status):
+                return status
+            if time.time() > deadline:
+                raise RuntimeError('%s did not complete within %.1f s, status 0x%X' % (self.controller, self.timeout, status))
+            time.sleep(interval)
+            interval = min(2 * interval, 0.01)
+            status = self.fpga.read_uint(self.controller, 2)
+
+    def _pop(self, n_bytes):
+        # Pop n_bytes from the RX FIFO. Each pop is preceded by a status read in the same batch, and
+        # a pop that found the FIFO empty is retried once the next byte arrived.
+        fpga, ctrl = self.fpga, self.controller
+        received = []
+        while len(received) < n_bytes:
+            with fpga.batch() as b:
+                pops = [(b.read_uint(ctrl, 2), b.read(ctrl, 4, 0x4)) for i in range(n_bytes - len(received))]
+            for status, pop in pops:
+                if b.results[status] & IIC_RX_EMPTY:
+                    self._wait(b.results[status], lambda status: not status & IIC_RX_EMPTY)
+                    break
+                received.append(b.results[pop][3])
+        return received
+
+    def execute(self):
+        """Run every queued access and return the results, one per access, None for writes."""
+        fpga, ctrl = self.fpga, self.controller
+        data = [[] for kind in self._kinds]
+        for chunks in self._rounds():
+            n_bytes = sum(n for index, ops, n in chunks)
+            with fpga.batch() as b:
+                b.blindwrite(ctrl, _IIC_CLEAR, offset=0x8)
+                b.blindwrite(ctrl, _IIC_BLOCK, offset=0xC)
+                for index, ops, n in chunks:
+                    for op in ops:
+                        b.blindwrite(ctrl, op, offset=0x0)
+                b.blindwrite(ctrl, _IIC_UNBLOCK, offset=0xC)
+                status = b.read_uint(ctrl, 2)
+            # An empty op FIFO only means the last op was started; read bytes are popped as they arrive
+            self._wait(b.results[status], lambda status: status & IIC_OP_EMPTY and
+                       (not n_bytes or not status & IIC_RX_EMPTY))
+            if n_bytes:
+                received = iter(self._pop(n_bytes))
+                for index, ops, n in chunks:
+                    data[index].extend(next(received) for i in range(n))
+        self.results = [kind and kind(d) for kind, d in zip(self._kinds, data)]
+        return self.results
+
 def iic_write_register(fpga, katadc_n, dev_addr, reg_addr, reg_value):
     """fpga is an FpgaClient object, katadc_n is the adc number (0,1)"""
-    if not katadc_n in [0,1]: raise RuntimeError("katadc_n must be 0 or 1. Please select your ZDok port.")
-    iic_controller='iic_adc%i'%katadc_n
-    #print 'Trying to write %x to %s at dev_addr %x, reg_addr %x.'%(reg_value,iic_controller,dev_addr,reg_addr)
-    # Block Fifo
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00,0x00,0x01), offset=12)
-    # Write IIC control byte
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, WR | START | LOCK, (dev_addr << 1) | IIC_WR), offset=0x0)
-    # Write IIC register address
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, WR | LOCK, reg_addr), offset=0x0)
-    # Write IIC register value
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, WR | STOP, reg_value), offset=0x0)
-    # Unblock Fifo
-    fpga.blindwrite(iic_controller,struct.pack('>4B',0,0,0,0), offset=12)
+    with IicTransaction(fpga, katadc_n) as t:
+        t.write_register(dev_addr, reg_addr, reg_value)
 
 def iic_read_register(fpga,katadc_n, dev_addr, reg_addr):
     "reads from an arbitrary I2C address. fpga is an FpgaClient object and katadc_n is the adc number (0,1)."
-    if not katadc_n in [0,1]: raise RuntimeError("katadc_n must be 0 or 1. Please select your ZDok port.")
-    iic_controller='iic_adc%i'%katadc_n
-    # Block Fifo
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00,0x00,0x01), offset=12)
-    # Write IIC control byte
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, WR | START | LOCK, (dev_addr << 1) | IIC_WR), offset=0x0)
-    # Write IIC register address
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, WR | LOCK, reg_addr), offset=0x0)
-    # Send repeated START
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, WR | START | LOCK, (dev_addr << 1) | IIC_RD), offset=0x0)
-    # Fetch IIC register value
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, RD | STOP, 0), offset=0x0)
-    # Unblock Fifo
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00,0x00,0x00), offset=12)
-    time.sleep(0.1)
-    return struct.unpack('>BBBB',fpga.read(iic_controller,4,4))[3]
+    with IicTransaction(fpga, katadc_n) as t:
+        t.read_register(dev_addr, reg_addr)
+    return t.results[0]
 
 def _eeprom_read(fpga,katadc_n,n_bytes,offset=0):
     "Reads an arbitrary number of bytes from the I2C EEPROM. fpga is an FpgaClient object and katadc_n is the adc number (0,1)."
-    if not katadc_n in [0,1]: raise RuntimeError("katadc_n must be 0 or 1. Please select your ZDok port.")
-    iic_controller='iic_adc%i'%katadc_n
-    reg_addr=offset
-    dev_addr=0x51
-    n_bytes_remaining=n_bytes
-    rv=[]
-    #flush the fifos:
-    fpga.blindwrite(iic_controller,'%c%c%c%c'%(0xff,0xff,0xff,0xff),offset=0x8)
-    #break n_bytes into 32-byte chunks (max fifo length):
-    while n_bytes_remaining > 0:
-        # Block Fifo
-        fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00,0x00,0x01), offset=12)
-        # Write IIC control byte
-        fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, WR | START | LOCK, (dev_addr << 1) | IIC_WR), offset=0x0)
-        # Write IIC register address
-        fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, WR | LOCK, reg_addr+len(rv)), offset=0x0)
-        # Send repeated START
-        fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, WR | START | LOCK, (dev_addr << 1) | IIC_RD), offset=0x0)
-        # Fetch IIC register value
-        for i in range(min(31,n_bytes_remaining-1)):
-            fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, RD, 0), offset=0x0)
-            #print '%4X'%struct.unpack('>L',fpga.read(iic_controller,4,0x8))
-        fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00, RD | STOP, 0), offset=0x0)
-        #check for OP buffer overflow:
-        #   Bit[0] RXFIFO empty flag
-        #   Bit[1] RXFIFO full flag
-        #   Bit[2] RXFIFO overflow error latch
-        #   Bit[4] OPFIFO empty flag
-        #   Bit[5] OPFIFO full flag
-        #   Bit[6] OPFIFO overflow error latch
-        #   Bit[8] NACK on write error latch
-        if bool(struct.unpack('>L',fpga.read(iic_controller,4,0x8))[0]&int('1100110',2)):
-            #fpga.blindwrite(iic_controller,'%c%c%c%c'%(0xff,0xff,0xff,0xff),offset=0x8)
-            raise RuntimeError("Sorry, you requested too many bytes and the IIC controller's buffer overflowed.")
-        # Unblock Fifo
-        fpga.blindwrite(iic_controller,'%c%c%c%c'%(0x0,0x00,0x00,0x00), offset=12)
-        for i in range(min(32,n_bytes_remaining)):
-            rv.append(fpga.read(iic_controller,4,4)[3])
-        n_bytes_remaining -= min(32,n_bytes_remaining)
-        #print 'got %i bytes, remaining: %i bytes'%(len(rv),n_bytes_remaining)
-    return ''.join(rv)
+    # Split into 32-byte chunks (RX fifo length) by the transaction
+    with IicTransaction(fpga, katadc_n) as t:
+        t.read(0x51, offset, n_bytes)
+    return t.results[0]
 
 #NOT WORKING:
 #def iic_write(fpga,katadc_n, dev_addr, start_addr, raw_data):
@@ -119,22 +209,27 @@ def _eeprom_read(fpga,katadc_n,n_bytes,offset=0):
 def get_ambient_temp(fpga,katadc_n):
     """Returns ambient board temp in degC."""
     if not katadc_n in [0,1]: raise RuntimeError("katadc_n must be 0 or 1. Please select your ZDok port.")
-    hb=iic_read_register(fpga,katadc_n,0x4C,0x00)
-    lb=iic_read_register(fpga,katadc_n,0x4C,0x10)
+    with IicTransaction(fpga, katadc_n) as t:
+        t.read_register(0x4C, 0x00)
+        t.read_register(0x4C, 0x10)
+    hb, lb = t.results
     return numpy.int8(hb)+numpy.uint8(lb)/float(256)
 
 def get_adc_temp(fpga,katadc_n):
     """Returns temp in degC of ADC IC."""
     if not katadc_n in [0,1]: raise RuntimeError("katadc_n must be 0 or 1. Please select your ZDok port.")
-    hb=iic_read_register(fpga,katadc_n,0x4C,0x01)
-    lb=iic_read_register(fpga,katadc_n,0x4C,0x11)
+    with IicTransaction(fpga, katadc_n) as t:
+        t.read_register(0x4C, 0x01)
+        t.read_register(0x4C, 0x11)
+    hb, lb = t.results
     return numpy.int8(hb)+numpy.uint8(lb)/float(256)
 
 def _eeprom_write(fpga,katadc_n,eeprom_bin):
     """Generic write of raw bytestream into the IIC EEPROM."""
     if not katadc_n in [0,1]: raise RuntimeError("katadc_n must be 0 or 1. Please select your ZDok port.")
+    # One transaction per byte: the EEPROM does not acknowledge while it programs the previous one
     for n,c in enumerate(eeprom_bin):
-       iic_write_register(fpga,katadc_n,0x51,n,c)
+       iic_write_register(fpga,katadc_n,0x51,n,ord(c))
 
 def eeprom_details_get(fpga,katadc_n,fetch_cal=False):
     """Retrieves data from the EEPROM and unpacks it. Returns a dictionary."""
@@ -244,8 +339,9 @@ def rf_fe_set(fpga,katadc_n,input_sel,gain=0,enabled=True):
     if gain<-11.5: raise RuntimeError('Valid gain range is -11.5dB to +20dB. %idB is invalid.'%gain)
     # ZHY 2018-03-15: enable output gain value, ref. gpio_header_set() comments
     #                 this value is initialized to 0xff for 'I' input, 0 for 'Q' input
-    iic_write_register(fpga,katadc_n,0x20+pol,6,0x00)
-    iic_write_register(fpga,katadc_n,0x20+pol,2,0x40+(enabled<<7)+int((gain*2)+23))
+    with IicTransaction(fpga, katadc_n) as t:
+        t.write_register(0x20+pol, 6, 0x00)
+        t.write_register(0x20+pol, 2, 0x40+(enabled<<7)+int((gain*2)+23))
 
 def rf_fe_get(fpga,katadc_n,input_sel):
     """Fetches and decodes the RF frontend on the KATADCs."""
@@ -264,10 +360,15 @@ def rf_fe_get(fpga,katadc_n,input_sel):
 
 def gpio_header_get(fpga,katadc_n):
     if not katadc_n in [0,1]: raise RuntimeError("katadc_n must be 0 or 1. Please select your ZDok port.")
+    with IicTransaction(fpga, katadc_n) as t:
+        # One access per register: the expander does not auto-increment across all 8
+        for pol in range(2):
+            for i in range(0,8):
+                t.read_register(0x20+pol, i)
     for pol in range(2):
         print "IIC GPIO expansion on ADC%i's %s input:"%(katadc_n,{0:'I',1:'Q'}[pol])
         for i in range(0,8):
-            print '\t%x: %x'%(i,iic_read_register(fpga, katadc_n, 0x20+pol, i))
+            print '\t%x: %x'%(i,t.results[8*pol+i])
 
 def gpio_header_set(fpga,katadc_n,input_sel):
     if not katadc_n in [0,1]: raise RuntimeError("katadc_n must be 0 or 1. Please select your ZDok port.")
@@ -0,0 +1,330 @@
+"""asyncio client for communicating with a ROACH board over KATCP.
+
+   AsyncFpgaClient offers the request surface of katcp_wrapper.FpgaClient (read, write,
+   blindwrite, read_uint, write_int, bulkread, snapshot_get, progdev, tap_start, ...) as
+   coroutines on asyncio streams, so one event loop can drive every board at once instead of
+   one katcp thread per board:
+
+       async def versions(hosts):
+           clients = [AsyncFpgaClient(h) for h in hosts]
+           await asyncio.gather(*(c.connect() for c in clients))
+           return await asyncio.gather(*(c.read_uint('rcs_ver') for c in clients))
+
+   Requests are pipelined: every call puts its request on the wire immediately and replies
+   are matched to requests in order, per request name, as tcpborphserver answers them.
+
+   Requires Python 3.
+"""
+
+import asyncio, collections, logging, re, struct, time
+
+log = logging.getLogger("katcp")
+
+_U32 = struct.Struct('>I')
+_I32 = struct.Struct('>i')
+
+_ESCAPES = {b'\\': b'\\\\', b' ': b'\\_', b'\0': b'\\0', b'\n': b'\\n',
+            b'\r': b'\\r', b'\x1b': b'\\e', b'\t': b'\\t'}
+_UNESCAPES = dict((v[1:], k) for k, v in _ESCAPES.items())
+_UNESCAPES[b'@'] = b''
+_ESCAPE_RE = re.compile(b'[\\\\ \\0\\n\\r\\x1b\\t]')
+_UNESCAPE_RE = re.compile(b'\\\\(.)')
+_WHITESPACE_RE = re.compile(b'[ \\t]+')
+
+REQUEST, REPLY, INFORM = b'?', b'!', b'#'
+OK = b'ok'
+
+
+def escape(arg):
+    """Escape one KATCP argument (bytes, str or int) for the wire."""
+    if isinstance(arg, str):
+        arg = arg.encode('latin-1')
+    elif isinstance(arg, int):
+        arg = b'%d' % arg
+    if not arg:
+        return b'\\@'
+    return _ESCAPE_RE.sub(lambda m: _ESCAPES[m.group()], arg)
+
+
+def unescape(arg):
+    """Undo escape() on one argument read from the wire."""
+    if b'\\' not in arg:
+        return arg
+    return _UNESCAPE_RE.sub(lambda m: _UNESCAPES[m.group(1)], arg)
+
+
+def format_message(mtype, name, *args):
+    """Return the wire form of a KATCP message, including the trailing newline."""
+    if isinstance(name, str):
+        name = name.encode('ascii')
+    return b' '.join([mtype + name] + [escape(a) for a in args]) + b'\n'
+
+
+def parse_message(line):
+    """Split a KATCP line into (type, name, args). Message ids are dropped."""
+    parts = _WHITESPACE_RE.split(line.strip())
+    head = parts[0]
+    name = head[1:].partition(b'[')[0]
+    return head[:1], name.decode('ascii'), [unescape(a) for a in parts[1:]]
+
+
+class AsyncFpgaClient(object):
+    """asyncio client for communicating with a ROACH board.
+
+       Notes:
+         - All requests are coroutines and may be issued concurrently; they are pipelined on
+           the single connection.
+         - A request that gets no reply within the timeout raises RuntimeError. A failing
+           reply raises RuntimeError with the request and reply, as FpgaClient does.
+       """
+
+    def __init__(self, host, port=7147, timeout=10.0, logger=log):
+        """Create an unconnected client. Call connect() (or use 'async with') before any request.
+
+           @param self  This object.
+           @param host  String: host to connect to.
+           @param port  Integer: port to connect to.
+           @param timeout  Float: seconds to wait for each reply.
+           @param logger Object: Logger to log to.
+           """
+        self.host = host
+        self.port = port
+        self._timeout = timeout
+        self._logger = logger
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        # request name -> deque of (future, informs) in the order the requests were sent
+        self._pending = collections.defaultdict(collections.deque)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+    @property
+    def bindaddr(self):
+        return self.host, self.port
+
+    def is_connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self, timeout=None):
+        """Open the connection and start dispatching replies.
+
+           @param self  This object.
+           @param timeout  Float: seconds to wait for the connection; defaults to the client timeout.
+           """
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, limit=2**24),
+            self._timeout if timeout is None else timeout)
+        self._read_task = asyncio.ensure_future(self._dispatch())
+
+    async def stop(self):
+        """Close the connection. Requests still waiting for a reply fail."""
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (OSError, ConnectionError):
+                pass
+        if self._read_task is not None:
+            await self._read_task
+        self._read_task = None
+        self._writer = None
+
+    async def _dispatch(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                mtype, name, args = parse_message(line)
+                queue = self._pending.get(name)
+                if mtype == REPLY and queue:
+                    future, informs = queue.popleft()
+                    if not future.done():
+                        future.set_result((args, informs))
+                elif mtype == INFORM and queue:
+                    queue[0][1].append(args)
+                elif mtype == INFORM and name == 'log':
+                    self._logger.debug('%s: %s' % (self.host, b' '.join(args).decode('latin-1')))
+        except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+            self._logger.warning('Connection to %s lost: %s' % (self.host, e))
+        finally:
+            self._fail_pending('Connection to %s closed.' % self.host)
+
+    def _fail_pending(self, reason):
+        for queue in self._pending.values():
+            while queue:
+                future, informs = queue.popleft()
+                if not future.done():
+                    future.set_exception(RuntimeError(reason))
+
+    async def _request(self, name, *args, **kwargs):
+        """Make a request and check the result.
+
+           Raise an error if the reply indicates a request failure.
+
+           @param self  This object.
+           @param name  String: name of the request message to send.
+           @param args  Request arguments (bytes, str or int).
+           @param timeout  Float: keyword only, seconds to wait for the reply.
+           @return  Tuple: reply arguments and a list of inform argument lists.
+           """
+        timeout = kwargs.get('timeout', self._timeout)
+        if not self.is_connected():
+            raise RuntimeError('Request %s failed: not connected to %s.' % (name, self.host))
+        future = asyncio.get_event_loop().create_future()
+        # The entry stays queued even if we stop waiting, so later replies still line up.
+        self._pending[name].append((future, []))
+        self._writer.write(format_message(REQUEST, name, *args))
+        await self._writer.drain()
+        try:
+            reply, informs = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError('Request %s to %s timed out after %s seconds.' % (name, self.host, timeout))
+        if not reply or reply[0] != OK:
+            msg = "Request %s failed.\n  Request: %s\n  Reply: %s." % (name, args if name != 'write' else args[:2], reply)
+            self._logger.error(msg)
+            raise RuntimeError(msg)
+        return reply, informs
+
+    async def listdev(self):
+        """Return a list of register / device names."""
+        reply, informs = await self._request('listdev')
+        return [i[0].decode('ascii') for i in informs]
+
+    async def listbof(self):
+        """Return a list of executable files."""
+        reply, informs = await self._request('listbof')
+        return [i[0].decode('ascii') for i in informs]
+
+    async def progdev(self, boffile):
+        """Program the FPGA with the specified boffile, or deprogram it if boffile is empty.
+
+           @param self  This object.
+           @param boffile  String: name of the BOF file.
+           @return  String: device status.
+           """
+        if boffile == '' or boffile is None:
+            reply, informs = await self._request('progdev')
+            self._logger.info("Deprogramming FPGA... %s." % reply[0].decode())
+        else:
+            reply, informs = await self._request('progdev', boffile)
+            self._logger.info("Programming FPGA with %s... %s." % (boffile, reply[0].decode()))
+        return reply[0].decode()
+
+    async def status(self):
+        """Return the status of the FPGA."""
+        reply, informs = await self._request('status')
+        return reply[1].decode()
+
+    async def ping(self):
+        """Tries to ping the FPGA."""
+        try:
+            await self._request('watchdog')
+        except RuntimeError:
+            return False
+        return True
+
+    async def tap_start(self, tap_dev, device, mac, ip, port):
+        """Program a 10GbE device and start the TAP driver. @see katcp_wrapper.FpgaClient.tap_start"""
+        if len(tap_dev) > 8:
+            raise RuntimeError("Tap device identifier must be shorter than 9 characters. You specified %s for device %s." % (tap_dev, device))
+        mac_str = ':'.join('%02X' % ((mac >> s) & 0xFF) for s in range(40, -8, -8))
+        ip_str = '%i.%i.%i.%i' % ((ip >> 24) & 0xFF, (ip >> 16) & 0xFF, (ip >> 8) & 0xFF, ip & 0xFF)
+        self._logger.info("Starting tgtap driver instance for %s: %s %s %s %s %s" % ("tap-start", tap_dev, device, ip_str, port, mac_str))
+        await self._request('tap-start', tap_dev, device, ip_str, port, mac_str)
+
+    async def tap_stop(self, device):
+        """Stop a TAP driver."""
+        await self._request('tap-stop', device)
+
+    async def read(self, device_name, size, offset=0):
+        """Return size bytes of binary data read from device_name at offset."""
+        reply, informs = await self._request('read', device_name, offset, size)
+        return reply[1]
+
+    async def bulkread(self, device_name, size, offset=0):
+        """Return size bytes read with the bulkread request, which returns the data in pages of informs."""
+        reply, informs = await self._request('bulkread', device_name, offset, size)
+        return b''.join([i[0] for i in informs])
+
+    async def blindwrite(self, device_name, data, offset=0):
+        """Unchecked data write."""
+        assert isinstance(data, bytes), 'You need to supply binary packed bytes data!'
+        assert (len(data)%4) == 0, 'You must write 32bit-bounded words!'
+        assert (offset%4) == 0, 'You must write 32bit-bounded words!'
+        await self._request('write', device_name, offset, data)
+
+    async def write(self, device_name, data, offset=0):
+        """Write and verify by reading back. The write and the read-back are pipelined."""
+        assert isinstance(data, bytes), 'You need to supply binary packed bytes data!'
+        assert (len(data)%4) == 0, 'You must write 32bit-bounded words!'
+        assert (offset%4) == 0, 'You must write 32bit-bounded words!'
+        _, new_data = await asyncio.gather(self._request('write', device_name, offset, data),
+                                           self.read(device_name, len(data), offset))
+        if new_data != data:
+            msg = ("Verification of write to %s at offset %d failed. Wrote 0x%08x... but got back 0x%08x..."
+                % (device_name, offset, _U32.unpack(data[0:4])[0], _U32.unpack(new_data[0:4])[0]))
+            self._logger.error(msg)
+            raise RuntimeError(msg)
+
+    async def read_int(self, device_name, offset=0):
+        """Read a signed 32 bit integer at offset (in 32 bit words)."""
+        return _I32.unpack(await self.read(device_name, 4, offset*4))[0]
+
+    async def read_uint(self, device_name, offset=0):
+        """Read an unsigned 32 bit integer at offset (in 32 bit words)."""
+        return _U32.unpack(await self.read(device_name, 4, offset*4))[0]
+
+    async def write_int(self, device_name, integer, blindwrite=False, offset=0):
+        """Write a 32 bit integer at offset (in 32 bit words), verified unless blindwrite."""
+        data = _I32.pack(integer) if integer < 0 else _U32.pack(integer)
+        if blindwrite:
+            await self.blindwrite(device_name, data, offset*4)
+        else:
+            await self.write(device_name, data, offset*4)
+
+    async def snapshot_arm(self, dev_name, man_trig=False, man_valid=False, offset=-1, circular_capture=False):
+        ctrl = (man_trig<<1) + (man_valid<<2) + (circular_capture<<3)
+        # One after another: the capture starts on the 0 -> 1 edge of the ctrl enable bit
+        if offset >= 0:
+            await self.write_int(dev_name + '_trig_offset', offset)
+        await self.write_int(dev_name + '_ctrl', ctrl)
+        await self.write_int(dev_name + '_ctrl', 1 + ctrl)
+
+    async def snapshot_get(self, dev_name, man_trig=False, man_valid=False, wait_period=1, offset=-1, circular_capture=False, get_extra_val=False, arm=True):
+        """Grabs all brams from a single snap block on this FPGA device.
+           @see katcp_wrapper.FpgaClient.snapshot_get
+           """
+        if arm:
+            await self.snapshot_arm(dev_name, man_trig=man_trig, man_valid=man_valid, offset=offset, circular_capture=circular_capture)
+        done = False
+        start_time = time.time()
+        while not done and ((time.time()-start_time) < wait_period or (wait_period < 0)):
+            addr = await self.read_uint(dev_name + '_status')
+            done = not bool(addr & 0x80000000)
+            if not done:
+                await asyncio.sleep(0.05)
+
+        bram_size = addr & 0x7fffffff
+        bram_dmp = {'length': bram_size}
+        if (bram_size != (await self.read_uint(dev_name + '_status')) & 0x7fffffff) or bram_size == 0:
+            raise RuntimeError("A snap block logic error occurred or it didn't finish capturing in the allotted %2.2f seconds. Reported %i bytes captured." % (wait_period, bram_size))
+
+        if circular_capture:
+            bram_dmp['offset'] = (await self.read_uint(dev_name + '_tr_en_cnt')) - bram_size
+        else:
+            bram_dmp['offset'] = 0
+        bram_dmp['offset'] = max(0, bram_dmp['offset'] + offset)
+
+        bram_dmp['data'] = await self.read(dev_name + '_bram', bram_size)
+        if get_extra_val:
+            bram_dmp['val'] = await self.read_uint(dev_name + '_val')
+        return bram_dmp
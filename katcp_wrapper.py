@@ -12,14 +12,24 @@
 
 from __future__ import print_function
 
-import struct, threading, socket, logging, time, os
+import struct, threading, socket, logging, time, os, fnmatch, collections
 
 from katcp import *
+import regmap
 log = logging.getLogger("katcp")
 
-class FpgaAsyncRequest:
+# Bytes of DRAM behind each value of the dram_controller indirect page register
+DRAM_PAGE_SIZE = 64*1024*1024
+
+# Guards the lazily created wait events and done callbacks of all FpgaAsyncRequests
+_nb_future_lock = threading.Lock()
+
+class FpgaAsyncRequest(object):
     """A class to hold information about a specific KATCP request made by a Fpga.
+       It doubles as a future for the reply: see done(), wait(), result() and add_done_callback().
        """
+    __slots__ = ('host', 'request', 'request_id', 'time_tx', 'informs', 'inform_times', 'reply',
+                 'reply_time', 'reply_cb', 'inform_cb', '_event', '_callbacks')
     def __init__(self, host, request, request_id, inform_cb = None, reply_cb = None):
         self.host = host
         self.request = request
@@ -31,8 +41,13 @@ class FpgaAsyncRequest:
         self.reply_time = -1
         self.reply_cb = reply_cb
         self.inform_cb = inform_cb
+        self._event = None
+        self._callbacks = None
     def __str__(self):
         return '%s(%s)@(%10.5f) - reply%s - informs(%i)' % (self.request, self.request_id, self.time_tx, str(self.reply), len(self.informs))
+    def __getitem__(self, key):
+        # _nb_request used to return {'host': ..., 'request': ..., 'id': ...}
+        return {'host': self.host, 'request': self.request, 'id': self.request_id}[key]
     def got_reply(self, reply_message):
         if not (reply_message.name == self.request):
             error_string = 'rx reply(%s) does not match request(%s)' % (reply_message.name, self.request)
@@ -42,6 +57,14 @@ class FpgaAsyncRequest:
         self.reply_time = time.time()
         if self.reply_cb != None:
             self.reply_cb(self.host, self.request_id)
+        with _nb_future_lock:
+            event, callbacks = self._event, self._callbacks
+            self._callbacks = None
+        if event is not None:
+            event.set()
+        if callbacks:
+            for fn in callbacks:
+                fn(self)
     def got_inform(self, inform_message):
         if self.reply != None:
             raise RuntimeError('Received inform for message(%s,%s) after reply. Invalid?' % (self.request, self.request_id))
@@ -59,6 +82,340 @@ class FpgaAsyncRequest:
         if self.reply == None:
             return False
         return self.reply.arguments[0] == Message.OK
+    def done(self):
+        '''Has the reply (or a timeout/failure reply) arrived?
+        '''
+        return self.reply is not None
+    def wait(self, timeout=None):
+        '''Wait for the reply. Returns done().
+        '''
+        if self.reply is not None:
+            return True
+        with _nb_future_lock:
+            if self.reply is not None:
+                return True
+            if self._event is None:
+                self._event = threading.Event()
+            event = self._event
+        event.wait(timeout)
+        return self.reply is not None
+    def result(self, timeout=None):
+        '''Wait for the reply and return (reply, informs) like a blocking request.
+           Raises RuntimeError if no reply arrived within timeout or if the request failed.
+        '''
+        if not self.wait(timeout):
+            raise RuntimeError('Request %s(%s) to %s still pending after %s seconds.' % (self.request, self.request_id, self.host, timeout))
+        if not self.complete_ok():
+            raise RuntimeError('Request %s(%s) to %s failed.\n  Reply: %s.' % (self.request, self.request_id, self.host, self.reply))
+        return self.reply, self.informs
+    def add_done_callback(self, fn):
+        '''Call fn(self) once the reply arrived, immediately if it already has. The callback
+           runs on the katcp client thread, so it must not block.
+        '''
+        with _nb_future_lock:
+            if self.reply is None:
+                if self._callbacks is None:
+                    self._callbacks = []
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+def gather(requests, timeout=None):
+    """Wait for several FpgaAsyncRequests and return their results in order.
+
+       @param requests  Iterable of FpgaAsyncRequest objects.
+       @param timeout  Float: seconds to wait for all of them together, None to wait forever.
+       @return  List of (reply, informs) tuples.
+       """
+    requests = list(requests)
+    if timeout is None:
+        return [r.result() for r in requests]
+    deadline = time.time() + timeout
+    return [r.result(max(0, deadline - time.time())) for r in requests]
+
+class FpgaRegisterCache(object):
+    """Shadow copy of the registers this client last wrote to or read from a Fpga.
+
+       Only registers marked static are shadowed: registers that the gateware never changes by
+       itself, such as configuration written by software. Reads of a shadowed register are served
+       locally and writes that would not change its value are skipped. Names may be given as
+       shell-style patterns (e.g. 'u?_acc_len', 'xgbe*_dest_*').
+
+       FpgaClient clears the cache on progdev, on every (re)connect and on writes to 'reset'.
+       The hits, misses and skipped_writes counters can be read at any time.
+       """
+    def __init__(self, static=()):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._patterns = []
+        self._static = {}
+        self.hits = 0
+        self.misses = 0
+        self.skipped_writes = 0
+        self.add_static(static)
+
+    def __str__(self):
+        return 'FpgaRegisterCache(%i entries, %i hits, %i misses, %i skipped writes)' % (
+            len(self._values), self.hits, self.misses, self.skipped_writes)
+
+    def add_static(self, names):
+        """Mark registers (names or shell-style patterns) as static."""
+        if isinstance(names, str):
+            names = [names]
+        with self._lock:
+            self._patterns.extend(names)
+            self._static = {}
+
+    def is_static(self, device_name):
+        try:
+            return self._static[device_name]
+        except KeyError:
+            static = any(fnmatch.fnmatchcase(device_name, p) for p in self._patterns)
+            self._static[device_name] = static
+            return static
+
+    def get(self, device_name, offset, size):
+        """Return the shadowed data of a static register, or None if it has to be read from the board."""
+        if not self.is_static(device_name):
+            return None
+        with self._lock:
+            data = self._values.get((device_name, offset))
+            if data is not None and len(data) == size:
+                self.hits += 1
+                return data
+            self.misses += 1
+            return None
+
+    def unchanged(self, device_name, offset, data):
+        """Check whether writing data would leave a static register unchanged (counted as a skipped write)."""
+        if not self.is_static(device_name):
+            return False
+        with self._lock:
+            if self._values.get((device_name, offset)) == data:
+                self.skipped_writes += 1
+                return True
+            return False
+
+    def count_skipped(self):
+        """Count a write skipped for a reason unchanged() did not see, e.g. it repeats a pending batch write."""
+        with self._lock:
+            self.skipped_writes += 1
+
+    def put(self, device_name, offset, data):
+        """Record data as the current contents of a register."""
+        if device_name == 'reset':
+            self.clear()
+        elif self.is_static(device_name):
+            with self._lock:
+                self._values[(device_name, offset)] = data
+
+    def clear(self):
+        """Forget all shadowed values. Counters are kept."""
+        with self._lock:
+            self._values.clear()
+
+class FpgaBatchError(RuntimeError):
+    """Raised when one or more requests in a FpgaBatch failed.
+
+       @param errors  List of (index, string) tuples: position of the failed operation in the batch and the reason.
+       @param results  List: results of all operations, None where the operation failed.
+       """
+    def __init__(self, errors, results):
+        self.errors = errors
+        self.results = results
+        RuntimeError.__init__(self, '%i of %i batched operations failed:\n  %s'
+            % (len(errors), len(results), '\n  '.join('[%i] %s' % e for e in errors)))
+
+class FpgaBatch(object):
+    """A list of register reads and writes that are put on the wire together.
+
+       Operations are queued with the same signatures as the FpgaClient methods of the same name
+       and each returns its index into the results list. Nothing is sent until execute() is called,
+       which happens automatically when the batch is used as a context manager:
+
+           with fpga.batch() as b:
+               b.write_int('u0_acc_len', 100)
+               i = b.read_uint('u0_bit_select')
+           bitsel = b.results[i]
+
+       All requests are issued back to back through the non-blocking request machinery, so the batch
+       costs about one round trip instead of one per request. Verified writes are sent as a write
+       immediately followed by a read of the same location. Failures are collected and reported once
+       as a FpgaBatchError after every reply has arrived.
+       """
+    window = 256
+
+    def __init__(self, fpga, timeout=None):
+        self._fpga = fpga
+        self._timeout = fpga._timeout if timeout is None else timeout
+        self._ops = []
+        self._pending = {}
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        return False
+
+    def __len__(self):
+        return len(self._ops)
+
+    def _add(self, requests, decode, description, commit=None):
+        self._ops.append((requests, decode, description, commit))
+        return len(self._ops) - 1
+
+    def _cached(self, device_name, offset, size):
+        data = self._pending.get((device_name, offset))
+        if data is not None and len(data) == size:
+            return data
+        if self._fpga.cache is not None:
+            return self._fpga.cache.get(device_name, offset, size)
+        return None
+
+    def _commit(self, device_name, offset):
+        cache = self._fpga.cache
+        def commit(data):
+            cache.put(device_name, offset, data)
+        return commit if cache is not None else None
+
+    def _read(self, device_name, size, offset, convert, description):
+        data = self._cached(device_name, offset, size)
+        if data is not None:
+            return self._add([], lambda replies: convert(data), description)
+        def decode(replies):
+            return replies[0][0].arguments[1]
+        commit = self._commit(device_name, offset)
+        def store(data):
+            if commit is not None:
+                commit(data)
+            return convert(data)
+        return self._add([('read', (device_name, str(offset), str(size)))],
+            decode, description, store)
+
+    def _write(self, device_name, data, offset, verify, description):
+        assert (type(data)==bytes) , 'You need to supply binary packed bytes data!'
+        assert (len(data)%4) ==0 , 'You must write 32bit-bounded words!'
+        assert ((offset%4) ==0) , 'You must write 32bit-bounded words!'
+        cache = self._fpga.cache
+        if (device_name, offset) in self._pending:
+            unchanged = self._pending[(device_name, offset)] == data
+            if unchanged:
+                cache.count_skipped()
+        else:
+            unchanged = cache is not None and cache.unchanged(device_name, offset, data)
+        if unchanged:
+            return self._add([], lambda replies: None, description)
+        if cache is not None and cache.is_static(device_name):
+            self._pending[(device_name, offset)] = data
+        commit = self._commit(device_name, offset)
+        requests = [('write', (device_name, str(offset), data))]
+        if verify:
+            requests.append(('read', (device_name, str(offset), str(len(data)))))
+        def decode(replies):
+            if verify:
+                new_data = replies[1][0].arguments[1]
+                if new_data != data:
+                    raise RuntimeError("Verification of write to %s at offset %d failed. Wrote 0x%08x... but got back 0x%08x..."
+                        % (device_name, offset, struct.unpack('>L', data[0:4])[0], struct.unpack('>L', new_data[0:4])[0]))
+            return data
+        def store(data):
+            if commit is not None:
+                commit(data)
+        return self._add(requests, decode, description, store)
+
+    def read(self, device_name, size, offset=0):
+        """Queue a read of size bytes. @see FpgaClient.read"""
+        return self._read(device_name, size, offset, lambda data: data,
+            'read %s[%i:%i]' % (device_name, offset, offset + size))
+
+    def bulkread(self, device_name, size, offset=0):
+        """Queue a bulkread of size bytes. @see FpgaClient.bulkread"""
+        return self._add([('bulkread', (device_name, str(offset), str(size)))],
+            lambda replies: b''.join([i.arguments[0] for i in replies[0][1]]),
+            'bulkread %s[%i:%i]' % (device_name, offset, offset + size))
+
+    def blindwrite(self, device_name, data, offset=0):
+        """Queue an unchecked write. @see FpgaClient.blindwrite"""
+        return self._write(device_name, data, offset, False,
+            'blindwrite %s[%i]' % (device_name, offset))
+
+    def write(self, device_name, data, offset=0):
+        """Queue a verified write: the write is followed by a read-back of the same bytes. @see FpgaClient.write"""
+        return self._write(device_name, data, offset, True,
+            'write %s[%i]' % (device_name, offset))
+
+    def read_int(self, device_name, offset=0):
+        """Queue a signed 32 bit read. @see FpgaClient.read_int"""
+        return self._read(device_name, 4, offset*4, lambda data: struct.unpack('>i', data)[0],
+            'read_int %s[%i]' % (device_name, offset))
+
+    def read_uint(self, device_name, offset=0):
+        """Queue an unsigned 32 bit read. @see FpgaClient.read_uint"""
+        return self._read(device_name, 4, offset*4, lambda data: struct.unpack('>I', data)[0],
+            'read_uint %s[%i]' % (device_name, offset))
+
+    def write_int(self, device_name, integer, blindwrite=False, offset=0):
+        """Queue a 32 bit integer write. @see FpgaClient.write_int"""
+        if integer < 0:
+            data = struct.pack(">i", integer)
+        else:
+            data = struct.pack(">I", integer)
+        if blindwrite:
+            return self.blindwrite(device_name, data, offset*4)
+        return self.write(device_name, data, offset*4)
+
+    def execute(self):
+        """Send all queued requests, wait for every reply and decode the results.
+
+           @param self  This object.
+           @return  List: one result per queued operation, in order (None for writes).
+           """
+        fpga = self._fpga
+        requests = [r for ops in self._ops for r in ops[0]]
+        # Each request in flight costs katcp a timeout timer, so keep a sliding window.
+        window = self.window
+        pending = []
+        for index, (name, args) in enumerate(requests):
+            if index >= window:
+                pending[index - window].wait(self._timeout + 1)
+            pending.append(fpga._nb_request(name, None, None, *args))
+
+        # Each request carries its own katcp timeout, allow a little slack on top for the last one.
+        deadline = time.time() + self._timeout + 1
+        for req in pending:
+            if not req.wait(max(0, deadline - time.time())):
+                raise RuntimeError('Batch of %i requests did not complete within %.1f seconds.' % (len(requests), self._timeout))
+            fpga._nb_pop_request_by_id(req.request_id)
+        replies = [(req.reply, req.informs) for req in pending]
+
+        results = []
+        errors = []
+        pos = 0
+        for index, (ops, decode, description, commit) in enumerate(self._ops):
+            op_replies = replies[pos:pos + len(ops)]
+            pos += len(ops)
+            failed = [reply for reply, informs in op_replies if reply.arguments[0] != Message.OK]
+            if failed:
+                errors.append((index, '%s: %s' % (description, failed[0])))
+                results.append(None)
+                continue
+            try:
+                result = decode(op_replies)
+            except RuntimeError as e:
+                errors.append((index, '%s: %s' % (description, e)))
+                results.append(None)
+                continue
+            results.append(commit(result) if commit is not None else result)
+        fpga._logger.debug('Batch of %i operations (%i requests) done, %i failed.' % (len(self._ops), len(requests), len(errors)))
+        self.results = results
+        if errors:
+            error = FpgaBatchError(errors, results)
+            fpga._logger.error(str(error))
+            raise error
+        return results
 
 #class FpgaClient(BlockingClient):
 class FpgaClient(CallbackClient):
@@ -72,7 +429,7 @@ class FpgaClient(CallbackClient):
            appropriate message.
        """
 
-    def __init__(self, host, port=7147, tb_limit=20, timeout=10.0, logger=log):
+    def __init__(self, host, port=7147, tb_limit=20, timeout=10.0, logger=log, cache=False):
         """Create a basic DeviceClient.
 
            @param self  This object.
@@ -83,101 +440,119 @@ class FpgaClient(CallbackClient):
            @param timeout  Float: seconds to wait before timing out on
                            client operations.
            @param logger Object: Logger to log to.
+           @param cache  Boolean: keep a FpgaRegisterCache of static registers
+                         (see self.cache.add_static).
            """
         super(FpgaClient, self).__init__(host, port, tb_limit = tb_limit, timeout = timeout, logger = logger)
         self.host = host
         self._timeout = timeout
+        self.cache = FpgaRegisterCache() if cache else None
+        self._bitstream = None
+        self._regmap = None
         self.start()
 
         # async stuff
         self._nb_request_id_lock = threading.Lock()
         self._nb_request_id = 0
         self._nb_requests_lock = threading.Lock()
-        self._nb_requests = {}
-        self._nb_max_requests = 100
+        self._nb_requests = collections.OrderedDict()
+        self._nb_max_requests = 10000
 
     """**********************************************************************************"""
     """**********************************************************************************"""
 
     def _nb_get_request_by_id(self, request_id):
-        try:
-            return self._nb_requests[request_id]
-        except KeyError:
-            return None
+        with self._nb_requests_lock:
+            return self._nb_requests.get(request_id)
 
     def _nb_pop_request_by_id(self, request_id):
-        try:
-            self._nb_requests_lock.acquire()
-            r = self._nb_requests.pop(request_id)
-            self._nb_requests_lock.release()
-            return r
-        except KeyError:
-            return None
+        with self._nb_requests_lock:
+            return self._nb_requests.pop(request_id, None)
 
     def _nb_pop_oldest_request(self):
-        req = self._nb_requests[list(self._nb_requests.keys())[0]]
-        for k, v in self._nb_requests.items():
-            if v.time_tx < req.time_tx:
-                req = v
-        self._nb_requests_lock.acquire()
-        r = self._nb_pop_request_by_id(req.request_id)
-        self._nb_requests_lock.release()
-        return r
+        with self._nb_requests_lock:
+            try:
+                return self._nb_requests.popitem(last=False)[1]
+            except KeyError:
+                return None
 
     def _nb_get_request_result(self, request_id):
         req = self._nb_get_request_by_id(request_id)
         return req.reply, req.informs
 
     def _nb_add_request(self, request_name, request_id, inform_cb, reply_cb):
-        if request_id in self._nb_requests:
-            raise RuntimeError('Trying to add request with id(%s) but it already exists.' % request_id)
-        self._nb_requests_lock.acquire()
-        self._nb_requests[request_id] = FpgaAsyncRequest(self.host, request_name, request_id, inform_cb, reply_cb)
-        self._nb_requests_lock.release()
+        req = FpgaAsyncRequest(self.host, request_name, request_id, inform_cb, reply_cb)
+        with self._nb_requests_lock:
+            if request_id in self._nb_requests:
+                raise RuntimeError('Trying to add request with id(%s) but it already exists.' % request_id)
+            self._nb_requests[request_id] = req
+        return req
 
     def _nb_get_next_request_id(self):
-        self._nb_request_id_lock.acquire()
-        self._nb_request_id += 1
-        reqid = self._nb_request_id
-        self._nb_request_id_lock.release()
-        return str(reqid)
-
-    def _nb_replycb(self, msg, *userdata):
-        """The callback for request replies. Check that the ID exists and call that request's got_reply function.
+        with self._nb_request_id_lock:
+            self._nb_request_id += 1
+            return str(self._nb_request_id)
+
+    def _nb_replycb(self, msg, req):
+        """The callback for request replies. The request object travels with the katcp request,
+           so replies still complete requests that were evicted from the table.
            """
-        request_id = ''.join(userdata)
-        if request_id not in self._nb_requests:
-            raise RuntimeError('Recieved reply for request_id(%s), but no such stored request.' % request_id)
-        self._nb_requests[request_id].got_reply(msg.copy())
+        req.got_reply(msg.copy())
 
-    def _nb_informcb(self, msg, *userdata):
-        """The callback for request informs. Check that the ID exists and call that request's got_inform function.
+    def _nb_informcb(self, msg, req):
+        """The callback for request informs.
            """
-        request_id = ''.join(userdata)
-        if request_id not in self._nb_requests:
-            raise RuntimeError('Recieved inform for request_id(%s), but no such stored request.' % request_id)
-        self._nb_requests[request_id].got_inform(msg.copy())
+        req.got_inform(msg.copy())
 
     def _nb_request(self, request, inform_cb = None, reply_cb = None, *args):
         """Make a non-blocking request.
            @param self      This object.
            @param request   The request string.
            @param inform_cb An optional callback function, called upon receipt of every inform to the request.
-           @param inform_cb An optional callback function, called upon receipt of the reply to the request.
+           @param reply_cb  An optional callback function, called upon receipt of the reply to the request.
            @param args      Arguments to the katcp.Message object.
+           @return  FpgaAsyncRequest: future for the reply, see FpgaAsyncRequest.result().
            """
-        if len(self._nb_requests) == self._nb_max_requests:
+        if len(self._nb_requests) >= self._nb_max_requests:
             oldreq = self._nb_pop_oldest_request()
-            self._logger.info("Request list full, removing oldest one(%s,%s)." % (oldreq.request, oldreq.request_id))
-            print("Request list full, removing oldest one(%s,%s)." % (oldreq.request, oldreq.request_id))
+            if oldreq is not None:
+                self._logger.debug("Request list full, removing oldest one(%s,%s)." % (oldreq.request, oldreq.request_id))
         request_id = self._nb_get_next_request_id()
-        self._nb_add_request(request, request_id, inform_cb, reply_cb)
-        self.callback_request(msg = Message.request(request, *args), reply_cb = self._nb_replycb, inform_cb = self._nb_informcb, user_data = request_id)
-        return {'host': self.host, 'request': request, 'id': request_id}
+        req = self._nb_add_request(request, request_id, inform_cb, reply_cb)
+        self.callback_request(msg = Message.request(request, *args), reply_cb = self._nb_replycb, inform_cb = self._nb_informcb, user_data = (req,))
+        return req
 
     """**********************************************************************************"""
     """**********************************************************************************"""
 
+    def notify_connected(self, connected):
+        """Called by katcp whenever the connection state changes. Whatever is on the other
+           side of a new connection may not match what we know about the board, so forget it.
+           """
+        self._bitstream = None
+        self._invalidate()
+
+    def _invalidate(self):
+        """Drop the shadow registers and the register map, e.g. after (re)programming."""
+        self._regmap = None
+        if self.cache is not None:
+            self.cache.clear()
+
+    def register_map(self, refresh=False):
+        """Return the typed RegisterMap of the running bitstream. listdev is issued once per
+           bitstream (or once per connection if the bitstream was not loaded by this client).
+
+           @see regmap
+           @param self  This object.
+           @param refresh  Boolean: rebuild the map from a fresh listdev.
+           @return  regmap.RegisterMap object.
+           """
+        if self._regmap is None or refresh:
+            if refresh:
+                regmap._listdev_cache.pop(self._bitstream, None)
+            self._regmap = regmap.load(self, self._bitstream)
+        return self._regmap
+
     def _request(self, name, request_timeout, *args):
         """Make a blocking request and check the result.
 
@@ -200,6 +575,16 @@ class FpgaClient(CallbackClient):
                     % (request.name, request, reply))
         return reply, informs
 
+    def batch(self, timeout=None):
+        """Return a FpgaBatch that pipelines register reads and writes.
+
+           @see FpgaBatch
+           @param self  This object.
+           @param timeout  Float: seconds to wait for the whole batch; defaults to the client timeout.
+           @return  FpgaBatch object.
+           """
+        return FpgaBatch(self, timeout)
+
     def listdev(self):
         """Return a list of register / device names.
 
@@ -235,12 +620,15 @@ class FpgaClient(CallbackClient):
            @param boffile  String: name of the BOF file.
            @return  String: device status.
            """
+        self._bitstream = None
+        self._invalidate()
         if boffile=='' or boffile==None:
             reply, informs = self._request("progdev", self._timeout)
             self._logger.info("Deprogramming FPGA... %s."%(reply.arguments[0]))
         else:
             reply, informs = self._request("progdev", self._timeout, boffile)
             self._logger.info("Programming FPGA with %s... %s."%(boffile,reply.arguments[0]))
+            self._bitstream = boffile
         return reply.arguments[0]
 
     def config_10gbe_core(self,device_name,mac,ip,port,arp_table,gateway=1):
@@ -400,7 +788,10 @@ class FpgaClient(CallbackClient):
             os.path.getsize(bof_file)
         except:
             raise IOError('BOF file not found.')
-        import time, queue
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
         def makerequest(result_queue):
             try:
                 result = self._request('upload', timeout, port)
@@ -456,6 +847,8 @@ class FpgaClient(CallbackClient):
                 time.sleep(0.1)
         if not done:
             raise RuntimeError('BOF file seemed to upload, but is not running?')
+        self._bitstream = None
+        self._invalidate()
 
     def status(self):
         """Return the status of the FPGA.
@@ -508,75 +901,312 @@ class FpgaClient(CallbackClient):
            @param offset  Integer: offset to read data from (in bytes).
            @return  Bindary string: data read.
            """
+        if self.cache is not None:
+            data = self.cache.get(device_name, offset, size)
+            if data is not None:
+                return data
         reply, informs = self._request("read", self._timeout, device_name, str(offset),
             str(size))
+        if self.cache is not None:
+            self.cache.put(device_name, offset, reply.arguments[1])
         return reply.arguments[1]
 
-    def read_dram(self, size, offset=0,verbose=False):
-        """Reads data from a ROACH's DRAM. Reads are done up to 1MB at a time.
+    def bulkread_into(self, device_name, buf, offset=0):
+        """Fill buf with data read using bulkread. Each inform page is copied straight into buf
+           as it arrives, so no intermediate string is built.
+
+           @param self  This object.
+           @param device_name  String: name of device / register to read from.
+           @param buf  Writable buffer: bytearray, memoryview or contiguous numpy array. Its size in bytes is the read size.
+           @param offset  Integer: offset to read data from (in bytes).
+           @return  Integer: number of bytes read.
+           """
+        view = _byte_view(buf)
+        size = len(view)
+        done = threading.Event()
+        state = {'pos': 0, 'reply': None}
+
+        def inform_cb(msg):
+            page = msg.arguments[0]
+            pos = state['pos']
+            view[pos:pos + len(page)] = page
+            state['pos'] = pos + len(page)
+
+        def reply_cb(msg):
+            state['reply'] = msg
+            done.set()
+
+        request = Message.request("bulkread", device_name, str(offset), str(size))
+        self.callback_request(request, reply_cb=reply_cb, inform_cb=inform_cb, timeout=self._timeout)
+        if not done.wait(self._timeout + 1):
+            raise RuntimeError("Request bulkread timed out.\n  Request: %s" % request)
+        reply = state['reply']
+        if reply.arguments[0] != Message.OK:
+            self._logger.error("Request %s failed.\n  Request: %s\n  Reply: %s." % (request.name, request, reply))
+            raise RuntimeError("Request %s failed.\n  Request: %s\n  Reply: %s." % (request.name, request, reply))
+        if state['pos'] != size:
+            raise RuntimeError("Bulkread of %s returned %i bytes, expected %i." % (device_name, state['pos'], size))
+        return size
+
+    def read_into(self, device_name, buf, offset=0):
+        """Fill buf with data read from device_name. Like read() but the reply argument is copied
+           straight into a caller-supplied buffer from the reply callback, so no result string is
+           built or returned and repeated reads of the same size reuse one allocation.
+
+           @param self  This object.
+           @param device_name  String: name of device / register to read from.
+           @param buf  Writable buffer: bytearray, memoryview or contiguous numpy array. Its size in bytes is the read size.
+           @param offset  Integer: offset to read data from (in bytes).
+           @return  Integer: number of bytes read.
+           """
+        view = _byte_view(buf)
+        size = len(view)
+        if self.cache is not None:
+            data = self.cache.get(device_name, offset, size)
+            if data is not None:
+                view[:len(data)] = data
+                return len(data)
+        done = threading.Event()
+        state = {'size': 0, 'reply': None}
+
+        def reply_cb(msg):
+            if msg.arguments[0] == Message.OK:
+                data = msg.arguments[1]
+                view[:len(data)] = data
+                state['size'] = len(data)
+                if self.cache is not None:
+                    self.cache.put(device_name, offset, data)
+            state['reply'] = msg
+            done.set()
+
+        request = Message.request("read", device_name, str(offset), str(size))
+        self.callback_request(request, reply_cb=reply_cb, timeout=self._timeout)
+        if not done.wait(self._timeout + 1):
+            raise RuntimeError("Request read timed out.\n  Request: %s" % request)
+        reply = state['reply']
+        if reply.arguments[0] != Message.OK:
+            self._logger.error("Request %s failed.\n  Request: %s\n  Reply: %s." % (request.name, request, reply))
+            raise RuntimeError("Request %s failed.\n  Request: %s\n  Reply: %s." % (request.name, request, reply))
+        return state['size']
+
+    def read_array(self, device_name, dtype='>u4', count=None, offset=0, out=None, bulk=False):
+        """Read a register / BRAM straight into a numpy array.
+
+           Native or little-endian dtypes are read as big-endian, which is how the FPGA stores them.
+
+           @param self  This object.
+           @param device_name  String: name of device / register to read from.
+           @param dtype  Numpy dtype or string: element type, e.g. '>i4'.
+           @param count  Integer: number of elements. Not needed when out is given.
+           @param offset  Integer: offset to read data from (in bytes).
+           @param out  Numpy array: reused as the destination instead of allocating a new array.
+           @param bulk  Boolean: use bulkread, better for large devices.
+           @return  Numpy array: out, or a new array of count elements.
+           """
+        import numpy as np
+        dtype = np.dtype(dtype)
+        if dtype.itemsize > 1 and dtype.byteorder in '=<':
+            dtype = dtype.newbyteorder('>')
+        if out is None:
+            if count is None:
+                raise ValueError('read_array of %s needs count or out' % device_name)
+            out = np.empty(count, dtype)
+        elif out.dtype != dtype:
+            out = out.view(dtype)
+        if bulk:
+            self.bulkread_into(device_name, out, offset)
+        else:
+            self.read_into(device_name, out, offset)
+        return out
+
+    def _dram_chunks(self, size, offset, chunk):
+        """Split a DRAM transfer into (dram_page, local_offset, length, position) pieces of at most
+           chunk bytes that never cross a 64MB indirect page.
+           """
+        position = 0
+        while position < size:
+            dram_page, local_offset = divmod(offset + position, DRAM_PAGE_SIZE)
+            length = min(chunk, size - position, DRAM_PAGE_SIZE - local_offset)
+            yield dram_page, local_offset, length, position
+            position += length
+
+    def _dram_select_page(self, dram_page):
+        """Non-blocking write of the DRAM indirect page register."""
+        data = struct.pack('>I', dram_page)
+        if self.cache is not None:
+            self.cache.put('dram_controller', 0, data)
+        return self._nb_request('write', None, None, 'dram_controller', '0', data)
+
+    def _iter_dram_pages(self, size, offset, chunk, prefetch, verbose):
+        """Yield (position, informs) for each chunk of a DRAM read, keeping up to prefetch bulkreads
+           in flight behind the one being consumed. Page selects are pipelined in order with the reads.
+           """
+        chunks = self._dram_chunks(size, offset, chunk)
+        pending = collections.deque()
+        last_dram_page = -1
+        try:
+            while True:
+                while len(pending) <= prefetch:
+                    try:
+                        dram_page, local_offset, length, position = next(chunks)
+                    except StopIteration:
+                        break
+                    if verbose: print('Reading %8i bytes from indirect address %4i at local offset %8i...'%(length,dram_page,local_offset))
+                    if last_dram_page != dram_page:
+                        pending.append((None, self._dram_select_page(dram_page)))
+                        last_dram_page = dram_page
+                    pending.append((position, self._nb_request('bulkread', None, None, 'dram_memory', str(local_offset), str(length))))
+                if not pending:
+                    return
+                position, req = pending[0]
+                reply, informs = req.result(self._timeout)
+                pending.popleft()
+                self._nb_pop_request_by_id(req.request_id)
+                if position is not None:
+                    yield position, informs
+        finally:
+            for position, req in pending:
+                self._nb_pop_request_by_id(req.request_id)
+
+    def iter_dram(self, size, offset=0, chunk=1024*1024, prefetch=2, verbose=False):
+        """Stream data from a ROACH's DRAM chunk by chunk. While the caller handles one chunk the
+           next ones are already being fetched, so the link stays busy and memory use stays at a
+           few chunks however large the capture is.
+
+               with open('dram.bin', 'wb') as f:
+                   for data in fpga.iter_dram(512*1024*1024):
+                       f.write(data)
+
+           @param self    This object.
+           @param size    Integer: amount of data to read (in bytes).
+           @param offset  Integer: offset to read data from (in bytes).
+           @param chunk   Integer: bytes per bulkread.
+           @param prefetch  Integer: chunks requested ahead of the one being returned.
+           @return  Generator of binary strings, at most chunk bytes each.
+        """
+        for position, informs in self._iter_dram_pages(size, offset, chunk, prefetch, verbose):
+            yield b''.join([i.arguments[0] for i in informs])
+
+    def read_dram(self, size, offset=0,verbose=False,out=None):
+        """Reads data from a ROACH's DRAM. Reads are done up to 1MB at a time and pipelined.
            The 64MB indirect address register is automatically incremented as necessary.
            It returns a string, as per the normal 'read' function.
            ROACH has a fixed device name for the DRAM (dram memory).
            Uses bulkread internally.
 
+           @see iter_dram
            @param self    This object.
            @param size    Integer: amount of data to read (in bytes).
            @param offset  Integer: offset to read data from (in bytes).
-           @return  Binary string: data read.
+           @param out     Writable buffer of at least size bytes: filled in place instead of building a string.
+           @return  Binary string: data read, or out when given.
         """
         #Modified 2010-01-07 to use bulkread.
-        data=[]
-        n_reads=0
-        last_dram_page = -1
-
-        dram_indirect_page_size=(64*1024*1024)
-        #read_chunk_size=(1024*1024)
         if verbose: print('Reading a total of %8i bytes from offset %8i...'%(size,offset))
+        if out is None:
+            return b''.join(self.iter_dram(size, offset, verbose=verbose))
+        view = _byte_view(out)
+        if len(view) < size:
+            raise ValueError('Buffer of %i bytes is too small for %i bytes of DRAM.' % (len(view), size))
+        self._read_dram_into(view, size, offset, verbose)
+        return out
+
+    def _read_dram_into(self, view, size, offset, verbose=False, progress=None):
+        n_reads = 0
+        for position, informs in self._iter_dram_pages(size, offset, 1024*1024, 2, verbose):
+            for i in informs:
+                page = i.arguments[0]
+                view[position:position + len(page)] = page
+                position += len(page)
+                n_reads += len(page)
+            if progress is not None:
+                progress(n_reads)
+        if n_reads != size:
+            raise RuntimeError('DRAM read returned %i bytes, expected %i.' % (n_reads, size))
+
+    def dram_to_file(self, path, size, offset=0, verbose=False):
+        """Dump DRAM straight into a file through a numpy memmap, without holding the capture in memory.
 
-        while n_reads < size:
-            dram_page=(offset+n_reads)/dram_indirect_page_size
-            local_offset = (offset+n_reads)%(dram_indirect_page_size)
-            #local_reads = min(read_chunk_size,size-n_reads,dram_indirect_page_size-(offset%dram_indirect_page_size))
-            local_reads = min(size-n_reads,dram_indirect_page_size-(offset%dram_indirect_page_size))
-            if verbose: print('Reading %8i bytes from indirect address %4i at local offset %8i...'%(local_reads,dram_page,local_offset))
-            if last_dram_page != dram_page:
-                self.write_int('dram_controller',dram_page)
-                last_dram_page = dram_page
-            local_data=(self.bulkread('dram_memory',local_reads,local_offset))
-            data.append(local_data)
-            #print 'done'
-            n_reads += local_reads
-        return ''.join(data)
-
-    def write_dram(self, data, offset=0,verbose=False):
-        """Writes data to a ROACH's DRAM. Writes are done up to 512KiB at a time.
+           @param self    This object.
+           @param path    String: file to create (overwritten if it exists).
+           @param size    Integer: amount of data to read (in bytes).
+           @param offset  Integer: offset to read data from (in bytes).
+           @return  numpy.memmap: the file contents as uint8.
+        """
+        import numpy as np
+        mm = np.memmap(path, dtype=np.uint8, mode='w+', shape=(size,))
+        start_time = time.time()
+        def progress(n_reads):
+            if verbose:
+                elapsed = max(time.time() - start_time, 1e-6)
+                print('Read %10i of %10i bytes, %7.2f MB/s' % (n_reads, size, n_reads / elapsed / 1e6))
+        self._read_dram_into(_byte_view(mm), size, offset, progress=progress)
+        mm.flush()
+        return mm
+
+    def write_dram(self, data, offset=0,verbose=False,window=8,chunk=512*1024):
+        """Writes data to a ROACH's DRAM. Writes are done up to 512KiB at a time, with up to
+           window chunks in flight so the link never idles waiting for a reply.
            The 64MB indirect address register is automatically incremented as necessary.
            ROACH has a fixed device name for the DRAM (dram memory) and so the user does not need to specify the write register.
 
+           @see write_dram_file
            @param self    This object.
-           @param data    Binary packed string to write.
-           @param offset  Integer: offset to read data from (in bytes).
-           @return  Binary string: data read.
+           @param data    Binary packed string, or any buffer: bytearray, memoryview, numpy array or memmap.
+           @param offset  Integer: offset to write data to (in bytes).
+           @param verbose Boolean: print progress and the achieved throughput.
+           @param window  Integer: chunks written ahead of the oldest unacknowledged one.
+           @param chunk   Integer: bytes per write request.
+           @return  Float: achieved throughput in MB/s.
         """
-        size=len(data)
-        n_writes=0
-        last_dram_page = -1
-
-        dram_indirect_page_size=(64*1024*1024)
-        write_chunk_size=(1024*512)
+        view = _byte_view(data, writable=False)
+        size = len(view)
+        if size % 4 or offset % 4:
+            raise ValueError('You must write 32bit-bounded words!')
         if verbose: print('writing a total of %8i bytes from offset %8i...'%(size,offset))
 
-        while n_writes < size:
-            dram_page=(offset+n_writes)/dram_indirect_page_size
-            local_offset = (offset+n_writes)%(dram_indirect_page_size)
-            local_writes = min(write_chunk_size,size-n_writes,dram_indirect_page_size-(offset%dram_indirect_page_size))
-            if verbose: print('Writing %8i bytes from indirect address %4i at local offset %8i...'%(local_writes,dram_page,local_offset))
-            if last_dram_page != dram_page:
-                self.write_int('dram_controller',dram_page)
-                last_dram_page = dram_page
-
-            self.blindwrite('dram_memory',data[n_writes:n_writes+local_writes],local_offset)
-            n_writes += local_writes
+        pending = collections.deque()
+        last_dram_page = -1
+        n_writes = 0
+        start_time = last_report = time.time()
+        try:
+            for dram_page, local_offset, length, position in self._dram_chunks(size, offset, chunk):
+                if last_dram_page != dram_page:
+                    pending.append((0, self._dram_select_page(dram_page)))
+                    last_dram_page = dram_page
+                pending.append((length, self._nb_request('write', None, None, 'dram_memory', str(local_offset),
+                                                         view[position:position + length].tobytes())))
+                while len(pending) > window:
+                    n_writes += self._dram_complete(pending.popleft())
+                if verbose and time.time() - last_report >= 1:
+                    last_report = time.time()
+                    print('Written %10i of %10i bytes, %7.2f MB/s' % (n_writes, size, n_writes / (last_report - start_time) / 1e6))
+            while pending:
+                n_writes += self._dram_complete(pending.popleft())
+        finally:
+            for length, req in pending:
+                self._nb_pop_request_by_id(req.request_id)
+        rate = size / max(time.time() - start_time, 1e-6) / 1e6
+        if verbose: print('Wrote %i bytes at %.2f MB/s' % (size, rate))
+        return rate
+
+    def _dram_complete(self, item):
+        length, req = item
+        req.result(self._timeout)
+        self._nb_pop_request_by_id(req.request_id)
+        return length
+
+    def write_dram_file(self, path, offset=0, verbose=False, window=8, chunk=512*1024):
+        """Load a file into a ROACH's DRAM. The file is memory-mapped, not read into memory.
+
+           @see write_dram
+           @param self    This object.
+           @param path    String: file holding the binary packed data.
+           @param offset  Integer: offset to write data to (in bytes).
+           @return  Float: achieved throughput in MB/s.
+        """
+        import numpy as np
+        return self.write_dram(np.memmap(path, dtype=np.uint8, mode='r'), offset, verbose, window, chunk)
 
     def write(self, device_name, data, offset=0):
         """Should issue a read command after the write and compare return to
@@ -591,9 +1221,15 @@ class FpgaClient(CallbackClient):
            @param data  Byte string: data to write.
            @param offset  Integer: offset to write data to (in bytes)
            """
+        if self.cache is not None and self.cache.unchanged(device_name, offset, data):
+            return
         self.blindwrite(device_name, data, offset)
-        new_data = self.read(device_name, len(data), offset)
+        # Read back from the board, never from the cache
+        reply, informs = self._request("read", self._timeout, device_name, str(offset), str(len(data)))
+        new_data = reply.arguments[1]
         if new_data != data:
+            if self.cache is not None:
+                self.cache.put(device_name, offset, new_data)
 
             unpacked_wrdata=struct.unpack('>L',data[0:4])[0]
             unpacked_rddata=struct.unpack('>L',new_data[0:4])[0]
@@ -615,7 +1251,11 @@ class FpgaClient(CallbackClient):
         assert (type(data)==bytes) , 'You need to supply binary packed bytes data!'
         assert (len(data)%4) ==0 , 'You must write 32bit-bounded words!'
         assert ((offset%4) ==0) , 'You must write 32bit-bounded words!'
+        if self.cache is not None and self.cache.unchanged(device_name, offset, data):
+            return
         self._request("write", self._timeout, device_name, str(offset), data)
+        if self.cache is not None:
+            self.cache.put(device_name, offset, data)
 
     def read_int(self, device_name, offset=0):
         """Calls .read() command with size=4, offset=0 and
@@ -990,7 +1630,7 @@ class FpgaClient(CallbackClient):
         self.write_int(dev_name + '_ctrl', (0 + (man_trig<<1) + (man_valid<<2) + (circular_capture<<3)))
         self.write_int(dev_name + '_ctrl', (1 + (man_trig<<1) + (man_valid<<2) + (circular_capture<<3)))
 
-    def snapshot_get(self, dev_name, man_trig=False, man_valid=False, wait_period=1, offset=-1, circular_capture=False, get_extra_val=False, arm=True):
+    def snapshot_get(self, dev_name, man_trig=False, man_valid=False, wait_period=1, offset=-1, circular_capture=False, get_extra_val=False, arm=True, out=None):
         """Grabs all brams from a single snap block on this FPGA device.\n
             \tdev_name: string, name of the snap block.\n
             \tman_trig: boolean, Trigger the snap block manually.\n
@@ -1000,7 +1640,9 @@ class FpgaClient(CallbackClient):
             \tRETURNS: dictionary with keywords: \n
             \t\tlengths: number of bytes captured.\n
             \t\toffset: number of bytes since last trigger.\n
-            \t\tdata: list of data from each fpga for corresponding bram.\n"""
+            \t\tdata: list of data from each fpga for corresponding bram.\n
+            \tout: writable buffer (bytearray, numpy array) reused for the data instead of allocating a new string.\n
+            \t\tdata is then a view of its first length bytes.\n"""
         # new snapshot block support (bytes instead of words) with hardware-configurable datawidth and user-selectable features.
         #TODO Test offset, get_extra_val and circular capture modes.
         if arm:
@@ -1037,6 +1679,12 @@ class FpgaClient(CallbackClient):
 
         if (bram_size == 0):
             bram_dmp['data']=[]
+        elif out is not None:
+            view = _byte_view(out)
+            if len(view) < bram_size:
+                raise ValueError("Buffer of %i bytes is too small for the %i bytes captured by %s." % (len(view), bram_size, dev_name))
+            self.read_into(dev_name+'_bram', view[:bram_size])
+            bram_dmp['data']=_data_view(out, bram_size)
         else:
             bram_dmp['data']=(self.read(dev_name+'_bram',(bram_size)))
 
@@ -1045,5 +1693,118 @@ class FpgaClient(CallbackClient):
 
         return bram_dmp
 
+    def snapshot_get_many(self, names, man_trig=False, man_valid=False, wait_period=1, offset=-1, circular_capture=False, get_extra_val=False, arm=True, out=None, timings=None):
+        """Capture several snap blocks at once. All of them are armed in one pipelined batch, their
+           status registers are polled together with a growing poll interval, and all BRAMs are read
+           in one batch, so n scopes cost about one capture and one read instead of n.
+
+               snaps = fpga.snapshot_get_many([('zdok0_scope', {'man_trig': True}),
+                                               'u0_x4_vacc_scope_AA', 'u0_x4_vacc_scope_BB'], man_valid=True)
+               adc = snaps['zdok0_scope']['data']
+
+           @see snapshot_get
+           @param self  This object.
+           @param names  List: snap block names, or (name, dict) pairs whose dict overrides the man_trig,
+                         man_valid, offset and circular_capture arguments for that block.
+           @param out  Dictionary: name -> writable buffer reused for that block's data, as in snapshot_get.
+           @param timings  Dictionary: if given, the seconds spent arming, polling and reading are stored
+                           under 'arm', 'poll' and 'read'.
+           @return  OrderedDict: name -> dictionary as returned by snapshot_get.
+           """
+        defaults = {'man_trig': man_trig, 'man_valid': man_valid, 'offset': offset, 'circular_capture': circular_capture}
+        scopes = collections.OrderedDict()
+        for name in names:
+            options = dict(defaults)
+            if not isinstance(name, str):
+                name, overrides = name
+                options.update(overrides)
+            scopes[name] = options
+        out = out or {}
+
+        t_arm = time.time()
+        if arm:
+            with self.batch() as b:
+                for name, o in scopes.items():
+                    ctrl = (o['man_trig']<<1) + (o['man_valid']<<2) + (o['circular_capture']<<3)
+                    if o['offset'] >= 0:
+                        b.write_int(name + '_trig_offset', o['offset'])
+                    b.write_int(name + '_ctrl', ctrl)
+                    b.write_int(name + '_ctrl', 1 + ctrl)
+
+        sizes = {}
+        waiting = list(scopes)
+        poll_interval = 0.001
+        start_time = time.time()
+        while waiting:
+            with self.batch() as b:
+                polls = [b.read_uint(name + '_status') for name in waiting]
+            for name, index in zip(waiting, polls):
+                addr = b.results[index]
+                if not addr & 0x80000000:
+                    sizes[name] = addr & 0x7fffffff
+            waiting = [name for name in waiting if name not in sizes]
+            if waiting and 0 <= wait_period <= time.time() - start_time:
+                raise RuntimeError("Snap blocks %s didn't finish capturing in the allotted %2.2f seconds." % (', '.join(waiting), wait_period))
+            if waiting:
+                time.sleep(poll_interval)
+                poll_interval = min(poll_interval * 2, 0.05)
+
+        t_read = time.time()
+        with self.batch() as b:
+            reads = {}
+            for name, o in scopes.items():
+                reads[name] = {'status': b.read_uint(name + '_status')}
+                if sizes[name]:
+                    reads[name]['data'] = b.read(name + '_bram', sizes[name])
+                if o['circular_capture']:
+                    reads[name]['tr_en_cnt'] = b.read_uint(name + '_tr_en_cnt')
+                if get_extra_val:
+                    reads[name]['val'] = b.read_uint(name + '_val')
+        if timings is not None:
+            timings.update(arm=start_time - t_arm, poll=t_read - start_time, read=time.time() - t_read)
+
+        snaps = collections.OrderedDict()
+        for name, o in scopes.items():
+            bram_size = sizes[name]
+            results = dict((key, b.results[index]) for key, index in reads[name].items())
+            if (bram_size != results['status'] & 0x7fffffff) or bram_size == 0:
+                raise RuntimeError("A snap block logic error occurred or %s didn't finish capturing in the allotted %2.2f seconds. Reported %i bytes captured." % (name, wait_period, bram_size))
+            bram_dmp = {'length': bram_size}
+            bram_dmp['offset'] = max(0, (results['tr_en_cnt'] - bram_size if o['circular_capture'] else 0) + o['offset'])
+            if name in out:
+                view = _byte_view(out[name])
+                if len(view) < bram_size:
+                    raise ValueError("Buffer of %i bytes is too small for the %i bytes captured by %s." % (len(view), bram_size, name))
+                view[:bram_size] = results['data']
+                bram_dmp['data'] = _data_view(out[name], bram_size)
+            else:
+                bram_dmp['data'] = results['data']
+            if get_extra_val:
+                bram_dmp['val'] = results['val']
+            snaps[name] = bram_dmp
+        return snaps
+
+def _byte_view(buf, writable=True):
+    """Return a memoryview of buf with one byte per item."""
+    if hasattr(buf, 'dtype'):
+        if not buf.flags.c_contiguous:
+            raise ValueError('Only contiguous arrays can be used as buffers')
+        buf = buf.reshape(-1).view('uint8')
+    view = memoryview(buf)
+    if writable and view.readonly:
+        raise ValueError('Can not read into a read-only buffer')
+    if view.itemsize != 1:
+        view = view.cast('B')
+    return view
+
+def _data_view(buf, size):
+    """Return the first size bytes of buf without copying, as an object numpy.frombuffer and struct accept."""
+    if hasattr(buf, 'dtype'):
+        return buf.reshape(-1).view('uint8')[:size]
+    try:
+        return buffer(buf, 0, size)
+    except (NameError, TypeError):
+        return memoryview(buf)[:size]
+
 def ip_to_a(ip):
     return '%i.%i.%i.%i'%((ip>>24),((ip&(0xff<<16))>>16),((ip&(0xff<<8))>>8),(ip&(0xff)))
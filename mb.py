@@ -2,7 +2,7 @@
 
 import time, struct, sys, logging, socket
 import katcp_wrapper, log_handlers
-import katadc
+import katadc, snapdecode
 import argparse
 import pyqtgraph as pg
 import numpy as np
@@ -61,22 +61,14 @@ def init_10gbe(dev, ip, port, dest_ip, dest_port):
 	dest_ip_addr, = struct.unpack('!L',socket.inet_aton(dest_ip))
 	print('Configuring %s destination IP and port %s:%i ... ' %
 			(dev, socket.inet_ntoa(struct.pack('!L', dest_ip_addr)), dest_port)),
-	fpga.write_int(dev + '_dest_ip', dest_ip_addr)
-	fpga.write_int(dev + '_dest_port', dest_port)
+	with fpga.batch() as b:
+		b.write_int(dev + '_dest_ip', dest_ip_addr)
+		b.write_int(dev + '_dest_port', dest_port)
+		# Workaround for tgtap:
+		#   write destination ip address entry in arp table to all 0 mac address
+		#   instead of broadcast address filled by tgtap
+		b.write(devname, '\0'*8, 0x3000 + 8 * (dest_ip_addr & 0xFF))
 	print('done')
-	# Workaround for tgtap:
-	#   write destination ip address entry in arp table to all 0 mac address
-	#   instead of broadcast address filled by tgtap
-	fpga.write(devname, '\0'*8, 0x3000 + 8 * (dest_ip_addr & 0xFF))
-
-
-def split_snapshot(snap):
-	len = snap['length']
-	all = struct.unpack('%db'%len, snap['data'])
-	segments = np.array(all).reshape(-1, 4)
-	p0 = segments[0::2, :].flatten()
-	p1 = segments[1::2, :].flatten()
-	return p0, p1
 
 
 def plot_anim():
@@ -87,7 +79,7 @@ def plot_anim():
 		# ADC histogram
 		print('zdok%d_scope' % u)
 		snap = fpga.snapshot_get('zdok%d_scope' % u, man_trig=True, man_valid=True)
-		adc0, adc1 = split_snapshot(snap)
+		adc0, adc1 = snapdecode.decode('zdok%d_scope' % u, snap)
 		y, x = np.histogram(adc0, 100)
 		lines[u*2 + 0].setData(x, y)
 		y, x = np.histogram(adc1, 100)
@@ -98,7 +90,7 @@ def plot_anim():
 			scopename = unit + '_x4_vacc_scope_' + spec_scope_names[i-2]
 			print(scopename)
 			snap = fpga.snapshot_get(scopename, man_valid=True)
-			speclin = np.array(struct.unpack('>%dI' % (snap['length']/4), snap['data']))
+			speclin = snapdecode.decode(scopename, snap)
 			speclog = np.log2(speclin+1)
 			lines[4*u + 2+i].setData(speclog)
 			idx = np.argmax(speclog)
@@ -107,7 +99,7 @@ def plot_anim():
 			scopename = unit + '_x4_vacc_scope_' + spec_scope_names[i-2]
 			print(scopename)
 			snap = fpga.snapshot_get(scopename, man_valid=True)
-			speclin = np.array(struct.unpack('>%di' % (snap['length']/4), snap['data']))
+			speclin = snapdecode.decode(scopename, snap)
 			speclog = np.log2(np.fabs(speclin)+1)
 			lines[4*u + 2+i].setData(speclog)
 			idx = np.argmax(speclog)
@@ -152,25 +144,16 @@ if __name__ == '__main__':
 					rf = katadc.rf_fe_get(fpga, zdok, inp)
 					print(rf)
 
-		for unit in ('u0', 'u1'):
-			print('Configuring spectrometer "%s" fft_shift, fft_shift=0x%X ... ' % (unit, opts.fftshift)),
-			fpga.write_int(unit + '_fft_shift', int(opts.fftshift))
-			print('done')
-
-			print('Configuring spectrometer "%s" scale coefficients, gain=0x%X ... ' % (unit, opts.gain)),
-			fpga.write_int(unit + '_gain', opts.gain) # in 16_8-16_8 format
-			print('done')
-
-			print('Configuring spectrometer "%s" bit selection, bit_select=0x%X ... ' % (unit, opts.bitsel)),
-			fpga.write_int(unit + '_bit_select', opts.bitsel)
-			print('done')
-
-			print('Configuring spectrometer "%s" accumulation length, acc_len=%d ... ' % (unit, opts.acclen)),
-			fpga.write_int(unit + '_acc_len',opts.acclen)
-			print('done')
-
-
-		fpga.write_int('use_tvg', 0b00)
+		print('Configuring spectrometers fft_shift=0x%X, gain=0x%X, bit_select=0x%X, acc_len=%d ... ' %
+				(opts.fftshift, opts.gain, opts.bitsel, opts.acclen)),
+		with fpga.batch() as b:
+			for unit in ('u0', 'u1'):
+				b.write_int(unit + '_fft_shift', int(opts.fftshift))
+				b.write_int(unit + '_gain', opts.gain) # in 16_8-16_8 format
+				b.write_int(unit + '_bit_select', opts.bitsel)
+				b.write_int(unit + '_acc_len',opts.acclen)
+			b.write_int('use_tvg', 0b00)
+		print('done')
 
 		init_10gbe('xgbe0', '192.168.16.221', 33333, '239.2.3.1', 12345)
 		init_10gbe('xgbe1', '192.168.16.222', 33333, '239.2.3.2', 12345)
@@ -2,7 +2,7 @@
 
 import time, struct, sys, logging, socket
 import katcp_wrapper, log_handlers
-import katadc
+import katadc, snapdecode
 import argparse
 import pyqtgraph as pg
 import numpy as np
@@ -70,15 +70,6 @@ def init_10gbe(dev, ip, port, dest_ip, dest_port):
 	fpga.write(devname, '\0'*8, 0x3000 + 8 * (dest_ip_addr & 0xFF))
 
 
-def split_snapshot(snap):
-	len = snap['length']
-	all = struct.unpack('%db'%len, snap['data'])
-	segments = np.array(all).reshape(-1, 4)
-	p0 = segments[0::2, :].flatten()
-	p1 = segments[1::2, :].flatten()
-	return p0, p1
-
-
 def plot_anim():
 	global fpga, plts, lines
 	#for u in range(0, 2):
@@ -88,7 +79,7 @@ def plot_anim():
 		# ADC histogram
 		print('zdok%d_scope' % u)
 		snap = fpga.snapshot_get('zdok%d_scope' % u, man_trig=True, man_valid=True)
-		adc0, adc1 = split_snapshot(snap)
+		adc0, adc1 = snapdecode.decode('zdok%d_scope' % u, snap)
 		y, x = np.histogram(adc0, 100)
 		lines[u*2 + 0].setData(x, y)
 		y, x = np.histogram(adc1, 100)
@@ -99,7 +90,7 @@ def plot_anim():
 			scopename = unit + '_x4_vacc_scope_' + spec_scope_names[i-2]
 			print(scopename)
 			snap = fpga.snapshot_get(scopename, man_valid=True)
-			speclin = np.array(struct.unpack('>%dI' % (snap['length']/4), snap['data']))
+			speclin = snapdecode.decode(scopename, snap)
 			speclog = np.log2(speclin+1)
 			lines[4*u + 2+i].setData(speclog)
 			idx = np.argmax(speclog)
@@ -108,7 +99,7 @@ def plot_anim():
 			scopename = unit + '_x4_vacc_scope_' + spec_scope_names[i-2]
 			print(scopename)
 			snap = fpga.snapshot_get(scopename, man_valid=True)
-			speclin = np.array(struct.unpack('>%di' % (snap['length']/4), snap['data']))
+			speclin = snapdecode.decode(scopename, snap)
 			speclog = np.log2(np.fabs(speclin)+1)
 			lines[4*u + 2+i].setData(speclog)
 			idx = np.argmax(speclog)
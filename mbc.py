@@ -11,52 +11,280 @@
 from __future__ import print_function
 
 import time
+_startup = [('start', time.time())]
+import sys
 import socket
 import datetime
 import random
 import struct
 import logging
 import os.path
+import importlib
 import threading
-import numpy as np
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+_startup.append(('stdlib', time.time()))
+# pyqtgraph imports numpy itself, so numpy is part of this step whatever mbc defers
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
+_startup.append(('pyqtgraph (with numpy)', time.time()))
 
-import katadc
-import katcp_wrapper
+# The window is built around the Plotter, so mbv can not wait
 from mbv import Plotter
+_startup.append(('mbv', time.time()))
+
+
+class LazyModule(object):
+    """Stand-in for a module that is imported on first attribute access."""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            t0 = time.time()
+            self._module = importlib.import_module(self._name)
+            _startup.append(('import %s (deferred, %.0f ms)' % (self._name, (time.time() - t0) * 1e3), time.time()))
+        return getattr(self._module, attr)
+
+# Board access is only needed once a board is selected
+katcp_wrapper = LazyModule('katcp_wrapper')
+katadc = LazyModule('katadc')
+snapdecode = LazyModule('snapdecode')
+snapring = LazyModule('snapring')
 
 GODMODE = True
+SHOW_WATERFALL = True            # Waterfall panel of the four spectrum products
+WATERFALL_BYTES = 64*2**20       # Memory for the waterfall history of all four products
 
 FPGA_CLOCK = 250e6              # Hz
 SCOPE_IDLE_FLAG = 0x12345678
-POLLING_INTERVAL = 1             # Second
+MIN_POLLING_INTERVAL = 0.1       # Second, fastest scope refresh
+POLLING_HEADROOM = 1.25          # Poll period over the measured acquisition plus render time
+RING_DEPTH = 64                  # Captures kept per scope
+CONNECT_TIMEOUT = 3              # Second
+WRITE_QUIET_PERIOD = 0.3         # Second a register must stay unchanged before it is written
+PENDING_STYLE = 'background-color: #FFF0A0'   # Widgets whose board operation has not completed yet
+STOKES = ('AA', 'BB', 'CR', 'CI')
+
+# Registers only written by this software, safe to shadow in the FpgaClient cache
+STATIC_REGISTERS = ('u?_beam_id', 'u?_fft_shift', 'u?_gain', 'u?_acc_len', 'u?_bit_select',
+                    'xgbe?_dest_ip', 'xgbe?_dest_port', 'use_tvg',
+                    'noisecal_delay*', 'noisecal_on*', 'noisecal_off*')
 
 roach_list = ['r1745', 'r1746', 'r1747', 'r1748', 'r1749', 'r1750',
               'r1801', 'r1802', 'r1803', 'r1805', 'r1806', 'r1807','10.0.1.168']
 
+class FrameMailbox(object):
+    """Latest-frame-wins hand over from the poller thread to the GUI thread.
+
+       post() replaces a frame the GUI has not taken yet, counting it as dropped, and returns
+       True only when the mailbox was empty, so the poller emits at most one pending signal.
+       The GUI reports how long it took to render a frame with rendered().
+       """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame = None
+        self.posted = 0
+        self.dropped = 0
+        self.render_time = 0.0
+
+    def post(self, frame):
+        with self._lock:
+            empty = self._frame is None
+            if not empty:
+                self.dropped += 1
+            self._frame = frame
+            self.posted += 1
+        return empty
+
+    def take(self):
+        with self._lock:
+            frame, self._frame = self._frame, None
+        return frame
+
+    def rendered(self, seconds):
+        # Smoothed so one slow frame does not stall the poller
+        self.render_time = seconds if not self.render_time else 0.8 * self.render_time + 0.2 * seconds
+
+
+class BoardWorker(QtCore.QObject):
+    """Runs board operations one at a time, in submission order, on a thread of its own.
+
+       submit(fn, done, failed) queues fn; once it has run, done(result) or failed(exception) is
+       called on the GUI thread through a queued Qt signal, so GUI handlers never wait on katcp.
+       """
+    sig_finished = QtCore.pyqtSignal(object, object, object, name='sigFinished')
+
+    def __init__(self, parent=None):
+        super(BoardWorker, self).__init__(parent)
+        self._jobs = queue.Queue()
+        # Created on the GUI thread, so the signal emitted by the worker thread is delivered there
+        self.sig_finished.connect(self._deliver)
+        self._thread = threading.Thread(target=self._run, name='mbc-worker')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, fn, done=None, failed=None):
+        self._jobs.put((fn, done, failed))
+
+    def stop(self, discard=True):
+        """Wait for the running operation, dropping those not started yet unless discard is False."""
+        try:
+            while discard:
+                self._jobs.get_nowait()
+        except queue.Empty:
+            pass
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            try:
+                result, error = job[0](), None
+            except Exception as e:
+                result, error = None, e
+            self.sig_finished.emit(job, result, error)
+
+    def _deliver(self, job, result, error):
+        fn, done, failed = job
+        if error is not None:
+            if failed:
+                failed(error)
+            else:
+                logging.getLogger('mbc').error('%s', error)
+        elif done:
+            done(result)
+
+
+class WriteCoalescer(QtCore.QObject):
+    """Debounces board writes per register on the GUI thread.
+
+       defer(key, fn) holds fn back until key had no new write for the quiet period, so a burst of
+       changes, e.g. scrolling a spinbox, becomes one write of the final value. A follow up given
+       as then=(name, fn), such as the reset an acc_len change needs, is submitted once, after
+       every held back write that asked for it.
+
+       @param submit  Callable(fn, widgets) queueing fn on the board worker.
+       @param quiet  Float: default quiet period in seconds.
+       """
+    def __init__(self, submit, quiet=WRITE_QUIET_PERIOD, parent=None):
+        super(WriteCoalescer, self).__init__(parent)
+        self.submit = submit
+        self.quiet = quiet
+        self.deferred = 0
+        self.submitted = 0
+        self._writes = {}
+        self._follow_ups = {}
+        self._timers = {}
+
+    def __len__(self):
+        return len(self._writes)
+
+    def defer(self, key, fn, widgets=(), then=None, quiet=None):
+        """Write with fn once key stayed unchanged for quiet seconds, replacing a held back fn."""
+        self.deferred += 1
+        self._writes[key] = (fn, widgets)
+        if then is not None:
+            name, follow_up = then
+            self._follow_ups.setdefault(name, [None, set()])
+            self._follow_ups[name][0] = follow_up
+            self._follow_ups[name][1].add(key)
+        timer = self._timers.get(key)
+        if timer is None:
+            timer = self._timers[key] = QtCore.QTimer(self)
+            timer.setSingleShot(True)
+            timer.timeout.connect(lambda: self._submit(key))
+        timer.start(int(1000 * (self.quiet if quiet is None else quiet)))
+
+    def flush(self):
+        """Submit every held back write now, e.g. before switching to another board."""
+        for key in list(self._writes):
+            self._timers[key].stop()
+            self._submit(key)
+
+    def _submit(self, key):
+        if key not in self._writes:
+            return
+        fn, widgets = self._writes.pop(key)
+        self.submitted += 1
+        self.submit(fn, widgets)
+        for name in list(self._follow_ups):
+            follow_up, keys = self._follow_ups[name]
+            keys.discard(key)
+            if not keys:
+                del self._follow_ups[name]
+                self.submitted += 1
+                self.submit(follow_up, ())
+
+
+def load_ui_type(ui_file):
+    """Return (form class, base class) of a Qt Designer file like pg.Qt.loadUiType, but compile it
+       to a Python module next to it (<name>_ui.py) once and import that on later launches.
+       Falls back to loadUiType when no uic compiler is available or the directory is read-only.
+       """
+    directory, name = os.path.split(os.path.splitext(ui_file)[0])
+    module_name = name + '_ui'
+    cache = os.path.join(directory, module_name + '.py')
+    try:
+        if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(ui_file):
+            try:
+                from PyQt5 import uic
+            except ImportError:
+                from PyQt4 import uic
+            with open(cache + '.tmp', 'w') as f:
+                uic.compileUi(ui_file, f)
+            os.rename(cache + '.tmp', cache)
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        module = importlib.import_module(module_name)
+        form = [v for k, v in vars(module).items() if k.startswith('Ui_')][0]
+        # The base class is the top level widget of the form, e.g. <widget class="QWidget" name="MainForm">
+        with open(ui_file) as f:
+            for line in f:
+                if '<widget class=' in line:
+                    base = line.split('"')[1]
+                    break
+        return form, getattr(QtGui, base)
+    except (ImportError, IOError, OSError, IndexError, AttributeError) as e:
+        logging.getLogger('mbc').debug('Compiled UI cache unavailable (%s), parsing %s', e, ui_file)
+        return pg.Qt.loadUiType(ui_file)
+
+
 # Define main window class from template
 path = os.path.dirname(os.path.abspath(__file__))
 uiFile = os.path.join(path, 'mbc.ui')
-WindowTemplate, TemplateBaseClass = pg.Qt.loadUiType(uiFile)
+WindowTemplate, TemplateBaseClass = load_ui_type(uiFile)
+_startup.append(('ui', time.time()))
 
 class MainForm(TemplateBaseClass):
 
-    sig_update_plot = QtCore.pyqtSignal(tuple, list, name='sigUpdatePlot')
-    #sig_update_plot = QtCore.Signal(tuple, list, name='sigUpdatePlot')    
+    sig_update_plot = QtCore.pyqtSignal(name='sigUpdatePlot')
+    #sig_update_plot = QtCore.Signal(name='sigUpdatePlot')
 
     def __init__(self):
         super(TemplateBaseClass, self).__init__()
 
         self.setup_ui()
 
-        self.plotter = Plotter(self.ui.plot_area)
+        if SHOW_WATERFALL:
+            self.waterfall_area = pg.GraphicsLayoutWidget(self)
+            self.ui.horizontalLayout.addWidget(self.waterfall_area)
+            self.plotter = Plotter(self.ui.plot_area, waterfall_glw=self.waterfall_area, waterfall_bytes=WATERFALL_BYTES)
+        else:
+            self.plotter = Plotter(self.ui.plot_area)
         self.label_clkstate = self.ui.plot_area.addLabel('', row=4, col=0, justify='left')
         self.label_lastupdate = self.ui.plot_area.addLabel('', row=4, col=1, justify='right')
 
         self.sig_update_plot.connect(self.on_update_plot)
 
         self.fpga = None
+        self.roach = None
         self.unit = 0
         self.prefix = 'u%d_' % self.unit
 
@@ -65,10 +293,19 @@ class MainForm(TemplateBaseClass):
         self.id = random.getrandbits(32)
         log.info('Unique id = %x' % self.id)
 
-        # For polling scopes
+        # For polling scopes; captures go to the ring, consumers read them from there. Created
+        # with the first poller thread, so snapring is not imported before a board is selected
+        self.ring = None
+        self.mailbox = FrameMailbox()
         self.poller_thread = None
         self.poller_event = threading.Event()
 
+        # Board requests of the GUI handlers run in order on the worker, never on the Qt thread
+        self.worker = BoardWorker(self)
+        self.pending = {}
+        # Register writes wait for the widget to settle; bursts collapse into one write
+        self.coalescer = WriteCoalescer(self.submit_op, parent=self)
+
     def setup_ui(self):
         # Create the main window
         self.ui = WindowTemplate()
@@ -129,6 +366,9 @@ class MainForm(TemplateBaseClass):
         for i in range(4):
             getattr(self.ui, 'edt_fabric_ip_{:d}'.format(i)).setValidator(v)
 
+        self.disable_board_widgets()
+
+    def disable_board_widgets(self):
         # Disable all widgets except the Roach board combobox
         interactive_widget_prefixes = ('edt', 'cbo', 'cb', 'rb', 'spn', 'btn')
         for name, obj in vars(self.ui).iteritems():
@@ -141,21 +381,92 @@ class MainForm(TemplateBaseClass):
 
     def closeEvent(self, event):
         self.stop_poller_thread()
+        self.coalescer.flush()
+        self.worker.stop(discard=False)
         self.disconnect_fpga()
 
+    def board_op(self, fn, widgets=(), done=None):
+        """Run fn on the board worker, showing widgets as pending until it completed.
+
+           Writes still held back by the coalescer are submitted first, so the board sees the
+           operations in the order the user made them.
+
+           @param fn  Callable making the katcp requests, run on the worker thread.
+           @param widgets  Widgets waiting for the operation.
+           @param done  Callable given the result of fn, run on the GUI thread.
+           """
+        self.coalescer.flush()
+        self.submit_op(fn, widgets, done)
+
+    def submit_op(self, fn, widgets=(), done=None):
+        # board_op without the flush, for the coalescer itself
+        for widget in widgets:
+            self.pending[widget] = self.pending.get(widget, 0) + 1
+            widget.setStyleSheet(PENDING_STYLE)
+
+        def settle():
+            for widget in widgets:
+                self.pending[widget] -= 1
+                if not self.pending[widget]:
+                    del self.pending[widget]
+                    widget.setStyleSheet('')
+
+        def on_done(result):
+            settle()
+            if done:
+                done(result)
+
+        def on_failed(error):
+            settle()
+            log.error('%s', error)
+
+        self.worker.submit(fn, on_done, on_failed)
+
+    @staticmethod
+    def open_fpga(roach):
+        fpga = katcp_wrapper.FpgaClient(roach, cache=True)
+        fpga.cache.add_static(STATIC_REGISTERS)
+        if not fpga.wait_connected(CONNECT_TIMEOUT):
+            fpga.stop()
+            raise RuntimeError('Can not connect to %s' % roach)
+        return fpga
+
     def connect_fpga(self, roach):
-        self.disconnect_fpga()
+        """Queue the connection to roach and the read back of its settings, then start polling."""
+        previous, self.fpga, self.roach = self.fpga, None, None
+        unit = self.unit
         log.info('Connecting to %s', roach)
-        self.fpga = katcp_wrapper.FpgaClient(roach)
-        time.sleep(0.5)
-        if not self.fpga.is_connected():
-            msg = 'Can not connect to %s' % roach
-            log.warn(msg)
-            self.fpga.stop()
-            self.fpga = None
-            QtGui.QMessageBox.critical(self, 'Error', msg, QtGui.QMessageBox.Ok, 0)
-            return False
-        return True
+
+        def connect():
+            if previous:
+                previous.stop()
+            fpga = self.open_fpga(roach)
+            return fpga, self.read_board_level_entries(fpga), self.read_unit_level_entries(fpga, unit)
+
+        def failed(error):
+            settle()
+            log.warn('%s', error)
+            QtGui.QMessageBox.critical(self, 'Error', str(error), QtGui.QMessageBox.Ok, 0)
+
+        def settle():
+            self.ui.cbo_roach.setStyleSheet('')
+
+        def connected(result):
+            settle()
+            if str(self.ui.cbo_roach.currentText()) != roach:
+                # Another board was selected meanwhile
+                result[0].stop()
+                return
+            self.fpga, board, entries = result
+            self.roach = roach
+            self.apply_board_level_entries(board)
+            self.apply_unit_level_entries(self.fpga, unit, entries)
+            rb_unit = self.ui.rb_unit0 if self.unit == 0 else self.ui.rb_unit1
+            rb_unit.setChecked(True)
+            self.start_poller_thread()
+
+        self.ui.cbo_roach.setStyleSheet(PENDING_STYLE)
+        self.worker.submit(connect, connected, failed)
 
     def disconnect_fpga(self):
         if self.fpga and self.fpga.is_connected():
@@ -164,6 +475,8 @@ class MainForm(TemplateBaseClass):
             self.fpga = None
 
     def start_poller_thread(self):
+        if self.ring is None:
+            self.ring = snapring.SnapshotRing(RING_DEPTH)
         self.poller_event.clear()
         self.poller_thread = threading.Thread(target=self.snapshot_poller)
         self.poller_thread.start()
@@ -178,32 +491,37 @@ class MainForm(TemplateBaseClass):
     def on_board_change(self, index):
         log.debug('%d, %s', index, self.ui.cbo_roach.itemText(index))
         self.stop_poller_thread()
-        roach = self.ui.cbo_roach.itemText(index)
-        if self.connect_fpga(roach):
-            # katadc.chip_init(self.fpga, 0)
-            # katadc.chip_init(self.fpga, 1)
-            self.retrieve_board_level_entries()
-            self.retrieve_unit_level_entries()
-            rb_unit = self.ui.rb_unit0 if self.unit == 0 else self.ui.rb_unit1
-            rb_unit.setChecked(True)
-            self.start_poller_thread()
+        roach = str(self.ui.cbo_roach.itemText(index))
+        self.plotter.reset_waterfalls()
+        # Until the new board answered, its widgets are re-enabled by the apply_*_entries
+        self.disable_board_widgets()
+        # Held back writes still go to the board they were meant for
+        self.coalescer.flush()
+        # katadc.chip_init(self.fpga, 0)
+        # katadc.chip_init(self.fpga, 1)
+        self.connect_fpga(roach)
 
     def on_unit_change(self, checked):
         log.debug('%s %s', self.sender().objectName(), 'selected' if checked else 'deselected')
         if checked:
+            # Held back u<n>_ writes reach the board before the new unit is read back
+            self.coalescer.flush()
             self.unit = 0 if self.sender().objectName()[-1] == '0' else 1
             self.prefix = 'u%d_' % self.unit
+            self.plotter.reset_waterfalls()
             self.retrieve_unit_level_entries()
 
     def on_tvg_change(self, state):
         log.debug('%s %d', self.sender().objectName(), state)
-        usetvg = self.fpga.read_uint('use_tvg')
-        if QtCore.Qt.Unchecked == state:
-            if usetvg & (1 << self.unit) != 0:
-                self.write_register('use_tvg', usetvg & ~(1 << self.unit))
-        elif QtCore.Qt.Checked == state:
-            if usetvg & (1 << self.unit) == 0:
-                self.write_register('use_tvg', usetvg | (1 << self.unit))
+        fpga, bit = self.fpga, 1 << self.unit
+
+        def write_tvg():
+            usetvg = fpga.read_uint('use_tvg')
+            value = usetvg | bit if QtCore.Qt.Checked == state else usetvg & ~bit
+            if value != usetvg:
+                fpga.write_int('use_tvg', value)
+                log.info('wrote register use_tvg=%d(%X)' % (value, value))
+        self.board_op(write_tvg, (self.ui.cb_tvg,))
 
     def on_rfgain_change(self, value):
         widget_name = str(self.sender().objectName())
@@ -211,15 +529,19 @@ class MainForm(TemplateBaseClass):
         index = int(widget_name[-1])
         input_names = ('I', 'Q')
         if self.rfgain[index] != value:
-            katadc.rf_fe_set(self.fpga, self.unit, input_names[index], value)
-            log.info('set zdok%d-%s rf gain %f dB' % (self.unit, input_names[index], value))
+            fpga, unit = self.fpga, self.unit
+
+            def set_gain():
+                katadc.rf_fe_set(fpga, unit, input_names[index], value)
+                log.info('set zdok%d-%s rf gain %f dB' % (unit, input_names[index], value))
+            self.coalescer.defer('zdok%d_rf_fe_%s' % (unit, input_names[index]), set_gain, (self.sender(),))
             self.rfgain[index] = value
 
     def on_beamid_change(self, index):
         beamid = index + 1
         log.debug('beam id %d', beamid)
         if self.beamid != beamid:
-            self.write_register(self.prefix + 'beam_id', beamid)
+            self.write_register(self.prefix + 'beam_id', beamid, self.ui.cbo_beamid)
             self.beamid = beamid
 
     def on_fftshift_change(self):
@@ -229,7 +551,7 @@ class MainForm(TemplateBaseClass):
         # so that the actual base is 2, 8, 10, or 16.
         fftshift = int(str(self.sender().text()), 0)
         if self.fftshift != fftshift:
-            self.write_register(self.prefix + 'fft_shift', fftshift)
+            self.write_register(self.prefix + 'fft_shift', fftshift, self.sender())
             self.fftshift = fftshift
 
     def on_digital_gain_change(self):
@@ -239,15 +561,16 @@ class MainForm(TemplateBaseClass):
         dgain = [int(str(self.ui.edt_dgain0.text()), 0), int(str(self.ui.edt_dgain1.text()), 0)]
         if self.dgain[index] != dgain[index]:
             gain = (dgain[1] & 0xFFFF) << 16 | (dgain[0] & 0xFFFF)
-            self.write_register(self.prefix + 'gain', gain)
+            self.write_register(self.prefix + 'gain', gain, self.sender())
             self.dgain[index] = dgain[index]
 
     def on_acclen_change(self, value):
         log.debug('acclen %d', value)
         if self.acclen != value:
-            self.write_register(self.prefix + 'acc_len', value)
+            # One reset once the length settled, not one per intermediate value
+            reset = ('reset', self.unit), self.pulse_op('reset', 1 << self.unit)
+            self.write_register(self.prefix + 'acc_len', value, self.ui.spn_acclen, then=reset)
             self.acclen = value
-            self.on_reset()
 
     def on_bitsel_change(self, sel):
         log.debug('%s %d', self.sender().objectName(), sel)
@@ -255,7 +578,7 @@ class MainForm(TemplateBaseClass):
         if self.bitsel[index] !=  sel:
             self.bitsel[index] = sel
             self.write_register(self.prefix + 'bit_select',
-                self.bitsel[3] << 6 | self.bitsel[2] << 4 | self.bitsel[1] << 2 | self.bitsel[0])
+                self.bitsel[3] << 6 | self.bitsel[2] << 4 | self.bitsel[1] << 2 | self.bitsel[0], self.sender())
 
     def on_dest_ip_change(self):
         log.debug('%s %s', self.sender().objectName(), self.sender().text())
@@ -265,10 +588,10 @@ class MainForm(TemplateBaseClass):
             ip, sep, port = ip_str.partition(':')
             reg_name = 'xgbe%d_dest_ip' % (index + 4*self.unit)
             reg_val, = struct.unpack('>I', socket.inet_aton(ip))
-            self.write_register(reg_name, reg_val)
+            self.write_register(reg_name, reg_val, self.sender())
             reg_name = 'xgbe%d_dest_port' % (index + 4*self.unit)
             reg_val = int(port)
-            self.write_register(reg_name, reg_val)
+            self.write_register(reg_name, reg_val, self.sender())
             self.dest_ip[index] = ip_str
 
     def on_fabric_ip_change(self):
@@ -282,99 +605,140 @@ class MainForm(TemplateBaseClass):
             mac = (2<<40) + (2<<32) + ip
             dev = 'xgbe{:d}'.format(index + 4*self.unit)
             reg = dev + '_core'
-            try:
-                self.fpga.tap_stop(dev)
-            except RuntimeError as e:
-                pass
-            self.fpga.tap_start(dev, reg, mac, ip, port)
+            fpga = self.fpga
+
+            def restart_tap():
+                try:
+                    fpga.tap_stop(dev)
+                except RuntimeError as e:
+                    pass
+                fpga.tap_start(dev, reg, mac, ip, port)
+            self.board_op(restart_tap, (self.sender(),))
             self.fabric_ip[index] = ip_str
 
     def on_refresh(self):
         log.debug('refresh')
+        # Refresh means re-read the board, not the shadow registers
+        log.debug('%s', self.fpga.cache)
+        self.board_op(self.fpga.cache.clear)
         self.retrieve_board_level_entries()
         self.retrieve_unit_level_entries()
 
     def on_reset(self):
         log.debug('reset')
-        self.write_register('reset', 0)
-        self.write_register('reset', 1 << self.unit)
+        self.pulse_register('reset', 1 << self.unit, self.ui.btn_reset)
 
     def on_arm(self):
         log.debug('arm')
-        self.write_register('arm', 0)
-        self.write_register('arm', 1 << self.unit)
-
-    def write_uint48(self, reg, val):
-        if val >= 2**48:
-            log.error('%s=%d exceed range!', reg, val)
-        lo = val % 2**32
-        hi = val // 2**32
-        self.write_register(reg, lo)
-        self.write_register(reg + '_hipart', hi)
-
-    def read_uint48(self, reg):
-        lo = self.fpga.read_uint(reg)
-        hi = self.fpga.read_uint(reg + '_hipart')
-        val = hi * 2**32 + lo
-        if val >= 2**48:
-            log.error('%s=%d exceed range!', reg, val)
-        return val
+        self.pulse_register('arm', 1 << self.unit, self.ui.btn_arm)
+
+    @staticmethod
+    def write_uint48(fpga, reg, val):
+        fpga.register_map()[reg].write(val)
+        log.info('wrote register ' + reg + '=%d(%X)' % (val, val))
+
+    @staticmethod
+    def read_uint48(fpga, reg):
+        return fpga.register_map()[reg].read()
 
     def on_noisecal_delay_change(self):
         log.debug('%s %s', self.sender().objectName(), self.sender().text())
         noisecal_delay = int(str(self.ui.edt_noisecal_delay.text()), 0)
         if self.noisecal_delay != noisecal_delay:
-            self.write_uint48('noisecal_delay', noisecal_delay)
+            fpga = self.fpga
+            self.board_op(lambda: self.write_uint48(fpga, 'noisecal_delay', noisecal_delay), (self.ui.edt_noisecal_delay,))
             self.noisecal_delay = noisecal_delay
 
     def on_noisecal_on_change(self):
         log.debug('%s %s', self.sender().objectName(), self.sender().text())
         noisecal_on = int(str(self.ui.edt_noisecal_on.text()), 0)
         if self.noisecal_on != noisecal_on:
-            self.write_uint48('noisecal_on', noisecal_on)
+            fpga = self.fpga
+            self.board_op(lambda: self.write_uint48(fpga, 'noisecal_on', noisecal_on), (self.ui.edt_noisecal_on,))
             self.noisecal_on = noisecal_on
 
     def on_noisecal_off_change(self):
         log.debug('%s %s', self.sender().objectName(), self.sender().text())
         noisecal_off = int(str(self.ui.edt_noisecal_off.text()), 0)
         if self.noisecal_off != noisecal_off:
-            self.write_uint48('noisecal_off', noisecal_off)
+            fpga = self.fpga
+            self.board_op(lambda: self.write_uint48(fpga, 'noisecal_off', noisecal_off), (self.ui.edt_noisecal_off,))
             self.noisecal_off = noisecal_off
 
-    def write_register(self, name, value):
-        self.fpga.write_int(name, value)
-        log.info('wrote register ' + name + '=%d(%X)' % (value, value))
+    def write_register(self, name, value, widget=None, then=None):
+        """Write value to register name once it stopped changing. @see WriteCoalescer.defer"""
+        fpga = self.fpga
+
+        def write():
+            fpga.write_int(name, value)
+            log.info('wrote register ' + name + '=%d(%X)' % (value, value))
+        self.coalescer.defer(name, write, (widget,) if widget else (), then)
+
+    def pulse_op(self, name, value):
+        fpga = self.fpga
+
+        def pulse():
+            fpga.write_int(name, 0)
+            fpga.write_int(name, value)
+            log.info('pulsed register ' + name + '=%d(%X)' % (value, value))
+        return pulse
+
+    def pulse_register(self, name, value, widget=None):
+        self.board_op(self.pulse_op(name, value), (widget,) if widget else ())
 
     def retrieve_board_level_entries(self):
-        rcs_id = self.fpga.read_uint('rcs_id')
-        rcs_ver = self.fpga.read_uint('rcs_ver')
-        rcs_timestamp = self.fpga.read_uint('rcs_timestamp')
-        rcs_str = struct.pack('>I', rcs_id) + ' - '
-        rcs_str += 'v%d.%d' % (rcs_ver >> 16, rcs_ver & 0xFFFF) + '\n'
-        rcs_str += datetime.datetime.fromtimestamp(rcs_timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        fpga = self.fpga
+        widgets = (self.ui.edt_noisecal_delay, self.ui.edt_noisecal_on, self.ui.edt_noisecal_off)
+        self.board_op(lambda: self.read_board_level_entries(fpga), widgets, self.apply_board_level_entries)
+
+    def read_board_level_entries(self, fpga):
+        # Worker thread: only katcp requests, no widgets
+        entries = {}
+        with fpga.batch() as b:
+            index = dict((reg, b.read_uint(reg)) for reg in ('rcs_id', 'rcs_ver', 'rcs_timestamp'))
+        for reg, i in index.items():
+            entries[reg] = b.results[i]
+        for reg in ('noisecal_delay', 'noisecal_on', 'noisecal_off'):
+            entries[reg] = self.read_uint48(fpga, reg)
+        entries['sys_clkcounter'] = fpga.read_uint('sys_clkcounter')
+        entries['sys_clkcounter_time'] = time.time()
+        return entries
+
+    def apply_board_level_entries(self, entries):
+        rcs_str = struct.pack('>I', entries['rcs_id']) + ' - '
+        rcs_str += 'v%d.%d' % (entries['rcs_ver'] >> 16, entries['rcs_ver'] & 0xFFFF) + '\n'
+        rcs_str += datetime.datetime.fromtimestamp(entries['rcs_timestamp']).strftime('%Y-%m-%d %H:%M:%S')
         self.ui.lbl_rcs.setText(rcs_str)
-        self.noisecal_delay = self.read_uint48('noisecal_delay')
+        self.noisecal_delay = entries['noisecal_delay']
         self.ui.edt_noisecal_delay.setEnabled(True)
         self.ui.edt_noisecal_delay.setText(str(self.noisecal_delay))
-        self.noisecal_on = self.read_uint48('noisecal_on')
+        self.noisecal_on = entries['noisecal_on']
         self.ui.edt_noisecal_on.setEnabled(True)
         self.ui.edt_noisecal_on.setText(str(self.noisecal_on))
-        self.noisecal_off = self.read_uint48('noisecal_off')
+        self.noisecal_off = entries['noisecal_off']
         self.ui.edt_noisecal_off.setEnabled(True)
         self.ui.edt_noisecal_off.setText(str(self.noisecal_off))
-        self.last_clkcounter = self.fpga.read_uint('sys_clkcounter')
-        self.last_clkcounter_time = time.time()
+        self.last_clkcounter = entries['sys_clkcounter']
+        self.last_clkcounter_time = entries['sys_clkcounter_time']
         for widget in (self.ui.rb_unit0, self.ui.rb_unit1, self.ui.btn_arm, self.ui.btn_reset, self.ui.btn_refresh):
             widget.setEnabled(True)
 
+    @staticmethod
+    def format_ipaddr(ip, port):
+        return socket.inet_ntoa(struct.pack('>I', ip)) + ':' + str(port)
+
     def get_dest_ipaddr(self, unit, index):
         prefix  = 'xgbe%d_' % (index + unit * 4)
         ip      = self.fpga.read_uint(prefix + 'dest_ip')
         port    = self.fpga.read_uint(prefix + 'dest_port')
-        log.debug(prefix + ': ' + socket.inet_ntoa(struct.pack('>I', ip)) + ':' + str(port))
-        return socket.inet_ntoa(struct.pack('>I', ip)) + ':' + str(port)
+        log.debug(prefix + ': ' + self.format_ipaddr(ip, port))
+        return self.format_ipaddr(ip, port)
 
     def get_10gbe_core_info(self, dev_name):
+        return self.decode_10gbe_core_info(self.fpga.read(dev_name, 48))
+
+    @staticmethod
+    def decode_10gbe_core_info(data):
         #assemble struct for header stuff...
         #0x00 - 0x07: My MAC address
         #0x08 - 0x0b: Not used
@@ -397,7 +761,7 @@ class MainForm(TemplateBaseClass):
         #0x1000     : CPU TX buffer
         #0x2000     : CPU RX buffer
         #0x3000     : ARP tables start
-        mem = struct.unpack('>12L', self.fpga.read(dev_name, 48))
+        mem = struct.unpack('>12L', data)
         info            = {}
         info['mac']     = mem[0] << 32 | mem[1]
         info['gateway'] = mem[3]
@@ -411,13 +775,44 @@ class MainForm(TemplateBaseClass):
         tginfo  = self.get_10gbe_core_info(dev)
         ip      = tginfo['ip']
         port    = tginfo['port']
-        log.debug(dev + ': ' + socket.inet_ntoa(struct.pack('>I', ip)) + ':' + str(port))
-        return socket.inet_ntoa(struct.pack('>I', ip)) + ':' + str(port)
+        log.debug(dev + ': ' + self.format_ipaddr(ip, port))
+        return self.format_ipaddr(ip, port)
 
     def retrieve_unit_level_entries(self):
         log.info('Retrieve parameters from unit %d' % self.unit)
+        fpga, unit = self.fpga, self.unit
+        widgets = (self.ui.cbo_beamid, self.ui.edt_fftshift, self.ui.spn_acclen,
+                   self.ui.spn_rfgain0, self.ui.spn_rfgain1, self.ui.cb_tvg)
+        self.board_op(lambda: self.read_unit_level_entries(fpga, unit), widgets,
+                      lambda entries: self.apply_unit_level_entries(fpga, unit, entries))
+
+    @staticmethod
+    def read_unit_level_entries(fpga, unit):
+        # Worker thread: fetch all unit registers in one pipelined batch, then the RF frontends
+        prefix = 'u%d_' % unit
+        with fpga.batch() as b:
+            idx = {}
+            for reg in ('beam_id', 'fft_shift', 'gain', 'acc_len', 'bit_select'):
+                idx[reg] = b.read_uint(prefix + reg)
+            idx['dest'] = [(b.read_uint('xgbe%d_dest_ip' % (i + unit * 4)),
+                            b.read_uint('xgbe%d_dest_port' % (i + unit * 4))) for i in range(4)]
+            idx['core'] = [b.read('xgbe%d_core' % (i + unit * 4), 48) for i in range(4)]
+            idx['use_tvg'] = b.read_uint('use_tvg')
+        results = b.results
+        entries = {}
+        for reg in ('beam_id', 'fft_shift', 'gain', 'acc_len', 'bit_select', 'use_tvg'):
+            entries[reg] = results[idx[reg]]
+        entries['dest'] = [(results[ip], results[port]) for ip, port in idx['dest']]
+        entries['core'] = [results[i] for i in idx['core']]
+        entries['rfgain'] = [katadc.rf_fe_get(fpga, unit, inp) for inp in ('I', 'Q')]
+        return entries
+
+    def apply_unit_level_entries(self, fpga, unit, entries):
+        if fpga is not self.fpga or unit != self.unit:
+            # Board or unit changed while the entries were read
+            return
         # beam id
-        self.beamid = self.fpga.read_uint(self.prefix + 'beam_id')
+        self.beamid = entries['beam_id']
         self.ui.cbo_beamid.setEnabled(GODMODE)
         if self.beamid < 1 or self.beamid > 19:
             log.warn('Invalid beam id %d', self.beamid)
@@ -425,22 +820,22 @@ class MainForm(TemplateBaseClass):
         else:
             self.ui.cbo_beamid.setCurrentIndex(self.beamid - 1)
         # fft_shift
-        self.fftshift = self.fpga.read_uint(self.prefix + 'fft_shift')
+        self.fftshift = entries['fft_shift']
         self.ui.edt_fftshift.setEnabled(True)
         self.ui.edt_fftshift.setText('0x%04X' % self.fftshift)
         # digital gain
-        dgain = self.fpga.read_uint(self.prefix + 'gain')
+        dgain = entries['gain']
         self.dgain = [dgain & 0xFFFF, dgain >> 16]
         self.ui.edt_dgain0.setEnabled(True)
         self.ui.edt_dgain0.setText('0x%04X' % self.dgain[0])
         self.ui.edt_dgain1.setEnabled(True)
         self.ui.edt_dgain1.setText('0x%04X' % self.dgain[1])
         # acc_len
-        self.acclen = self.fpga.read_uint(self.prefix + 'acc_len')
+        self.acclen = entries['acc_len']
         self.ui.spn_acclen.setEnabled(True)
         self.ui.spn_acclen.setValue(self.acclen)
         # bit_select
-        bs = self.fpga.read_uint(self.prefix + 'bit_select')
+        bs = entries['bit_select']
         self.bitsel = [bs & 0b11, bs >> 2 & 0b11, bs >> 4 & 0b11, bs >> 6 & 0b11]
         widgets = (self.ui.cbo_bitsel_0, self.ui.cbo_bitsel_1, self.ui.cbo_bitsel_2, self.ui.cbo_bitsel_3)
         for i in range(4):
@@ -451,19 +846,19 @@ class MainForm(TemplateBaseClass):
         widgets = (self.ui.edt_dest_ip_0, self.ui.edt_dest_ip_1, self.ui.edt_dest_ip_2, self.ui.edt_dest_ip_3)
         for i in range(4):
             widgets[i].setEnabled(GODMODE)
-            self.dest_ip.append(self.get_dest_ipaddr(self.unit, i))
+            self.dest_ip.append(self.format_ipaddr(*entries['dest'][i]))
             widgets[i].setText(self.dest_ip[i])
         # fabric ip
         self.fabric_ip = []
         widgets = (self.ui.edt_fabric_ip_0, self.ui.edt_fabric_ip_1, self.ui.edt_fabric_ip_2, self.ui.edt_fabric_ip_3)
         for i in range(4):
             widgets[i].setEnabled(GODMODE)
-            self.fabric_ip.append(self.get_fabric_ipaddr(self.unit, i))
+            tginfo = self.decode_10gbe_core_info(entries['core'][i])
+            self.fabric_ip.append(self.format_ipaddr(tginfo['ip'], tginfo['port']))
             widgets[i].setText(self.fabric_ip[i])
         # RF gain
         self.rfgain = []
-        for inp, widget in zip(('I', 'Q'), (self.ui.spn_rfgain0, self.ui.spn_rfgain1)):
-            rfgain = katadc.rf_fe_get(self.fpga, self.unit, inp)
+        for inp, widget, rfgain in zip(('I', 'Q'), (self.ui.spn_rfgain0, self.ui.spn_rfgain1), entries['rfgain']):
             widget.setEnabled(True)
             if rfgain['enabled']:
                 self.rfgain.append(rfgain['gain'])
@@ -472,19 +867,10 @@ class MainForm(TemplateBaseClass):
                 self.rfgain.append(None)
                 log.warn('katadc %d RF frontend %s not enabled', self.unit, inp)
         # TVG
-        usetvg = (self.fpga.read_uint('use_tvg') & (1 << self.unit)) != 0
+        usetvg = (entries['use_tvg'] & (1 << self.unit)) != 0
         self.ui.cb_tvg.setChecked(usetvg)
         self.ui.cb_tvg.setEnabled(GODMODE)
 
-    @staticmethod
-    def split_snapshot(snap):
-        len = snap['length']
-        all = struct.unpack('%db'%len, snap['data'])
-        segments = np.array(all).reshape(-1, 4)
-        p0 = segments[0::2, :].flatten()
-        p1 = segments[1::2, :].flatten()
-        return p0, p1
-
     def get_mb_scopes(self):
         # Try to gain lock
         while self.fpga.read_uint('sys_scratchpad') != self.id:
@@ -494,30 +880,42 @@ class MainForm(TemplateBaseClass):
             self.fpga.write_int('sys_scratchpad', self.id, blindwrite=True)
         try:
             adc_name = 'zdok%d_scope' % self.unit
-            snap = self.fpga.snapshot_get(adc_name, man_trig=True, man_valid=True, wait_period=10)
-            adc = self.split_snapshot(snap)
-            spec = []
-            stokes = ['AA', 'BB', 'CR', 'CI']
-            for i in range(4):
-                scope_name = self.prefix + 'x4_vacc_scope_' + stokes[i]
-                snap = self.fpga.snapshot_get(scope_name, man_valid=True, wait_period=10)
-                spec.append(np.array(struct.unpack('>%di' % (snap['length']/4), snap['data'])))
+            scope_names = [self.prefix + 'x4_vacc_scope_' + s for s in STOKES]
+            snaps = self.fpga.snapshot_get_many([(adc_name, {'man_trig': True})] + scope_names,
+                                                man_valid=True, wait_period=10)
+            adc = snapdecode.decode(adc_name, snaps[adc_name])
+            spec = [snapdecode.decode(name, snaps[name]) for name in scope_names]
         finally:
             # Release lock
             self.fpga.write_int('sys_scratchpad', SCOPE_IDLE_FLAG, blindwrite=True)
         return adc, spec
 
+    def store_mb_scopes(self, roach, unit, adc, spec, timestamp=None):
+        # Ring keys are (board, unit, scope) with scope one of adc0, adc1, AA, BB, CR, CI
+        timestamp = time.time() if timestamp is None else timestamp
+        for i, samples in enumerate(adc):
+            self.ring.append((roach, unit, 'adc%d' % i), samples, timestamp)
+        for s, data in zip(STOKES, spec):
+            self.ring.append((roach, unit, s), data, timestamp)
+
     def snapshot_poller(self):
         finished = False
         while not finished:
+            roach, unit = self.roach, self.unit
+            start = time.time()
             adc, spec = self.get_mb_scopes()
-            self.sig_update_plot.emit(adc, spec)
-            self.poller_event.wait(POLLING_INTERVAL)
+            self.store_mb_scopes(roach, unit, adc, spec, start)
+            # The clock check reads the board too, so it is done here rather than on the GUI thread
+            clkcounter = self.fpga.read_uint('sys_clkcounter')
+            if self.mailbox.post((roach, unit, clkcounter, time.time())):
+                self.sig_update_plot.emit()
+            # Poll no faster than the board captures and the GUI renders
+            acquisition = time.time() - start
+            period = max(MIN_POLLING_INTERVAL, POLLING_HEADROOM * (acquisition + self.mailbox.render_time))
+            self.poller_event.wait(period - acquisition)
             finished = self.poller_event.is_set()
 
-    def validate_clock_source(self):
-        clkcounter = self.fpga.read_uint('sys_clkcounter')
-        clkcounter_time = time.time()
+    def validate_clock_source(self, clkcounter, clkcounter_time):
         if clkcounter < self.last_clkcounter:
             hz = (clkcounter + 2**32 - self.last_clkcounter) / (clkcounter_time - self.last_clkcounter_time)
         else:
@@ -532,11 +930,21 @@ class MainForm(TemplateBaseClass):
         else:
             self.label_clkstate.setText('CLOCK OK', color='g', bold=True)
 
-    def on_update_plot(self, adc, spec):
+    def on_update_plot(self):
+        frame = self.mailbox.take()
+        if frame is None:
+            return
+        start = time.time()
+        roach, unit, clkcounter, clkcounter_time = frame
+        adc = [self.ring.latest((roach, unit, 'adc%d' % i))[1] for i in range(2)]
+        spec = [self.ring.latest((roach, unit, s))[1] for s in STOKES]
         self.label_lastupdate.setText(time.strftime('%Y-%m-%d %H:%M:%S %Z', time.localtime()))
         self.plotter.update_plots(adc, spec, self.bitsel)
-        if self.fpga and self.fpga.is_connected():
-            self.validate_clock_source()
+        if roach == self.roach:
+            self.validate_clock_source(clkcounter, clkcounter_time)
+        self.mailbox.rendered(time.time() - start)
+        if self.mailbox.dropped:
+            log.debug('%d of %d frames superseded before display', self.mailbox.dropped, self.mailbox.posted)
 
 
 # Start Qt event loop unless running in interactive mode or using pyside.
@@ -551,15 +959,31 @@ if __name__ == '__main__':
     handler.setFormatter(logging.Formatter('%(asctime)s %(name)s - %(levelname)s - %(message)s', '%Y-%m-%d %H:%M:%S'))
     log.addHandler(handler)
 
-    # katcp_wrapper.log.setLevel(logging.DEBUG)
-    katcp_wrapper.log.setLevel(logging.INFO)
-    katcp_wrapper.log.addHandler(handler)
+    # katcp_wrapper logs to the 'katcp' logger; configure it without importing katcp yet
+    katcp_log = logging.getLogger('katcp')
+    # katcp_log.setLevel(logging.DEBUG)
+    katcp_log.setLevel(logging.INFO)
+    katcp_log.addHandler(handler)
+
+    profile_startup = '--profile-startup' in sys.argv
+    if profile_startup:
+        sys.argv.remove('--profile-startup')
 
     pg.mkQApp()
+    _startup.append(('QApplication', time.time()))
     win = MainForm()
+    _startup.append(('MainForm', time.time()))
     win.show()
+    _startup.append(('show', time.time()))
+
+    def print_startup():
+        _startup.append(('first event loop pass', time.time()))
+        print('Startup timing (ms since mbc started importing):')
+        for (label, t), (previous, t_prev) in zip(_startup[1:], _startup):
+            print('  %-40s %7.1f %+7.1f' % (label, (t - _startup[0][1]) * 1e3, (t - t_prev) * 1e3))
+    if profile_startup:
+        QtCore.QTimer.singleShot(0, print_startup)
 
-    import sys
     try:
         if (sys.flags.interactive != 1) or not hasattr(QtCore, 'PYQT_VERSION'):
             QtGui.QApplication.instance().exec_()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python2
+
+# -*- coding: utf-8 -*-
+
+#############################################################################
+#
+#           FAST 19-Beam Digital Receiver Dashboard
+#
+#############################################################################
+
+"""Thumbnails of the ADC histograms and spectra of every (board, unit) at once.
+
+       python mbdash.py                       # every board of mbc.roach_list, both units
+       python mbdash.py r1745 r1746 --units 0 --workers 4 --period 5 --focus-period 0.5
+
+   A fixed pool of worker threads polls the units, one capture per board at a time, over one
+   FpgaClient per board. The unit due soonest is polled next, so with equal periods the units
+   are visited round-robin. Clicking a thumbnail shows that unit in a full mbv.Plotter view and
+   polls it every --focus-period seconds instead of every --period.
+
+   Captures are kept in a snapring.SnapshotRing; the GUI redraws a thumbnail only when its unit
+   has a new capture.
+"""
+
+from __future__ import print_function
+
+import time
+import random
+import logging
+import threading
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore, QtGui
+
+import katcp_wrapper
+import mbrec
+import snapring
+from mbv import Plotter
+
+THUMB_POINTS = 256               # Spectrum points per thumbnail
+REDRAW_INTERVAL = 200            # Millisecond
+
+log = logging.getLogger('mbdash')
+
+
+class Target(object):
+    """One (board, unit) polled by the dashboard."""
+    __slots__ = ('board', 'unit', 'due', 'error', 'bitsel')
+
+    def __init__(self, board, unit):
+        self.board = board
+        self.unit = unit
+        self.due = 0.0
+        self.error = None
+        self.bitsel = (1, 1, 1, 1)
+
+    @property
+    def key(self):
+        return (self.board, self.unit)
+
+
+class Acquisition(object):
+    """Bounded pool of workers capturing the scopes of many units into a SnapshotRing.
+
+       @param targets  List of (board, unit) tuples.
+       @param workers  Integer: number of worker threads.
+       @param period  Float: seconds between captures of a unit.
+       @param focus_period  Float: seconds between captures of the focused unit.
+       @param port  Integer: KATCP port of every board.
+       @param depth  Integer: captures kept per scope.
+       """
+    def __init__(self, targets, workers=4, period=5.0, focus_period=0.5, port=7147, depth=8):
+        self.targets = [Target(board, unit) for board, unit in targets]
+        self.period = period
+        self.focus_period = focus_period
+        self.port = port
+        self.ring = snapring.SnapshotRing(depth)
+        self.focus = None
+        self.clients = {}
+        self._busy = set()
+        self._cond = threading.Condition()
+        self._stopping = False
+        random.seed()
+        self._id = random.getrandbits(32)
+        self._workers = [threading.Thread(target=self._work, name='mbdash-%d' % i) for i in range(workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def client(self, board):
+        with self._cond:
+            if board not in self.clients:
+                self.clients[board] = katcp_wrapper.FpgaClient(board, self.port, timeout=10)
+            return self.clients[board]
+
+    def set_focus(self, key):
+        """Poll the unit key = (board, unit) at the focus rate, starting right away."""
+        with self._cond:
+            self.focus = key
+            for target in self.targets:
+                if target.key == key:
+                    target.due = 0.0
+            self._cond.notify_all()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+        for fpga in self.clients.values():
+            fpga.stop()
+
+    def _next(self):
+        # Earliest due unit on a board no other worker is capturing from
+        with self._cond:
+            while not self._stopping:
+                ready = [t for t in self.targets if t.board not in self._busy]
+                target = min(ready, key=lambda t: t.due) if ready else None
+                wait = None if target is None else target.due - time.time()
+                if target is not None and wait <= 0:
+                    self._busy.add(target.board)
+                    return target
+                self._cond.wait(wait)
+            return None
+
+    def _work(self):
+        while True:
+            target = self._next()
+            if target is None:
+                return
+            try:
+                self.capture(target)
+                target.error = None
+            except Exception as e:
+                if target.error is None:
+                    log.warning('%s unit %d: %s', target.board, target.unit, e)
+                target.error = str(e)
+            with self._cond:
+                self._busy.discard(target.board)
+                period = self.focus_period if target.key == self.focus else self.period
+                target.due = time.time() + period
+                self._cond.notify_all()
+
+    def capture(self, target):
+        fpga = self.client(target.board)
+        if not fpga.is_connected():
+            raise RuntimeError('not connected')
+        with mbrec.scope_lock(fpga, self._id):
+            timestamp = time.time()
+            record = mbrec.capture(fpga, target.unit)
+        if target.key == self.focus:
+            bs = fpga.read_uint('u%d_bit_select' % target.unit)
+            target.bitsel = (bs & 3, bs >> 2 & 3, bs >> 4 & 3, bs >> 6 & 3)
+        for scope, data in record.items():
+            self.ring.append(target.key + (scope,), data, timestamp)
+
+
+class Dashboard(QtGui.QWidget):
+    """Thumbnail grid of every target plus a full Plotter of the focused one."""
+
+    def __init__(self, acquisition, columns=4):
+        super(Dashboard, self).__init__()
+        self.acq = acquisition
+        self.setWindowTitle('Multibeam Dashboard')
+        layout = QtGui.QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.thumbs = pg.GraphicsLayoutWidget()
+        self.full = pg.GraphicsLayoutWidget()
+        layout.addWidget(self.thumbs, 3)
+        layout.addWidget(self.full, 2)
+        self.plotter = Plotter(self.full)
+        self.hist_edges = np.arange(-128, 129)
+        self.cells = []
+        self.drawn = {}
+        for n, target in enumerate(self.acq.targets):
+            cell = self.thumbs.addLayout(row=n // columns, col=n % columns)
+            label = cell.addLabel('%s u%d' % target.key, row=0, col=0, colspan=2, size='8pt')
+            hist = cell.addPlot(row=1, col=0)
+            spec = cell.addPlot(row=1, col=1)
+            for plt in (hist, spec):
+                plt.hideAxis('left')
+                plt.hideAxis('bottom')
+                plt.setMouseEnabled(False, False)
+            hist.setXRange(-128, 127)
+            spec.setYRange(0, 32)
+            curves = ([hist.plot(stepMode=True, pen=pen) for pen in ('g', 'y')] +
+                      [spec.plot(pen=pen) for pen in ('g', 'y')])
+            self.cells.append((target, cell, label, curves))
+        self.thumbs.scene().sigMouseClicked.connect(self.on_click)
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.redraw)
+        self.timer.start(REDRAW_INTERVAL)
+
+    def on_click(self, event):
+        pos = event.scenePos()
+        for target, cell, label, curves in self.cells:
+            if cell.sceneBoundingRect().contains(pos):
+                log.info('Focus on %s unit %d', target.board, target.unit)
+                self.acq.set_focus(target.key)
+                self.plotter.reset_waterfalls()
+                break
+
+    def redraw(self):
+        ring = self.acq.ring
+        for target, cell, label, curves in self.cells:
+            key = target.key + ('AA',)
+            if target.error is not None:
+                label.setText('%s u%d: %s' % (target.key + (target.error.split('\n')[0],)), color='r', size='8pt')
+            if key not in ring or ring.ring(key).count == self.drawn.get(target.key):
+                continue
+            self.drawn[target.key] = ring.ring(key).count
+            if target.error is None:
+                label.setText('%s u%d' % target.key, size='8pt')
+            for i in range(2):
+                adc = ring.latest(target.key + ('adc%d' % i,))[1]
+                curves[i].setData(self.hist_edges, np.bincount(adc + 128, minlength=256))
+                spec = ring.latest(target.key + (('AA', 'BB')[i],))[1]
+                step = max(1, len(spec) // THUMB_POINTS)
+                curves[2 + i].setData(np.log2(np.maximum.reduceat(spec, np.arange(0, len(spec), step)) + 1.0))
+            if target.key == self.acq.focus:
+                self.update_full(target)
+
+    def update_full(self, target):
+        ring = self.acq.ring
+        adc = [ring.latest(target.key + ('adc%d' % i,))[1] for i in range(2)]
+        spec = [ring.latest(target.key + (s,))[1] for s in mbrec.STOKES]
+        self.plotter.update_plots(adc, spec, target.bitsel)
+        self.full.setWindowTitle('%s unit %d' % target.key)
+
+
+if __name__ == '__main__':
+    import argparse
+    import mbc
+    parser = argparse.ArgumentParser(description='Monitor every multibeam board and unit at once.')
+    parser.add_argument('boards', nargs='*', help='boards to monitor, default mbc.roach_list')
+    parser.add_argument('-u', '--units', type=int, nargs='+', default=[0, 1], choices=(0, 1))
+    parser.add_argument('-p', '--port', type=int, default=7147, help='KATCP port')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='acquisition threads')
+    parser.add_argument('--period', type=float, default=5.0, help='seconds between captures of a unit')
+    parser.add_argument('--focus-period', type=float, default=0.5, help='seconds between captures of the focused unit')
+    parser.add_argument('--columns', type=int, default=4, help='thumbnails per row')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s - %(levelname)s - %(message)s')
+    boards = args.boards or mbc.roach_list
+    acq = Acquisition([(b, u) for b in boards for u in args.units], args.workers, args.period,
+                      args.focus_period, args.port)
+    try:
+        pg.mkQApp()
+        win = Dashboard(acq, args.columns)
+        win.resize(1600, 900)
+        win.show()
+        QtGui.QApplication.instance().exec_()
+    finally:
+        acq.stop()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python2
+"""Render the monitor of one unit to images without Qt or an X server.
+
+   Draws the mbv.Plotter layout (ADC histograms, waveforms, AA/BB/CR/CI spectra with the
+   bit-select zoom overlaid) with numpy into an RGB array and writes it as PNG, or writes the
+   plot-ready data as a compact binary frame (.mbf, see frame_bytes) for a remote viewer.
+
+       python mbheadless.py r1745 0 -o /srv/www/r1745.png --interval 2
+       python mbheadless.py r1745 0 --http 8080          # GET /frame.png or /frame.mbf
+
+   Every interval the board is captured and a frame rendered only if somebody asked for one
+   since the last frame: an HTTP GET, or a file named like the output plus '.request' (e.g.
+   'touch /srv/www/r1745.png.request'). --always renders every interval regardless.
+
+   Panels carry no text; their ranges match the Plotter: histograms from 0 to the highest bin,
+   waveforms -128..127, spectra 0..32 in log2, zooms 0..255 for AA/BB and -128..127 for CR/CI.
+"""
+
+from __future__ import print_function
+
+import os, sys, time, random, struct, zlib, logging, threading
+
+import numpy as np
+
+import katcp_wrapper
+import mbrec
+
+BACKGROUND = (0, 0, 0)
+FRAME = (80, 80, 80)
+HIST = (0, 255, 0)
+WAVE = (200, 200, 200)
+SPEC = (255, 255, 0)
+ZOOM = (0, 128, 0)
+
+FRAME_MAGIC = b'MBF1'
+FRAME_HEADER = struct.Struct('>4sdHH')      # magic, timestamp, columns, channels
+
+log = logging.getLogger('mbheadless')
+
+
+def column_envelope(y, columns):
+    """Return (low, high) of y per pixel column, joined to the neighbouring column so the
+       drawn spans form a connected line.
+       """
+    y = np.asarray(y, np.float64)
+    if len(y) < columns:
+        y = np.interp(np.linspace(0, len(y) - 1, columns), np.arange(len(y)), y)
+    starts = np.arange(columns) * len(y) // columns
+    low = np.minimum.reduceat(y, starts)
+    high = np.maximum.reduceat(y, starts)
+    last = y[np.append(starts[1:], len(y)) - 1]
+    low[1:] = np.minimum(low[1:], last[:-1])
+    high[1:] = np.maximum(high[1:], last[:-1])
+    return low, high
+
+
+class Renderer(object):
+    """Draws frames into one preallocated RGB image.
+
+       @param width  Integer: image width in pixels.
+       @param height  Integer: image height in pixels.
+       @param margin  Integer: pixels around every panel.
+       """
+    def __init__(self, width=800, height=600, margin=4):
+        self.image = np.empty((height, width, 3), np.uint8)
+        # Panel rectangles (x, y, w, h): 2 columns by 4 rows, as in Plotter
+        cw, rh = width // 2, height // 4
+        self.panels = [(c * cw + margin, r * rh + margin, cw - 2 * margin, rh - 2 * margin)
+                       for r in range(4) for c in range(2)]
+        self._rows = {}
+
+    def _span(self, panel, low, high, vmin, vmax, color):
+        # Colour the pixels of every column between low and high (data units)
+        x, y, w, h = panel
+        scale = (h - 1) / float(vmax - vmin)
+        top = np.clip(np.round((vmax - high) * scale), 0, h - 1)
+        bottom = np.clip(np.round((vmax - low) * scale), 0, h - 1)
+        rows = self._rows.get(h)
+        if rows is None:
+            rows = self._rows[h] = np.arange(h)[:, None]
+        mask = (rows >= top) & (rows <= bottom)
+        self.image[y:y + h, x:x + w][mask] = color
+
+    def _curve(self, panel, data, vmin, vmax, color):
+        low, high = column_envelope(data, panel[2])
+        self._span(panel, low, high, vmin, vmax, color)
+
+    def _clear(self, panel):
+        x, y, w, h = panel
+        self.image[y:y + h, x:x + w] = BACKGROUND
+        self.image[y, x:x + w] = self.image[y + h - 1, x:x + w] = FRAME
+        self.image[y:y + h, x] = self.image[y:y + h, x + w - 1] = FRAME
+
+    def render(self, adc, spec, bitsel=(1, 1, 1, 1)):
+        """Draw a frame and return the RGB image (height, width, 3), reused by the next call."""
+        self.image[...] = BACKGROUND
+        for panel in self.panels:
+            self._clear(panel)
+        for i in range(2):
+            counts = np.bincount(np.asarray(adc[i], np.intp) + 128, minlength=256)
+            panel = self.panels[i]
+            # Filled histogram: spans from zero to the count
+            self._span(panel, np.zeros(panel[2]), column_envelope(counts, panel[2])[1], 0, max(1, counts.max()), HIST)
+            self._curve(self.panels[2 + i], adc[i][0:1024], -128, 127, WAVE)
+        for i in range(4):
+            zoom = spec[i] >> bitsel[i]*8
+            if i < 2:
+                zoom = zoom & 0xFF
+            panel = self.panels[4 + i]
+            self._curve(panel, zoom, 0 if i < 2 else -128, 255 if i < 2 else 127, ZOOM)
+            self._curve(panel, np.log2(np.fabs(spec[i]) + 1), 0, 32, SPEC)
+        return self.image
+
+
+def png_bytes(rgb):
+    """Encode an RGB uint8 array as an 8 bit PNG, with zlib only."""
+    h, w, _ = rgb.shape
+    raw = np.zeros((h, 1 + 3 * w), np.uint8)           # filter byte 0 per row
+    raw[:, 1:] = rgb.reshape(h, -1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xFFFFFFFF)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b''))
+
+
+def frame_bytes(adc, spec, bitsel=(1, 1, 1, 1), columns=512, timestamp=None):
+    """Pack the plot-ready data of a frame.
+
+       Layout after FRAME_HEADER: ADC histograms (2 x 256 '>u4'), waveforms (2 x 1024 'i1'),
+       then per spectrum the log2 low and high envelope (2 x columns '>f4') followed by the
+       zoom low and high envelope (2 x columns '>i2').
+       """
+    timestamp = time.time() if timestamp is None else timestamp
+    parts = [FRAME_HEADER.pack(FRAME_MAGIC, timestamp, columns, len(spec[0]))]
+    for i in range(2):
+        parts.append(np.bincount(np.asarray(adc[i], np.intp) + 128, minlength=256).astype('>u4').tobytes())
+    for i in range(2):
+        parts.append(np.asarray(adc[i][0:1024], np.int8).tobytes())
+    for i in range(4):
+        zoom = spec[i] >> bitsel[i]*8
+        if i < 2:
+            zoom = zoom & 0xFF
+        parts.append(np.array(column_envelope(np.log2(np.fabs(spec[i]) + 1), columns), '>f4').tobytes())
+        parts.append(np.clip(column_envelope(zoom, columns), -2**15, 2**15 - 1).astype('>i2').tobytes())
+    return b''.join(parts)
+
+
+def read_frame(data):
+    """Unpack frame_bytes() output into a dictionary of arrays."""
+    magic, timestamp, columns, channels = FRAME_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise ValueError('Not a monitor frame')
+    offset = FRAME_HEADER.size
+    frame = {'time': timestamp, 'channels': channels}
+
+    def take(dtype, shape):
+        count = int(np.prod(shape))
+        a = np.frombuffer(data, dtype, count, offset).reshape(shape)
+        return a, offset + count * np.dtype(dtype).itemsize
+    frame['hist'], offset = take('>u4', (2, 256))
+    frame['wave'], offset = take('i1', (2, 1024))
+    for s in mbrec.STOKES:
+        frame[s], offset = take('>f4', (2, columns))
+        frame[s + '_zoom'], offset = take('>i2', (2, columns))
+    return frame
+
+
+def _write_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, path)
+
+
+class Monitor(object):
+    """Capture and render on demand, at most once per interval.
+
+       @param fpga  FpgaClient of the board.
+       @param unit  Integer: unit to show.
+       @param renderer  Renderer object.
+       @param output  String: PNG (.png) or frame (.mbf) file to write, None to only serve requests.
+       @param interval  Float: seconds between frames.
+       @param always  Boolean: write output every interval even if nobody asked.
+       """
+    def __init__(self, fpga, unit, renderer, output=None, interval=2.0, always=False):
+        self.fpga = fpga
+        self.unit = unit
+        self.renderer = renderer
+        self.output = output
+        self.output_kind = None if output is None else ('mbf' if output.endswith('.mbf') else 'png')
+        self.interval = interval
+        self.always = always
+        self.data = {}              # kind -> bytes of the newest frame
+        self.frames = {}            # kind -> number of frames rendered
+        self._wanted = set()
+        self._cond = threading.Condition()
+        random.seed()
+        self._id = random.getrandbits(32)
+
+    def request(self, kind='png'):
+        """Ask for a 'png' or 'mbf' frame at the next interval."""
+        with self._cond:
+            self._wanted.add(kind)
+
+    def _take_wanted(self):
+        with self._cond:
+            kinds, self._wanted = self._wanted, set()
+        if self.output_kind:
+            request_file = self.output + '.request'
+            if os.path.exists(request_file):
+                os.remove(request_file)
+                kinds.add(self.output_kind)
+            elif self.always:
+                kinds.add(self.output_kind)
+        return kinds
+
+    def step(self):
+        """Capture and render one frame if one was asked for. Return True if it did."""
+        kinds = self._take_wanted()
+        if not kinds:
+            return False
+        with mbrec.scope_lock(self.fpga, self._id):
+            timestamp = time.time()
+            record = mbrec.capture(self.fpga, self.unit)
+        bs = self.fpga.read_uint('u%d_bit_select' % self.unit)
+        bitsel = (bs & 3, bs >> 2 & 3, bs >> 4 & 3, bs >> 6 & 3)
+        adc = (record['adc0'], record['adc1'])
+        spec = [record[s] for s in mbrec.STOKES]
+        data = {}
+        if 'png' in kinds:
+            data['png'] = png_bytes(self.renderer.render(adc, spec, bitsel))
+        if 'mbf' in kinds:
+            data['mbf'] = frame_bytes(adc, spec, bitsel, timestamp=timestamp)
+        if self.output_kind in data:
+            _write_atomic(self.output, data[self.output_kind])
+        with self._cond:
+            self.data.update(data)
+            for kind in data:
+                self.frames[kind] = self.frames.get(kind, 0) + 1
+            self._cond.notify_all()
+        return True
+
+    def get(self, kind, timeout):
+        """Ask for a frame of kind and wait up to timeout seconds for it. Return its bytes or None."""
+        with self._cond:
+            count = self.frames.get(kind, 0)
+            self._wanted.add(kind)
+            deadline = time.time() + timeout
+            while self.frames.get(kind, 0) == count and time.time() < deadline:
+                self._cond.wait(deadline - time.time())
+            return self.data.get(kind)
+
+    def run(self, duration=None):
+        start = time.time()
+        while duration is None or time.time() - start < duration:
+            t0 = time.time()
+            try:
+                self.step()
+            except RuntimeError as e:
+                log.warning('%s', e)
+            time.sleep(max(0, self.interval - (time.time() - t0)))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Render the monitor of a multibeam unit without Qt.')
+    parser.add_argument('roach', help='board to monitor')
+    parser.add_argument('unit', type=int, nargs='?', default=0, choices=(0, 1), help='unit to monitor')
+    parser.add_argument('-p', '--port', type=int, default=7147, help='KATCP port')
+    parser.add_argument('-o', '--output', help='PNG (.png) or frame (.mbf) file to write')
+    parser.add_argument('-i', '--interval', type=float, default=2.0, help='seconds between frames')
+    parser.add_argument('--always', action='store_true', help='render every interval, even if nobody asked')
+    parser.add_argument('--size', type=int, nargs=2, default=(800, 600), metavar=('W', 'H'), help='image size')
+    parser.add_argument('--http', type=int, help='serve /frame.png and /frame.mbf on this port')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s - %(levelname)s - %(message)s')
+    fpga = katcp_wrapper.FpgaClient(args.roach, args.port, timeout=10)
+    try:
+        if not fpga.wait_connected(5):
+            log.critical('Can not connect to %s:%d', args.roach, args.port)
+            sys.exit(1)
+        monitor = Monitor(fpga, args.unit, Renderer(*args.size), args.output, args.interval, args.always)
+        if args.http:
+            try:
+                from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+            except ImportError:
+                from http.server import BaseHTTPRequestHandler, HTTPServer
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    kind = {'/frame.png': 'png', '/frame.mbf': 'mbf'}.get(self.path)
+                    data = monitor.get(kind, 2 * args.interval + 10) if kind else None
+                    if data is None:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/png' if kind == 'png' else 'application/octet-stream')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+                def log_message(self, format, *args):
+                    log.debug(format, *args)
+
+            server = HTTPServer(('', args.http), Handler)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            log.info('Serving frames on port %d', args.http)
+        monitor.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fpga.stop()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python2
+"""Record the ADC and accumulated spectrum scopes of one unit continuously.
+
+   Captures zdok<unit>_scope and u<unit>_x4_vacc_scope_{AA,BB,CR,CI} as fast as the board
+   produces them and stores them in segments: compressed .npz files holding a block of
+   consecutive captures. Each segment is closed when it reaches --segment-mb of raw data or
+   --segment-sec seconds, and is listed in index.jsonl in the output directory.
+
+       python mbrec.py r1745 0 -o /data/r1745_u0 --segment-mb 256 --segment-sec 600
+
+   Segment arrays: 'time' (capture timestamps, float64 seconds), 'adc0' and 'adc1' (int16,
+   captures x samples), 'AA', 'BB', 'CR', 'CI' (captures x channels).
+
+   Files are written by a background thread. If the disk falls behind, the oldest waiting
+   captures are dropped (and counted) rather than slowing the acquisition down.
+
+   Reading back:
+
+       for seg in mbrec.segments('/data/r1745_u0'):
+           print(seg['time'][0], seg['AA'].shape)
+"""
+
+from __future__ import print_function
+
+import os, sys, time, json, random, logging, threading, collections, contextlib
+
+import numpy as np
+
+import katcp_wrapper
+import snapdecode
+
+STOKES = ('AA', 'BB', 'CR', 'CI')
+SCOPE_IDLE_FLAG = 0x12345678
+INDEX = 'index.jsonl'
+
+log = logging.getLogger('mbrec')
+
+
+class SegmentWriter(threading.Thread):
+    """Background thread collecting captures into segments and writing them to disk.
+
+       @param directory  String: output directory, created if needed.
+       @param prefix  String: segment file name prefix.
+       @param segment_bytes  Integer: close a segment once it holds this many raw bytes.
+       @param segment_seconds  Float: close a segment once its first capture is this old.
+       @param queue_size  Integer: captures waiting to be written before the oldest are dropped.
+       @param metadata  Dictionary: stored in every index entry.
+       """
+
+    def __init__(self, directory, prefix, segment_bytes=256*2**20, segment_seconds=600.0,
+                 queue_size=256, metadata=None):
+        threading.Thread.__init__(self, name='mbrec-writer')
+        self.daemon = True
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.metadata = metadata or {}
+        self.queue = collections.deque(maxlen=queue_size)
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.dropped = 0
+        self.written = 0
+        self.segments = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def put(self, timestamp, record):
+        """Queue one capture: a dictionary of arrays. Never blocks."""
+        with self.cond:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append((timestamp, record))
+            self.cond.notify()
+
+    def stop(self):
+        """Write what is queued, close the open segment and wait for the thread to finish."""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.join()
+
+    def run(self):
+        times, records, nbytes = [], [], 0
+        while True:
+            with self.cond:
+                while not self.queue and not self.stopping:
+                    self.cond.wait(1.0)
+                    if records and time.time() - times[0] >= self.segment_seconds:
+                        break
+                batch = list(self.queue)
+                self.queue.clear()
+                stopping = self.stopping
+            for timestamp, record in batch:
+                times.append(timestamp)
+                records.append(record)
+                nbytes += sum(a.nbytes for a in record.values())
+            if records and (stopping or nbytes >= self.segment_bytes
+                            or time.time() - times[0] >= self.segment_seconds):
+                try:
+                    self.write_segment(times, records)
+                except (IOError, OSError) as e:
+                    log.error('Writing segment failed, %i captures lost: %s', len(records), e)
+                times, records, nbytes = [], [], 0
+            if stopping:
+                return
+
+    def write_segment(self, times, records):
+        name = '%s_%s_%04i.npz' % (self.prefix, time.strftime('%Y%m%dT%H%M%S', time.gmtime(times[0])), self.segments)
+        path = os.path.join(self.directory, name)
+        arrays = {'time': np.array(times)}
+        for key in records[0]:
+            arrays[key] = np.stack([r[key] for r in records])
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.rename(tmp, path)
+        entry = dict(self.metadata, file=name, first=times[0], last=times[-1], captures=len(times),
+                     bytes=os.path.getsize(path))
+        with open(os.path.join(self.directory, INDEX), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        self.segments += 1
+        self.written += len(times)
+        log.info('Wrote %s: %i captures, %.1f MB', name, len(times), entry['bytes'] / 1e6)
+
+
+@contextlib.contextmanager
+def scope_lock(fpga, lock_id):
+    """Own the scopes of a board, as mbc does, by holding lock_id in sys_scratchpad."""
+    while fpga.read_uint('sys_scratchpad') != lock_id:
+        while fpga.read_uint('sys_scratchpad') != SCOPE_IDLE_FLAG:
+            time.sleep(0.1)
+        fpga.write_int('sys_scratchpad', lock_id, blindwrite=True)
+    try:
+        yield
+    finally:
+        fpga.write_int('sys_scratchpad', SCOPE_IDLE_FLAG, blindwrite=True)
+
+
+def capture(fpga, unit):
+    """Capture the ADC and spectrum scopes of unit once. Returns a dictionary of arrays."""
+    adc_name = 'zdok%d_scope' % unit
+    scope_names = ['u%d_x4_vacc_scope_%s' % (unit, s) for s in STOKES]
+    snaps = fpga.snapshot_get_many([(adc_name, {'man_trig': True})] + scope_names, man_valid=True, wait_period=10)
+    record = {}
+    record['adc0'], record['adc1'] = snapdecode.decode(adc_name, snaps[adc_name])
+    for stokes, name in zip(STOKES, scope_names):
+        # copy: the decoded views point into the reply strings
+        record[stokes] = np.array(snapdecode.decode(name, snaps[name]))
+    return record
+
+
+def record(fpga, unit, writer, duration=None, stats_interval=10.0, lock_id=None):
+    """Capture continuously into writer until duration seconds have passed (forever if None)
+       or KeyboardInterrupt. Each capture holds the scope lock, so mbc and other clients of the
+       board do not re-arm the scopes halfway; lock_id defaults to a random id.
+       """
+    if lock_id is None:
+        random.seed()
+        lock_id = random.getrandbits(32)
+    start = last_stats = time.time()
+    count = 0
+    try:
+        while duration is None or time.time() - start < duration:
+            with scope_lock(fpga, lock_id):
+                timestamp = time.time()
+                data = capture(fpga, unit)
+            writer.put(timestamp, data)
+            count += 1
+            if timestamp - last_stats >= stats_interval:
+                log.info('%i captures, %.2f/s, %i written, %i dropped',
+                         count, count / (timestamp - start), writer.written, writer.dropped)
+                last_stats = timestamp
+    except KeyboardInterrupt:
+        pass
+    return count
+
+
+def segments(directory):
+    """Yield the segments listed in a recording's index, oldest first, as dictionaries of arrays."""
+    with open(os.path.join(directory, INDEX)) as f:
+        for line in f:
+            entry = json.loads(line)
+            with np.load(os.path.join(directory, entry['file'])) as data:
+                yield dict((key, data[key]) for key in data.files)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Record the ADC and spectrum scopes of a multibeam unit.')
+    parser.add_argument('roach', help='board to record from')
+    parser.add_argument('unit', type=int, nargs='?', default=0, choices=(0, 1), help='unit to record')
+    parser.add_argument('-p', '--port', type=int, default=7147, help='KATCP port')
+    parser.add_argument('-o', '--output', default='.', help='output directory')
+    parser.add_argument('--segment-mb', type=float, default=256, help='raw MB per segment')
+    parser.add_argument('--segment-sec', type=float, default=600, help='seconds per segment')
+    parser.add_argument('--queue', type=int, default=256, help='captures buffered for the writer')
+    parser.add_argument('-d', '--duration', type=float, default=None, help='seconds to record, default until Ctrl-C')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s - %(levelname)s - %(message)s')
+    fpga = katcp_wrapper.FpgaClient(args.roach, args.port, timeout=10)
+    try:
+        if not fpga.wait_connected(5):
+            log.critical('Can not connect to %s:%d', args.roach, args.port)
+            sys.exit(1)
+        metadata = {'roach': args.roach, 'unit': args.unit,
+                    'acc_len': fpga.read_uint('u%d_acc_len' % args.unit)}
+        writer = SegmentWriter(args.output, '%s_u%d' % (args.roach, args.unit), int(args.segment_mb * 2**20),
+                               args.segment_sec, args.queue, metadata)
+        writer.start()
+        log.info('Recording %s unit %d into %s', args.roach, args.unit, args.output)
+        count = record(fpga, args.unit, writer, args.duration)
+        writer.stop()
+        log.info('Done: %i captures, %i written in %i segments, %i dropped',
+                 count, writer.written, writer.segments, writer.dropped)
+    finally:
+        fpga.stop()
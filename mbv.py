@@ -15,13 +15,75 @@ import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
 
 
+class Waterfall(object):
+    """Spectrogram history of one spectrum in a preallocated ring of rows.
+
+       Every row is written twice, at slot i and i + rows of a (2 * rows, columns) array, so the
+       last rows rows are always one contiguous view and a new spectrum costs one row copy.
+
+       @param channels  Integer: channels per spectrum.
+       @param rows  Integer: rows of history kept.
+       @param freq_decimation  Integer: channels per column, their maximum is kept.
+       @param time_decimation  Integer: spectra per row, their maximum is kept.
+       """
+    def __init__(self, channels, rows=1024, freq_decimation=1, time_decimation=1):
+        self.channels = channels
+        self.rows = rows
+        self.freq_decimation = freq_decimation
+        self.time_decimation = time_decimation
+        self._starts = np.arange(0, channels, freq_decimation)
+        self._image = np.zeros((2 * rows, len(self._starts)), np.float32)
+        self._acc = np.empty(len(self._starts), np.float32)
+        self._row = np.empty(len(self._starts), np.float32)
+        self._pending = 0
+        self.count = 0
+
+    @property
+    def nbytes(self):
+        return self._image.nbytes + self._acc.nbytes + self._row.nbytes
+
+    def append(self, spectrum):
+        """Add one spectrum. Return True when it completed a new row."""
+        if self._pending == 0:
+            np.maximum.reduceat(spectrum, self._starts, out=self._acc)
+        else:
+            np.maximum.reduceat(spectrum, self._starts, out=self._row)
+            np.maximum(self._acc, self._row, out=self._acc)
+        self._pending += 1
+        if self._pending < self.time_decimation:
+            return False
+        i = self.count % self.rows
+        self._image[i] = self._image[i + self.rows] = self._acc
+        self.count += 1
+        self._pending = 0
+        return True
+
+    def image(self):
+        """Return the last rows rows, oldest first, as a (rows, columns) view."""
+        end = (self.count - 1) % self.rows + self.rows + 1 if self.count else self.rows
+        return self._image[end - self.rows:end]
+
+
 class Plotter(object):
 
-    def __init__(self, glw, hist_brush=(0,255,0,150), zoom_pen=(0,128,0,150), show_title=True):
+    def __init__(self, glw, hist_brush=(0,255,0,150), zoom_pen=(0,128,0,150), show_title=True,
+                 waterfall_glw=None, waterfall_bytes=64*2**20, waterfall_columns=1024, waterfall_time_decimation=1):
         super(Plotter, self).__init__()
         self.glw = glw
         self.show_title = show_title
+        self._buffers = {}          # per-curve work buffers and last frame, reused across frames
+        self._bitsel = None
+        self._lod = [None] * 4      # channels per point each spectrum is drawn with
         self.init_plots(hist_brush, zoom_pen)
+        # Waterfalls are sized by the first spectrum to fit waterfall_bytes for all four products
+        self.waterfall_glw = waterfall_glw
+        self.waterfall_bytes = waterfall_bytes
+        self.waterfall_columns = waterfall_columns
+        self.waterfall_time_decimation = waterfall_time_decimation
+        self.waterfalls = [None] * 4
+        self.waterfall_images = []
+        if waterfall_glw is not None:
+            self.init_waterfalls()
 
     def init_plots(self, hist_brush, zoom_pen):
         self.hists = []
@@ -80,6 +142,7 @@ class Plotter(object):
             curve = pg.PlotCurveItem(pen=zoom_pen)
             vbr.addItem(curve)
             plt.getViewBox().sigResized.connect(self.update_view)
+            plt.getViewBox().sigXRangeChanged.connect(self.update_lod)
             self.zooms.append(curve)
             self.spec_vbrs.append(vbr)
 
@@ -92,45 +155,152 @@ class Plotter(object):
             plt.getAxis('right').setWidth(tickwidth)
             plt.getAxis('bottom').setTickFont(tickfont)
 
+    def init_waterfalls(self):
+        for i, title in enumerate(('AA', 'BB', 'CR', 'CI')):
+            plt = self.waterfall_glw.addPlot(row=i//2, col=i%2)
+            if self.show_title:
+                plt.setTitle(title + ' waterfall')
+            plt.getAxis('left').setLabel('row')
+            img = pg.ImageItem()
+            plt.addItem(img)
+            self.waterfall_images.append(img)
+
+    def reset_waterfalls(self):
+        """Start the waterfall histories afresh, e.g. after switching to another unit."""
+        self.waterfalls = [None] * 4
+
+    def update_waterfall(self, i, log):
+        wf = self.waterfalls[i]
+        new = wf is None or wf.channels != len(log)
+        if new:
+            freq_decimation = max(1, -(-len(log) // self.waterfall_columns))
+            columns = -(-len(log) // freq_decimation)
+            rows = max(1, self.waterfall_bytes // (4 * 2 * columns * 4))
+            wf = self.waterfalls[i] = Waterfall(len(log), rows, freq_decimation, self.waterfall_time_decimation)
+        if wf.append(log) or new:
+            # ImageItem indexes [x, y]: transpose so channels run along x and the newest row is on top
+            img = self.waterfall_images[i]
+            img.setImage(wf.image().T, autoLevels=False, levels=(0, 32))
+            if new:
+                img.setRect(QtCore.QRectF(0, 0, wf.channels, wf.rows))
+
     def update_view(self, vbl):
         for i in range(len(self.spec_plots)):
             if vbl is self.spec_plots[i].getViewBox():
                 vbr = self.spec_vbrs[i]
                 vbr.setGeometry(vbl.sceneBoundingRect())
                 vbr.linkedViewChanged(vbl, vbr.XAxis)
+                self.update_lod(vbl)
                 break
 
+    def update_lod(self, vbl, *args):
+        # Redraw a spectrum only when its view now needs a different decimation
+        for i in range(len(self.spec_plots)):
+            if vbl is self.spec_plots[i].getViewBox():
+                if ('log', i) in self._buffers and self.lod_step(i) != self._lod[i]:
+                    self.draw_spectrum(i)
+                break
+
+    def lod_step(self, i):
+        """Channels per pixel column of spectrum plot i, at least 1."""
+        vb = self.spec_plots[i].getViewBox()
+        (x0, x1), pixels = vb.viewRange()[0], vb.width()
+        if pixels < 1:
+            return 1
+        return max(1, int((x1 - x0) / pixels))
+
+    @staticmethod
+    def minmax_envelope(y, step):
+        """Decimate y to the minimum and maximum of every step samples, keeping spikes visible.
+
+           @param y  Numpy array.
+           @param step  Integer: samples per output pair.
+           @return  Tuple of arrays (x, y) with two points per step samples.
+           """
+        starts = np.arange(0, len(y), step)
+        env = np.empty(2 * len(starts), y.dtype)
+        env[0::2] = np.minimum.reduceat(y, starts)
+        env[1::2] = np.maximum.reduceat(y, starts)
+        return np.repeat(np.minimum(starts + (step - 1) / 2.0, len(y) - 1), 2), env
+
+    def draw_spectrum(self, i):
+        # Full resolution once zoomed in to a channel per pixel or less
+        step = self.lod_step(i)
+        self._lod[i] = step
+        log, zoom = self._buffers[('log', i)], self._buffers[('zoom', i)]
+        if step == 1:
+            self.specs[i].setData(log)
+            self.zooms[i].setData(np.arange(len(zoom)), zoom)
+        else:
+            self.specs[i].setData(*self.minmax_envelope(log, step))
+            self.zooms[i].setData(*self.minmax_envelope(zoom, step))
+
     @staticmethod
     def rms(x):
         return np.sqrt(x.dot(x) / x.size)
 
+    # ADC samples are 8 bit: histogram them into a fixed set of 256 bins
+    HIST_EDGES = np.arange(-128, 129)
+    HIST_VALUES = np.arange(-128, 128, dtype=np.float64)
+    HIST_SQUARES = HIST_VALUES * HIST_VALUES
+
+    def _buffer(self, key, shape, dtype):
+        """Return the buffer kept under key, (re)allocated when shape or dtype changed."""
+        buf = self._buffers.get(key)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self._buffers[key] = np.empty(shape, dtype)
+        return buf
+
+    def _changed(self, key, data):
+        """Return True, and remember data, unless data equals what was seen last time under key."""
+        last = self._buffers.get(key)
+        if last is not None and last.shape == data.shape and np.array_equal(last, data):
+            return False
+        self._buffer(key, data.shape, data.dtype)[...] = data
+        return True
+
     def update_plots(self, adc, spec, bitsel=(1, 1, 1, 1)):
         for i in range(2):
+            if not self._changed(('adc', i), adc[i]):
+                continue
             self.waves[i].setData(adc[i][0:1024])
-            # if self.show_title:
-            #     self.wave_plots[i].setTitle('MEAN %6.2f' % np.mean(adc[i]))
-            y, x = np.histogram(adc[i], adc[i].max() - adc[i].min() + 1)
-            self.hists[i].setData(x, y)
+            # Offset to 0..255 in a reused buffer, count, and take mean and RMS from the counts
+            offset = self._buffer(('adc_offset', i), adc[i].shape, np.intp)
+            np.add(adc[i], 128, out=offset)
+            counts = np.bincount(offset, minlength=256)
+            self.hists[i].setData(self.HIST_EDGES, counts)
             if self.show_title:
-                self.hist_plots[i].setTitle('MEAN %.2f, RMS %.2f' % (np.mean(adc[i]), self.rms(adc[i])))
-
-        for i in range(2):
-            self.specs[i].setData(np.log2(np.fabs(spec[i]) + 1))
-            self.zooms[i].setData((spec[i] >> bitsel[i]*8) & 0xFF)
-
-        for i in range(2,4):
-            self.specs[i].setData(np.log2(np.fabs(spec[i]) + 1))
-            self.zooms[i].setData((spec[i] >> bitsel[i]*8))
+                n = float(adc[i].size)
+                mean = counts.dot(self.HIST_VALUES) / n
+                rms = np.sqrt(counts.dot(self.HIST_SQUARES) / n)
+                self.hist_plots[i].setTitle('MEAN %.2f, RMS %.2f' % (mean, rms))
 
+        bitsel_changed = tuple(bitsel) != self._bitsel
+        self._bitsel = tuple(bitsel)
+        for i in range(4):
+            changed = self._changed(('spec', i), spec[i])
+            if changed:
+                log = self._buffer(('log', i), spec[i].shape, np.float64)
+                np.absolute(spec[i], out=log)
+                log += 1
+                np.log2(log, out=log)
+                if self.waterfall_images:
+                    self.update_waterfall(i, log)
+            if changed or bitsel_changed:
+                zoom = self._buffer(('zoom', i), spec[i].shape, spec[i].dtype.newbyteorder('='))
+                np.right_shift(spec[i], bitsel[i]*8, out=zoom)
+                if i < 2:
+                    zoom &= 0xFF
+                self.draw_spectrum(i)
 
 if __name__ == '__main__':
 
     import sys
     import time
-    import struct
     import logging
     import os.path
     import katcp_wrapper
+    import snapdecode
 
     def init_logger():
         logname = os.path.splitext(os.path.basename(__file__))[0]
@@ -158,26 +328,21 @@ if __name__ == '__main__':
         plotter = Plotter(glw, show_title=False)
         mw.show()
 
-    def split_snapshot(snap):
-        len = snap['length']
-        all = struct.unpack('%db'%len, snap['data'])
-        segments = np.array(all).reshape(-1, 4)
-        p0 = segments[0::2, :].flatten()
-        p1 = segments[1::2, :].flatten()
-        return p0, p1
+    # Spectrum snapshot buffers reused on every frame, allocated by the first capture
+    snap_bufs = {}
 
     def plot_anim(unit):
         global plotter, fpga
         prefix = 'u{:d}_'.format(unit)
         adc_name = 'zdok{:d}_scope'.format(unit)
-        snap = fpga.snapshot_get(adc_name, man_trig=True, man_valid=True)
-        adc = split_snapshot(snap)
-        spec = []
         stokes = ['AA', 'BB', 'CR', 'CI']
-        for i in range(4):
-            scope_name = prefix + 'x4_vacc_scope_' + stokes[i]
-            snap = fpga.snapshot_get(scope_name, man_valid=True)
-            spec.append(np.array(struct.unpack('>%di' % (snap['length']/4), snap['data'])))
+        scope_names = [prefix + 'x4_vacc_scope_' + s for s in stokes]
+        snaps = fpga.snapshot_get_many([(adc_name, {'man_trig': True})] + scope_names, man_valid=True, out=snap_bufs)
+        adc = snapdecode.decode(adc_name, snaps[adc_name])
+        spec = [snapdecode.decode(name, snaps[name]) for name in scope_names]
+        for name in scope_names:
+            if name not in snap_bufs:
+                snap_bufs[name] = bytearray(snaps[name]['length'])
         bitsel = fpga.read_uint('u{:d}_bit_select'.format(unit))
         plotter.update_plots(adc, spec, (bitsel & 3, bitsel >> 2 & 3, bitsel >> 4 & 3, bitsel >> 6 & 3))
 
@@ -0,0 +1,252 @@
+"""Typed register map for a ROACH board, built from listdev.
+
+   Register names are grouped on their first '_' so that units and cores read naturally:
+
+       regs = fpga.register_map()
+       regs.u0.acc_len = 100
+       bitsel = regs.u1.bit_select          # -> (sel0, sel1, sel2, sel3)
+       regs['noisecal_delay'].write(2**40)  # 48-bit lo/_hipart pair
+
+   Every register gets a codec chosen once when the map is built: unsigned 32 bit by default,
+   the layouts in LAYOUTS for known registers, and a 48 bit lo/hi pair for every register that
+   has a '<name>_hipart' companion. Unknown names raise locally, without a round trip.
+"""
+
+from __future__ import print_function
+
+import struct, fnmatch
+
+_U32 = struct.Struct('>I')
+_I32 = struct.Struct('>i')
+
+# listdev results per bitstream, shared by all clients in this process
+_listdev_cache = {}
+
+
+class UInt32Codec(object):
+    """Plain 32 bit unsigned register."""
+    __slots__ = ()
+    width = 32
+
+    def encode(self, value):
+        return _U32.pack(value)
+
+    def decode(self, data):
+        return _U32.unpack(data)[0]
+
+
+class Int32Codec(object):
+    """32 bit two's complement register."""
+    __slots__ = ()
+    width = 32
+
+    def encode(self, value):
+        return _I32.pack(value)
+
+    def decode(self, data):
+        return _I32.unpack(data)[0]
+
+
+class BitfieldCodec(object):
+    """32 bit register holding packed fields, least significant field first.
+
+       @param widths  Tuple of integers: bit width of each field.
+       @param frac_bits  Integer: fixed point fraction bits of every field; values are floats if non-zero.
+       """
+    __slots__ = ('widths', '_fields', '_scale')
+    width = 32
+
+    def __init__(self, widths, frac_bits=0):
+        self.widths = tuple(widths)
+        shifts = [sum(self.widths[:i]) for i in range(len(self.widths))]
+        assert shifts[-1] + self.widths[-1] <= 32, 'Fields do not fit in 32 bits'
+        self._fields = tuple((shift, (1 << width) - 1) for shift, width in zip(shifts, self.widths))
+        self._scale = float(1 << frac_bits) if frac_bits else None
+
+    def encode(self, values):
+        if len(values) != len(self._fields):
+            raise ValueError('Expected %i fields, got %i' % (len(self._fields), len(values)))
+        word = 0
+        scale = self._scale
+        for (shift, mask), value in zip(self._fields, values):
+            if scale is not None:
+                value = int(round(value * scale))
+            if value < 0 or value > mask:
+                raise ValueError('Field value %r does not fit in %i bits' % (value, mask.bit_length()))
+            word |= value << shift
+        return _U32.pack(word)
+
+    def decode(self, data):
+        word = _U32.unpack(data)[0]
+        if self._scale is None:
+            return tuple((word >> shift) & mask for shift, mask in self._fields)
+        return tuple(((word >> shift) & mask) / self._scale for shift, mask in self._fields)
+
+
+class UInt48Codec(object):
+    """48 bit value split over a register (low 32 bits) and its '_hipart' companion (high 16 bits)."""
+    __slots__ = ()
+    width = 48
+
+    def encode(self, value):
+        if value < 0 or value >= 1 << 48:
+            raise ValueError('%r exceeds 48 bits' % value)
+        return _U32.pack(value & 0xFFFFFFFF), _U32.pack(value >> 32)
+
+    def decode(self, data):
+        lo, hi = data
+        return _U32.unpack(hi)[0] << 32 | _U32.unpack(lo)[0]
+
+
+U32 = UInt32Codec()
+I32 = Int32Codec()
+U48 = UInt48Codec()
+
+# Known register layouts, matched against the full register name
+LAYOUTS = [
+    ('u?_bit_select', BitfieldCodec((2, 2, 2, 2))),
+    ('u?_gain', BitfieldCodec((16, 16), frac_bits=8)),      # 16_8 pol0/pol1 pair
+]
+
+
+class Register(object):
+    """A named register with its codec.
+
+       @param fpga  FpgaClient object.
+       @param name  String: register name as in listdev.
+       @param codec  Codec object.
+       """
+    __slots__ = ('fpga', 'name', 'codec', '_hipart')
+
+    def __init__(self, fpga, name, codec):
+        self.fpga = fpga
+        self.name = name
+        self.codec = codec
+        self._hipart = name + '_hipart'
+
+    def __repr__(self):
+        return 'Register(%s, %s)' % (self.name, type(self.codec).__name__)
+
+    def read(self):
+        if self.codec is U48:
+            with self.fpga.batch() as b:
+                b.read(self.name, 4)
+                b.read(self._hipart, 4)
+            return self.codec.decode(b.results)
+        return self.codec.decode(self.fpga.read(self.name, 4))
+
+    def write(self, value, blindwrite=False):
+        try:
+            data = self.codec.encode(value)
+        except (ValueError, struct.error) as e:
+            raise ValueError('Can not write %r to %s: %s' % (value, self.name, e))
+        if self.codec is U48:
+            with self.fpga.batch() as b:
+                if blindwrite:
+                    b.blindwrite(self.name, data[0])
+                    b.blindwrite(self._hipart, data[1])
+                else:
+                    b.write(self.name, data[0])
+                    b.write(self._hipart, data[1])
+        elif blindwrite:
+            self.fpga.blindwrite(self.name, data)
+        else:
+            self.fpga.write(self.name, data)
+
+
+class RegisterGroup(object):
+    """Attribute access to the registers sharing a name prefix (e.g. 'u0_')."""
+
+    def __init__(self, prefix, registers):
+        object.__setattr__(self, '_prefix', prefix)
+        object.__setattr__(self, '_registers', registers)
+
+    def __repr__(self):
+        return 'RegisterGroup(%s: %s)' % (self._prefix, ', '.join(sorted(self._registers)))
+
+    def __dir__(self):
+        return sorted(self._registers)
+
+    def __contains__(self, name):
+        return name in self._registers
+
+    def __getitem__(self, name):
+        try:
+            return self._registers[name]
+        except KeyError:
+            raise KeyError('No register %s%s' % (self._prefix, name))
+
+    def __getattr__(self, name):
+        try:
+            register = self._registers[name]
+        except KeyError:
+            raise AttributeError('No register %s%s' % (self._prefix, name))
+        return register.read()
+
+    def __setattr__(self, name, value):
+        try:
+            register = self._registers[name]
+        except KeyError:
+            raise AttributeError('No register %s%s' % (self._prefix, name))
+        register.write(value)
+
+
+class RegisterMap(RegisterGroup):
+    """All registers of the running bitstream. Registers are reachable by full name
+       (regs.sys_clkcounter, regs['u0_acc_len']) and by group (regs.u0.acc_len).
+
+       @param fpga  FpgaClient object.
+       @param devices  List of strings: device names as returned by listdev (bytes are decoded).
+       """
+
+    def __init__(self, fpga, devices):
+        devices = set(name if isinstance(name, str) else name.decode('ascii') for name in devices)
+        registers = {}
+        groups = {}
+        for name in devices:
+            if name.endswith('_hipart') and name[:-len('_hipart')] in devices:
+                continue
+            if name + '_hipart' in devices:
+                codec = U48
+            else:
+                codec = U32
+                for pattern, layout in LAYOUTS:
+                    if fnmatch.fnmatchcase(name, pattern):
+                        codec = layout
+                        break
+            registers[name] = Register(fpga, name, codec)
+            prefix, sep, rest = name.partition('_')
+            if sep and rest:
+                groups.setdefault(prefix, {})[rest] = registers[name]
+        RegisterGroup.__init__(self, '', registers)
+        object.__setattr__(self, '_groups', dict((prefix, RegisterGroup(prefix + '_', members))
+                                                 for prefix, members in groups.items()))
+
+    def __repr__(self):
+        return 'RegisterMap(%i registers)' % len(self._registers)
+
+    def __dir__(self):
+        return sorted(set(self._registers) | set(self._groups))
+
+    def __getattr__(self, name):
+        if name in self._registers:
+            return self._registers[name].read()
+        try:
+            return self._groups[name]
+        except KeyError:
+            raise AttributeError('No register or register group %s' % name)
+
+
+def load(fpga, bitstream=None):
+    """Build the RegisterMap of a board, issuing listdev only for bitstreams not seen before.
+
+       @param fpga  FpgaClient object.
+       @param bitstream  String: name of the running bof file, None if unknown (always lists).
+       @return  RegisterMap object.
+       """
+    devices = _listdev_cache.get(bitstream) if bitstream else None
+    if devices is None:
+        devices = fpga.listdev()
+        if bitstream:
+            _listdev_cache[bitstream] = devices
+    return RegisterMap(fpga, devices)
@@ -0,0 +1,665 @@
+#!/usr/bin/env python
+"""Local stand-in for the tcpborphserver of a ROACH board.
+
+   Serves the KATCP requests FpgaClient uses (read, write, bulkread, listdev, listbof, progdev,
+   status, watchdog, tap-start, tap-stop, upload) from in-memory devices modelled on the
+   multibeam bitstream:
+
+     - 32 bit registers and BRAMs backed by bytearrays,
+     - sys_clkcounter counting at FPGA_CLOCK,
+     - snapshot blocks (zdok?_scope, u?_x4_vacc_scope_*) that fill with synthetic ADC samples and
+       accumulated spectra when armed,
+     - iic_adc0/1 controllers with the temperature sensor, EEPROM and RF frontend GPIO expanders
+       that katadc talks to,
+     - xgbe?_core 10GbE cores that tap-start fills in,
+     - dram_memory behind the dram_controller page register.
+
+   Every connection can be slowed down to look like a real board on a real network: replies are
+   held back by a fixed latency and the link carries at most a given number of bytes per second,
+   without serialising pipelined requests.
+
+       python roachsim.py --port 7147 --boards 13 --latency 0.0005 --bandwidth 10e6
+
+   starts 13 boards on ports 7147..7159. From Python:
+
+       boards = roachsim.start_boards(2)
+       fpga = katcp_wrapper.FpgaClient('127.0.0.1', boards[0].port)
+
+   Works with Python 2 and 3; needs numpy.
+"""
+
+from __future__ import print_function
+
+import argparse, collections, logging, re, socket, struct, threading, time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import numpy as np
+
+log = logging.getLogger('roachsim')
+
+FPGA_CLOCK = 250e6              # Hz
+SCOPE_IDLE_FLAG = 0x12345678
+BOF_FILES = ['mb8k_v1.163.bof', 'mb1k-v159.bof', 'mb2k-v159.bof', 'mb4k-v158.bof', 'mb8k-v159.bof']
+ADC_SCOPE_BYTES = 16384         # two interleaved 8 bit inputs
+SPEC_CHANNELS = 4096            # of an 8k bitstream; mb<n>k bitstreams have n * 512
+XGBE_CORE_BYTES = 0x4000
+DRAM_PAGE_SIZE = 64*1024*1024
+DRAM_BLOCK_SIZE = 1024*1024
+BULKREAD_PAGE = 4096
+IIC_OP_FIFO = 64
+IIC_RX_FIFO = 32
+
+_U32 = struct.Struct('>I')
+
+# ---------------------------------------------------------------------------------------------
+# KATCP encoding
+
+_ESCAPES = {b'\\': b'\\\\', b' ': b'\\_', b'\0': b'\\0', b'\n': b'\\n',
+            b'\r': b'\\r', b'\x1b': b'\\e', b'\t': b'\\t'}
+_UNESCAPES = dict((v[1:], k) for k, v in _ESCAPES.items())
+_UNESCAPES[b'@'] = b''
+_ESCAPE_RE = re.compile(b'[\\\\ \\0\\n\\r\\x1b\\t]')
+_UNESCAPE_RE = re.compile(b'\\\\(.)')
+_WHITESPACE_RE = re.compile(b'[ \\t]+')
+
+
+def _str(data):
+    """Native string from wire bytes."""
+    return data if str is bytes else data.decode('latin-1')
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('latin-1')
+
+
+def escape(arg):
+    arg = _bytes(arg)
+    if not arg:
+        return b'\\@'
+    return _ESCAPE_RE.sub(lambda m: _ESCAPES[m.group()], arg)
+
+
+def unescape(arg):
+    if b'\\' not in arg:
+        return arg
+    return _UNESCAPE_RE.sub(lambda m: _UNESCAPES[m.group(1)], arg)
+
+
+def format_message(mtype, name, mid, args):
+    head = mtype + _bytes(name) + (b'[' + mid + b']' if mid else b'')
+    return b' '.join([head] + [escape(a) for a in args]) + b'\n'
+
+
+def parse_request(line):
+    """Return (name, message id or None, args) of a request line, None for anything else."""
+    parts = _WHITESPACE_RE.split(line.strip(b' \t\r\n'))
+    if not parts[0].startswith(b'?'):
+        return None
+    name, _, mid = parts[0][1:].partition(b'[')
+    return _str(name), mid.rstrip(b']') or None, [unescape(a) for a in parts[1:]]
+
+
+class RequestFailed(Exception):
+    """Turned into a '!<request> fail <reason>' reply."""
+
+# ---------------------------------------------------------------------------------------------
+# Devices
+
+class Memory(object):
+    """Plain register or BRAM."""
+
+    def __init__(self, size, value=0):
+        self.data = bytearray(size)
+        if value:
+            self.data[0:4] = _U32.pack(value)
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def read(self, offset, size):
+        return bytes(self.data[offset:offset + size])
+
+    def write(self, offset, data):
+        self.data[offset:offset + len(data)] = data
+
+    def uint(self):
+        return _U32.unpack(bytes(self.data[0:4]))[0]
+
+
+class ClockCounter(object):
+    size = 4
+
+    def __init__(self):
+        self.start = time.time()
+
+    def read(self, offset, size):
+        return _U32.pack(int((time.time() - self.start) * FPGA_CLOCK) & 0xFFFFFFFF)[offset:offset + size]
+
+    def write(self, offset, data):
+        raise RequestFailed('read-only')
+
+
+class Dram(object):
+    """64MB window into the DRAM, moved with the dram_controller page register. Backing
+       store is allocated in blocks on first write, so unused DRAM costs nothing.
+       """
+    size = DRAM_PAGE_SIZE
+
+    def __init__(self, page_register):
+        self.page_register = page_register
+        self.blocks = {}
+
+    def _spans(self, offset, size):
+        address = self.page_register.uint() * DRAM_PAGE_SIZE + offset
+        end = address + size
+        while address < end:
+            block, local = divmod(address, DRAM_BLOCK_SIZE)
+            length = min(end - address, DRAM_BLOCK_SIZE - local)
+            yield block, local, length
+            address += length
+
+    def read(self, offset, size):
+        out = []
+        for block, local, length in self._spans(offset, size):
+            data = self.blocks.get(block)
+            out.append(bytes(data[local:local + length]) if data is not None else b'\0' * length)
+        return b''.join(out)
+
+    def write(self, offset, data):
+        position = 0
+        for block, local, length in self._spans(offset, len(data)):
+            if block not in self.blocks:
+                self.blocks[block] = bytearray(DRAM_BLOCK_SIZE)
+            self.blocks[block][local:local + length] = data[position:position + length]
+            position += length
+
+
+class Snapshot(object):
+    """Snapshot block: _ctrl, _status, _bram, _trig_offset, _tr_en_cnt and _val devices.
+
+       A rising edge on bit 0 of _ctrl starts a capture that takes duration() seconds; _status
+       has bit 31 set until then and the captured length afterwards. The BRAM is filled by
+       generate() when the capture completes.
+       """
+
+    def __init__(self, nbytes, generate, duration):
+        self.nbytes = nbytes
+        self.generate = generate
+        self.duration = duration
+        self.bram = Memory(nbytes)
+        self.ctrl = 0
+        self.done_at = None
+        self.captured = 0
+
+    def devices(self, name):
+        snapshot = self
+
+        class Ctrl(Memory):
+            def write(self, offset, data):
+                Memory.write(self, offset, data)
+                snapshot.set_ctrl(self.uint())
+
+        class Status(object):
+            size = 4
+            def read(self, offset, size):
+                return _U32.pack(snapshot.status())[offset:offset + size]
+            def write(self, offset, data):
+                raise RequestFailed('read-only')
+
+        class Count(Status):
+            def read(self, offset, size):
+                snapshot.status()
+                return _U32.pack(snapshot.captured)[offset:offset + size]
+
+        return {name + '_ctrl': Ctrl(4), name + '_status': Status(), name + '_bram': self.bram,
+                name + '_trig_offset': Memory(4), name + '_tr_en_cnt': Count(), name + '_val': Memory(4)}
+
+    def set_ctrl(self, value):
+        if value & 1 and not self.ctrl & 1:
+            self.done_at = time.time() + self.duration()
+            self.captured = 0
+        self.ctrl = value
+
+    def status(self):
+        if self.done_at is not None and time.time() >= self.done_at:
+            self.bram.data[:] = self.generate()
+            self.captured = self.nbytes
+            self.done_at = None
+        if self.done_at is not None:
+            return 0x80000000
+        return self.captured
+
+
+class IicController(object):
+    """OpenCores style IIC master as used on the KATADC.
+
+       0x0: op FIFO, byte 2 holds the RD/START/STOP/LOCK flags and byte 3 the data.
+       0x4: RX FIFO, reading pops one byte into byte 3.
+       0x8: status (bit 0 RX empty, 1 RX full, 2 RX overflow, 4 op empty, 5 op full,
+            6 op overflow, 8 NACK); writing clears the FIFOs and latches.
+       0xC: bit 0 blocks the op FIFO; ops run when it is released.
+       """
+    size = 16
+    RD, START, STOP = 0x1, 0x2, 0x4
+
+    def __init__(self, devices):
+        self.devices = devices      # IIC address -> bytearray of registers
+        self.ops = []
+        self.rx = collections.deque()
+        self.blocked = False
+        self.latches = 0
+        self.target = None
+        self.reading = False
+        self.pointer = None
+
+    def read(self, offset, size):
+        if offset == 0x4:
+            value = self.rx.popleft() if self.rx else 0
+        elif offset == 0x8:
+            value = (self.latches | (not self.rx) | (len(self.rx) >= IIC_RX_FIFO) << 1
+                     | (not self.ops) << 4 | (len(self.ops) >= IIC_OP_FIFO) << 5)
+        elif offset == 0xC:
+            value = int(self.blocked)
+        else:
+            value = 0
+        return _U32.pack(value)[:size]
+
+    def write(self, offset, data):
+        value = _U32.unpack(bytes(data[0:4]))[0]
+        if offset == 0x0:
+            if len(self.ops) >= IIC_OP_FIFO:
+                self.latches |= 0x40
+            else:
+                self.ops.append(((value >> 8) & 0xFF, value & 0xFF))
+            if not self.blocked:
+                self.run()
+        elif offset == 0x8:
+            self.ops = []
+            self.rx.clear()
+            self.latches = 0
+        elif offset == 0xC:
+            self.blocked = bool(value & 1)
+            if not self.blocked:
+                self.run()
+
+    def run(self):
+        for flags, byte in self.ops:
+            if flags & self.START:
+                address, self.reading = byte >> 1, bool(byte & 1)
+                self.target = self.devices.get(address)
+                if self.target is None:
+                    self.latches |= 0x100
+                if not self.reading:
+                    self.pointer = None
+            elif self.target is None:
+                pass
+            elif flags & self.RD:
+                if len(self.rx) >= IIC_RX_FIFO:
+                    self.latches |= 0x4
+                else:
+                    self.rx.append(self.target[(self.pointer or 0) % len(self.target)])
+                self.pointer = (self.pointer or 0) + 1
+            elif self.pointer is None:
+                self.pointer = byte
+            else:
+                self.target[self.pointer % len(self.target)] = byte
+                self.pointer += 1
+            if flags & self.STOP:
+                self.target = None
+        self.ops = []
+
+
+def katadc_iic_devices(serial_number):
+    """IIC devices on a KATADC: TMP421 sensor, EEPROM and the two RF frontend GPIO expanders."""
+    tmp421 = bytearray(256)
+    tmp421[0x00], tmp421[0x10] = 38, 0x80       # ambient 38.5 degC
+    tmp421[0x01], tmp421[0x11] = 52, 0x40       # ADC 52.25 degC
+    eeprom = bytearray(256)
+    eeprom[0:16] = struct.pack('>8H', serial_number, 2, 0x0152, 1, 0, 0, 0, 0)
+    return {0x4C: tmp421, 0x51: eeprom, 0x20: bytearray(8), 0x21: bytearray(8)}
+
+# ---------------------------------------------------------------------------------------------
+# Board
+
+def spec_channels(bitstream):
+    """Channels per spectrum scope of a bitstream: mb1k..mb8k give 512..4096, others SPEC_CHANNELS."""
+    match = re.match(r'mb(\d+)k', bitstream or '')
+    return int(match.group(1)) * 512 if match else SPEC_CHANNELS
+
+
+class Board(object):
+    """State of one simulated ROACH running the multibeam bitstream.
+
+       @param name  String: label used in log messages.
+       @param seed  Integer: seed of the synthetic data.
+       """
+
+    def __init__(self, name='roach', seed=0):
+        self.name = name
+        self.lock = threading.Lock()
+        self.random = np.random.RandomState(seed)
+        self.serial_number = 1745 + seed
+        self.bof_files = list(BOF_FILES)
+        self.bitstream = None
+        self.devices = {}
+        self.taps = {}
+        self.program(self.bof_files[0])
+
+    def program(self, bitstream):
+        self.bitstream = bitstream
+        self.channels = spec_channels(bitstream)
+        self.devices = {}
+        self.taps = {}
+        if not bitstream:
+            return
+        d = self.devices
+        d['sys_board_id'] = Memory(4, 0xB0A7)
+        d['sys_rev'] = Memory(4, 0x10000)
+        d['sys_rev_rcs'] = Memory(4)
+        # Nobody holds the scope lock on a fresh board
+        d['sys_scratchpad'] = Memory(4, SCOPE_IDLE_FLAG)
+        d['sys_clkcounter'] = ClockCounter()
+        d['rcs_id'] = Memory(4, 0x163)
+        d['rcs_ver'] = Memory(4, 0x2012)
+        d['rcs_timestamp'] = Memory(4, 1609459200)
+        d['reset'] = Memory(4)
+        d['use_tvg'] = Memory(4)
+        for reg in ('noisecal_delay', 'noisecal_on', 'noisecal_off'):
+            d[reg] = Memory(4)
+            d[reg + '_hipart'] = Memory(4)
+        for unit in (0, 1):
+            prefix = 'u%d_' % unit
+            d[prefix + 'beam_id'] = Memory(4, unit + 1)
+            d[prefix + 'fft_shift'] = Memory(4, 0xFFFF)
+            d[prefix + 'gain'] = Memory(4, 0x01000100)
+            d[prefix + 'acc_len'] = Memory(4, 100)
+            d[prefix + 'bit_select'] = Memory(4, 0x55)
+            for pol, stokes in enumerate(('AA', 'BB', 'CR', 'CI')):
+                snap = Snapshot(self.channels * 4, self._spectrum_generator(unit, stokes),
+                                self._accumulation_time(unit))
+                d.update(snap.devices(prefix + 'x4_vacc_scope_' + stokes))
+            snap = Snapshot(ADC_SCOPE_BYTES, self._adc_generator(unit), lambda: ADC_SCOPE_BYTES / 2 / FPGA_CLOCK)
+            d.update(snap.devices('zdok%d_scope' % unit))
+            d['iic_adc%d' % unit] = IicController(katadc_iic_devices(self.serial_number))
+        d['kat_adc_controller'] = Memory(16)
+        for core in range(8):
+            d['xgbe%d_core' % core] = Memory(XGBE_CORE_BYTES)
+            d['xgbe%d_core' % core].write(0x34, _U32.pack(0xFFFFFFFF))     # multicast RX mask: none
+            d['xgbe%d_dest_ip' % core] = Memory(4)
+            d['xgbe%d_dest_port' % core] = Memory(4)
+        d['dram_controller'] = Memory(4)
+        d['dram_memory'] = Dram(d['dram_controller'])
+
+    def _accumulation_time(self, unit):
+        acc_len = 'u%d_acc_len' % unit
+        return lambda: self.devices[acc_len].uint() * self.channels * 2 / FPGA_CLOCK
+
+    def _adc_generator(self, unit):
+        samples = ADC_SCOPE_BYTES // 2
+        t = np.arange(samples)
+        tone = 30 * np.sin(2 * np.pi * (0.0123 + 0.01 * unit) * t)
+        def generate():
+            pols = [np.clip(tone + self.random.normal(0, 12 + 4 * p, samples), -128, 127).astype(np.int8)
+                    for p in (0, 1)]
+            # 4 samples of input 0, then 4 of input 1, and so on
+            return np.stack([p.reshape(-1, 4) for p in pols], axis=1).tobytes()
+        return generate
+
+    def _spectrum_generator(self, unit, stokes):
+        count = self.channels
+        channels = np.arange(count)
+        bandpass = 2e4 * (1.2 - np.cos(2 * np.pi * channels / count)) + 5e3
+        bandpass[count // 3] *= 40
+        acc_len, use_tvg = 'u%d_acc_len' % unit, 'use_tvg'
+        def generate():
+            n = max(1, self.devices[acc_len].uint())
+            if self.devices[use_tvg].uint() & (1 << unit):
+                spectrum = channels * n
+            elif stokes in ('AA', 'BB'):
+                spectrum = bandpass * n * (1 + self.random.normal(0, 1.0 / np.sqrt(n), count))
+            else:
+                spectrum = self.random.normal(0, 0.1, count) * bandpass * np.sqrt(n)
+            return np.clip(spectrum, -2**31, 2**31 - 1).astype('>i4').tobytes()
+        return generate
+
+    def device(self, name, offset, size):
+        dev = self.devices.get(_str(name))
+        if dev is None:
+            raise RequestFailed('unable to find %s' % _str(name))
+        if offset < 0 or size < 0 or offset + size > dev.size:
+            raise RequestFailed('%s: %i bytes at offset %i exceed size %i' % (_str(name), size, offset, dev.size))
+        return dev
+
+    # Request handlers return (reply args, list of inform args lists)
+
+    def request_read(self, name, offset, size):
+        offset, size = int(offset), int(size)
+        return [b'ok', self.device(name, offset, size).read(offset, size)], []
+
+    def request_bulkread(self, name, offset, size):
+        offset, size = int(offset), int(size)
+        data = self.device(name, offset, size).read(offset, size)
+        pages = [[data[i:i + BULKREAD_PAGE]] for i in range(0, len(data), BULKREAD_PAGE)]
+        return [b'ok', len(pages)], pages
+
+    def request_write(self, name, offset, data):
+        offset = int(offset)
+        self.device(name, offset, len(data)).write(offset, data)
+        return [b'ok'], []
+
+    def request_listdev(self):
+        return [b'ok', len(self.devices)], [[name] for name in sorted(self.devices)]
+
+    def request_listbof(self):
+        return [b'ok', len(self.bof_files)], [[name] for name in self.bof_files]
+
+    def request_progdev(self, bitstream=b''):
+        bitstream = _str(bitstream)
+        if bitstream and bitstream not in self.bof_files:
+            raise RequestFailed('no such bof file %s' % bitstream)
+        self.program(bitstream)
+        return [b'ok'], []
+
+    def request_status(self):
+        if not self.bitstream:
+            raise RequestFailed('fpga not programmed')
+        return [b'ok', b'ready'], []
+
+    def request_watchdog(self):
+        return [b'ok'], []
+
+    def request_tap_start(self, tap_dev, device, ip, port, mac):
+        core = self.device(device, 0, 0x24)
+        ip_word = _U32.unpack(socket.inet_aton(_str(ip)))[0]
+        mac_word = int(_str(mac).replace(':', ''), 16)
+        core.write(0x00, struct.pack('>HHI', 0, mac_word >> 32, mac_word & 0xFFFFFFFF))
+        core.write(0x0C, _U32.pack(ip_word & 0xFFFFFF00 | 1))
+        core.write(0x10, _U32.pack(ip_word))
+        core.write(0x20, struct.pack('>BBH', 0, 1, int(port)))
+        core.write(0x24, _U32.pack(0x7C))
+        self.taps[_str(tap_dev)] = _str(device)
+        return [b'ok'], []
+
+    def request_tap_stop(self, tap_dev):
+        if self.taps.pop(_str(tap_dev), None) is None:
+            raise RequestFailed('no tap instance %s' % _str(tap_dev))
+        return [b'ok'], []
+
+    def request_upload(self, port, timeout=30.0):
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('', int(port)))
+        listener.listen(1)
+        listener.settimeout(float(timeout))
+        try:
+            conn, addr = listener.accept()
+        except socket.timeout:
+            raise RequestFailed('upload timed out')
+        finally:
+            listener.close()
+        size = 0
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            size += len(chunk)
+        conn.close()
+        log.info('%s: received %i byte bof upload', self.name, size)
+        self.program('uploaded.bof')
+        return [b'ok'], []
+
+    def handle(self, name, args):
+        """Run one request. Returns (reply args, informs); failures become a fail reply."""
+        handler = getattr(self, 'request_' + name.replace('-', '_'), None)
+        if handler is None:
+            return [b'invalid', b'unknown request %s' % _bytes(name)], []
+        try:
+            if name == 'upload':
+                return handler(*args)
+            with self.lock:
+                return handler(*args)
+        except RequestFailed as e:
+            return [b'fail', _bytes(e)], []
+        except Exception as e:
+            log.exception('%s: request %s failed', self.name, name)
+            return [b'fail', _bytes('%s: %s' % (type(e).__name__, e))], []
+
+# ---------------------------------------------------------------------------------------------
+# Server
+
+class KatcpHandler(socketserver.StreamRequestHandler):
+    """One client connection. With latency or bandwidth set, replies go out from a separate
+       thread at the time the modelled link would deliver them.
+       """
+
+    def handle(self):
+        server = self.server
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.outbox = collections.deque()
+        self.ready = threading.Condition()
+        self.last_due = 0
+        self.closed = False
+        delayed = server.latency > 0 or server.bandwidth > 0
+        if delayed:
+            sender = threading.Thread(target=self.send_replies)
+            sender.daemon = True
+            sender.start()
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                request = parse_request(line)
+                if request is None:
+                    continue
+                name, mid, args = request
+                t_rx = time.time()
+                reply, informs = server.board.handle(name, args)
+                data = b''.join([format_message(b'#', name, mid, i) for i in informs]
+                                + [format_message(b'!', name, mid, reply)])
+                if delayed:
+                    self.queue(t_rx, len(line), data)
+                else:
+                    self.wfile.write(data)
+        except (socket.error, IOError):
+            pass
+        finally:
+            with self.ready:
+                self.closed = True
+                self.ready.notify()
+
+    def queue(self, t_rx, nbytes_in, data):
+        server = self.server
+        transfer = float(nbytes_in + len(data)) / server.bandwidth if server.bandwidth > 0 else 0
+        due = max(t_rx + server.latency, self.last_due) + transfer
+        self.last_due = due
+        with self.ready:
+            self.outbox.append((due, data))
+            self.ready.notify()
+
+    def send_replies(self):
+        while True:
+            with self.ready:
+                while not self.outbox and not self.closed:
+                    self.ready.wait()
+                if not self.outbox:
+                    return
+                due, data = self.outbox.popleft()
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except (socket.error, IOError):
+                return
+
+
+class RoachServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """KATCP server for one Board.
+
+       @param board  Board object.
+       @param port  Integer: TCP port, 0 to pick a free one.
+       @param latency  Float: seconds added to every reply.
+       @param bandwidth  Float: link bytes per second, 0 for unlimited.
+       """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, board, port=0, host='127.0.0.1', latency=0.0, bandwidth=0.0):
+        self.board = board
+        self.latency = latency
+        self.bandwidth = bandwidth
+        socketserver.TCPServer.__init__(self, (host, port), KatcpHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serve from a daemon thread and return self."""
+        thread = threading.Thread(target=self.serve_forever, name='roachsim-%s' % self.board.name)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def start_boards(count, port=0, host='127.0.0.1', latency=0.0, bandwidth=0.0):
+    """Start count simulated boards in daemon threads.
+
+       @param count  Integer: number of boards.
+       @param port  Integer: port of the first board, the others follow; 0 picks free ports.
+       @return  List of RoachServer objects; their port attribute holds the port.
+       """
+    servers = []
+    for i in range(count):
+        board = Board('sim%d' % i, seed=i)
+        servers.append(RoachServer(board, port + i if port else 0, host, latency, bandwidth).start())
+    return servers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate ROACH boards running the multibeam bitstream.')
+    parser.add_argument('-p', '--port', type=int, default=7147, help='port of the first board')
+    parser.add_argument('-n', '--boards', type=int, default=1, help='number of boards')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('-l', '--latency', type=float, default=0.0, help='seconds added to every reply')
+    parser.add_argument('-b', '--bandwidth', type=float, default=0.0, help='link bytes per second, 0 for unlimited')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s - %(levelname)s - %(message)s')
+    servers = start_boards(args.boards, args.port, args.host, args.latency, args.bandwidth)
+    for server in servers:
+        log.info('%s listening on %s:%d', server.board.name, args.host, server.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
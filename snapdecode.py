@@ -0,0 +1,97 @@
+"""Decode snap block captures of the multibeam bitstream into numpy arrays.
+
+   Every scope has a ScopeLayout, found by matching its name against LAYOUTS:
+
+       snap = fpga.snapshot_get('u0_x4_vacc_scope_AA', man_valid=True)
+       spec = snapdecode.decode('u0_x4_vacc_scope_AA', snap)        # '>u4' view of the BRAM
+       adc0, adc1 = snapdecode.decode('zdok0_scope', fpga.snapshot_get('zdok0_scope', man_trig=True, man_valid=True))
+
+   Single input scopes decode to a read-only np.frombuffer view of the captured data, so no
+   copy is made. Interleaved scopes (the ADC scopes hold 4 samples of input 0, then 4 of input
+   1, and so on) are split with a strided reshape and each input is then made contiguous in one
+   vectorised copy, widened so histogramming cannot overflow.
+"""
+
+from __future__ import print_function
+
+import fnmatch
+
+import numpy as np
+
+
+class ScopeLayout(object):
+    """How the BRAM of a snap block is laid out.
+
+       @param dtype  Numpy dtype or string: sample type as stored by the FPGA (big-endian for words).
+       @param inputs  Integer: number of interleaved inputs.
+       @param interleave  Integer: consecutive samples of one input before the next input follows.
+       @param widen  Numpy dtype: type the inputs of an interleaved scope are converted to, None to keep dtype.
+       """
+    __slots__ = ('dtype', 'inputs', 'interleave', 'widen')
+
+    def __init__(self, dtype, inputs=1, interleave=1, widen=None):
+        self.dtype = np.dtype(dtype)
+        self.inputs = inputs
+        self.interleave = interleave
+        self.widen = widen
+
+    def __repr__(self):
+        return 'ScopeLayout(%s, inputs=%i, interleave=%i)' % (self.dtype.str, self.inputs, self.interleave)
+
+    def decode(self, data, length=None):
+        """Return a view of data for single input scopes, a tuple of arrays (one per input) otherwise.
+
+           @param data  String or buffer: captured BRAM contents.
+           @param length  Integer: bytes of data to use, default all.
+           """
+        count = -1 if length is None else length // self.dtype.itemsize
+        samples = np.frombuffer(data, self.dtype, count)
+        if self.inputs == 1:
+            return samples
+        # (blocks, inputs, interleave) view; input i is [:, i, :]
+        blocks = samples.reshape(-1, self.inputs, self.interleave)
+        dtype = self.widen or self.dtype
+        return tuple(blocks[:, i, :].astype(dtype).reshape(-1) for i in range(self.inputs))
+
+
+# Scope name pattern -> layout, first match wins
+LAYOUTS = [
+    ('zdok?_scope', ScopeLayout(np.int8, inputs=2, interleave=4, widen=np.int16)),
+    ('u?_x4_vacc_scope_AA', ScopeLayout('>u4')),
+    ('u?_x4_vacc_scope_BB', ScopeLayout('>u4')),
+    ('u?_x4_vacc_scope_CR', ScopeLayout('>i4')),
+    ('u?_x4_vacc_scope_CI', ScopeLayout('>i4')),
+]
+
+_layout_cache = {}
+
+
+def register(pattern, layout):
+    """Add a layout for scopes matching pattern, taking precedence over the existing ones."""
+    LAYOUTS.insert(0, (pattern, layout))
+    _layout_cache.clear()
+
+
+def layout(name):
+    """Return the ScopeLayout of the named scope. Raise KeyError for unknown scopes."""
+    try:
+        return _layout_cache[name]
+    except KeyError:
+        pass
+    for pattern, scope_layout in LAYOUTS:
+        if fnmatch.fnmatchcase(name, pattern):
+            _layout_cache[name] = scope_layout
+            return scope_layout
+    raise KeyError('No layout registered for scope %s' % name)
+
+
+def decode(name, snap):
+    """Decode a capture of the named scope.
+
+       @param name  String: snap block name, e.g. 'zdok0_scope'.
+       @param snap  Dictionary returned by FpgaClient.snapshot_get, or the raw data.
+       @return  Numpy array, or a tuple of arrays for interleaved scopes.
+       """
+    if isinstance(snap, dict):
+        return layout(name).decode(snap['data'], snap['length'])
+    return layout(name).decode(snap)
@@ -0,0 +1,148 @@
+"""Keep the most recent captures of every scope in fixed size, preallocated numpy rings.
+
+   One acquisition thread appends, any number of consumers read:
+
+       ring = SnapshotRing(depth=64)
+       ring.append(('r1745', 0, 'AA'), spectrum)              # timestamp defaults to now
+       t, spec = ring.latest(('r1745', 0, 'AA'))
+       times, specs = ring.since(('r1745', 0, 'AA'), t_last)  # captures newer than t_last
+       times, specs = ring.window(('r1745', 0, 'AA'), t0, t1)
+
+   Every capture is stored twice, at slot i and slot i + depth + 1 of an array of 2 * (depth + 1)
+   rows, so any run of up to depth consecutive captures is one contiguous slice. Queries therefore
+   return views of the ring, never copies; the spare slot is the one being written, so a view never
+   shows a capture that is being overwritten. A view stays valid until the captures it shows are
+   evicted; consumers that keep results longer than depth - len(result) appends must copy them.
+"""
+
+from __future__ import print_function
+
+import time
+import threading
+
+import numpy as np
+
+
+class ScopeRing(object):
+    """The last depth captures of one scope, each with its timestamp.
+
+       @param shape  Tuple: shape of one capture.
+       @param dtype  Numpy dtype of the captures.
+       @param depth  Integer: number of captures kept.
+       """
+    def __init__(self, shape, dtype, depth):
+        self.depth = depth
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self._slots = depth + 1     # one spare slot, the one append is writing
+        self._data = np.zeros((2 * self._slots,) + self.shape, self.dtype)
+        self._times = np.zeros(2 * self._slots)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.depth)
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes + self._times.nbytes
+
+    def append(self, data, timestamp=None):
+        """Store a capture, evicting the oldest one when the ring is full."""
+        if timestamp is None:
+            timestamp = time.time()
+        i = self.count % self._slots
+        self._data[i] = data
+        self._data[i + self._slots] = data
+        self._times[i] = self._times[i + self._slots] = timestamp
+        with self._lock:
+            self.count += 1
+
+    def _span(self):
+        # Slice of the last len(self) captures, oldest first. It never includes the spare slot
+        with self._lock:
+            count = self.count
+        n = min(count, self.depth)
+        end = (count - 1) % self._slots + self._slots + 1 if count else 0
+        return slice(end - n, end)
+
+    def latest(self):
+        """Return (timestamp, capture) of the newest capture, (None, None) while empty."""
+        span = self._span()
+        if span.start == span.stop:
+            return None, None
+        return self._times[span.stop - 1], self._data[span.stop - 1]
+
+    def all(self):
+        """Return (timestamps, captures) of everything held, oldest first."""
+        span = self._span()
+        return self._times[span], self._data[span]
+
+    def since(self, t):
+        """Return (timestamps, captures) taken after t."""
+        span = self._span()
+        times = self._times[span]
+        first = span.start + np.searchsorted(times, t, 'right')
+        return self._times[first:span.stop], self._data[first:span.stop]
+
+    def window(self, t0, t1):
+        """Return (timestamps, captures) taken at t0 or later but before t1."""
+        span = self._span()
+        times = self._times[span]
+        first, last = span.start + np.searchsorted(times, (t0, t1), 'left')
+        return self._times[first:last], self._data[first:last]
+
+
+class SnapshotRing(object):
+    """A ScopeRing per key, typically (board, unit, scope), created on the first append.
+
+       @param depth  Integer: captures kept per key.
+       """
+    def __init__(self, depth=64):
+        self.depth = depth
+        self.rings = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.rings
+
+    def keys(self):
+        return list(self.rings)
+
+    @property
+    def nbytes(self):
+        return sum(ring.nbytes for ring in list(self.rings.values()))
+
+    def ring(self, key):
+        """Return the ScopeRing of key. Raise KeyError if nothing was appended to it yet."""
+        return self.rings[key]
+
+    def append(self, key, data, timestamp=None):
+        """Store a capture under key. Its shape and dtype must match the earlier ones."""
+        data = np.asarray(data)
+        try:
+            ring = self.rings[key]
+        except KeyError:
+            with self._lock:
+                ring = self.rings.setdefault(key, ScopeRing(data.shape, data.dtype, self.depth))
+        if data.shape != ring.shape:
+            raise ValueError('Capture for %s has shape %s, ring holds %s' % (key, data.shape, ring.shape))
+        ring.append(data, timestamp)
+
+    def discard(self, key):
+        """Forget the captures of key, releasing its memory."""
+        with self._lock:
+            self.rings.pop(key, None)
+
+    def latest(self, key):
+        """Return (timestamp, capture) of the newest capture of key, (None, None) if there is none."""
+        ring = self.rings.get(key)
+        return ring.latest() if ring else (None, None)
+
+    def since(self, key, t):
+        """Return (timestamps, captures) of key taken after t."""
+        return self.rings[key].since(t)
+
+    def window(self, key, t0, t1):
+        """Return (timestamps, captures) of key taken at t0 or later but before t1."""
+        return self.rings[key].window(t0, t1)